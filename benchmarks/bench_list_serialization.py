@@ -0,0 +1,40 @@
+"""Requests per second of GET /posts and GET /users pages through pydantic models and response_model,
+and with FAST_JSON_RESPONSES, which serializes DB rows directly. App is called in-process.
+
+python -m benchmarks.bench_list_serialization"""
+import asyncio
+import time
+
+from benchmarks.common import seeded_engine, web_api_app, use_database, asgi_request
+
+ROWS_COUNT = 10_000
+PAGE_SIZE = 1000
+REQUESTS = 50
+
+
+async def requests_per_second(app, path: str) -> float:
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        status_code, _ = await asgi_request(app, 'GET', path, f'limit={PAGE_SIZE}')
+        assert status_code == 200
+    return REQUESTS / (time.perf_counter() - start)
+
+
+async def main():
+    app = web_api_app()
+    from blog.api.v1 import fast_json
+    engine = await seeded_engine(posts_count=ROWS_COUNT, users_count=ROWS_COUNT)
+    use_database(app, engine)
+    print(f'pages of {PAGE_SIZE} rows, requests/s')
+    print(f'{"":>14} {"pydantic":>9} {"fast json":>10}')
+    for path in ('/api/v1/posts', '/api/v1/users'):
+        fast_json.fast_json_settings.FAST_JSON_RESPONSES = False
+        slow = await requests_per_second(app, path)
+        fast_json.fast_json_settings.FAST_JSON_RESPONSES = True
+        fast = await requests_per_second(app, path)
+        print(f'{path:>14} {slow:>9.1f} {fast:>10.1f}')
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
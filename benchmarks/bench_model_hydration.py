@@ -0,0 +1,44 @@
+"""Compares per row cost of building Post and User models from DB rows with validation and without it,
+as the model layer does for rows read from the database.
+
+python -m benchmarks.bench_model_hydration"""
+import timeit
+
+from blog.model import post, user
+
+ROWS = 10_000
+REPEAT = 5
+
+
+def _validated_post(row) -> post.Post:
+    post_id, user_id, title, body = row
+    return post.Post(author_id=user_id, post_id=post_id, post_info=post.PostInfo(title=title, body=body))
+
+
+def _validated_user(row) -> user.User:
+    user_id, username, name, surname, email, password_hash = row
+    return user.User(user_id=user_id,
+                     user_info=user.UserInfo(username=username, name=name, surname=surname, email=email),
+                     password_hash=password_hash)
+
+
+def _per_row_us(make, rows) -> float:
+    seconds = min(timeit.repeat(lambda: [make(row) for row in rows], number=1, repeat=REPEAT))
+    return seconds / len(rows) * 1e6
+
+
+def main():
+    post_rows = [(i, i % 100 + 1, f'title {i}', 'Some body text ' * 10) for i in range(1, ROWS + 1)]
+    user_rows = [(i, f'user{i}', f'name{i}', f'surname{i}', f'user{i}@example.com', 'hash' * 8)
+                 for i in range(1, ROWS + 1)]
+    assert _validated_post(post_rows[0]) == post._post_from_row(post_rows[0])
+    assert _validated_user(user_rows[0]) == user._user_from_row(user_rows[0])
+    print(f'{ROWS} rows page')
+    for name, validated, trusted, rows in (('post', _validated_post, post._post_from_row, post_rows),
+                                           ('user', _validated_user, user._user_from_row, user_rows)):
+        print(f'{name} validated: {_per_row_us(validated, rows):8.2f} us/row')
+        print(f'{name} trusted:   {_per_row_us(trusted, rows):8.2f} us/row')
+
+
+if __name__ == '__main__':
+    main()
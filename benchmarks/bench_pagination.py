@@ -0,0 +1,30 @@
+"""Compares page latency of LIMIT/OFFSET and keyset (cursor) pagination for GET /posts.
+OFFSET latency grows with page number, keyset latency stays flat.
+
+python -m benchmarks.bench_pagination"""
+import asyncio
+
+from benchmarks.common import seeded_engine, median_seconds
+from blog.model import post
+
+POSTS_COUNT = 200_000
+PAGE_SIZE = 10
+
+
+async def main():
+    engine = await seeded_engine(posts_count=POSTS_COUNT)
+    async with engine.connect() as connection:
+        print(f'{"page":>8} {"skip, ms":>10} {"cursor, ms":>11}')
+        for page in (1, 100, 1000, 10_000, POSTS_COUNT // PAGE_SIZE - 1):
+            skip = (page - 1) * PAGE_SIZE
+            offset_time = await median_seconds(
+                lambda: post.get_all_posts_async(connection, skip=skip, limit=PAGE_SIZE))
+            # after_post_id is what the cursor of the previous page decodes to
+            keyset_time = await median_seconds(
+                lambda: post.get_posts_after_async(connection, after_post_id=skip, limit=PAGE_SIZE))
+            print(f'{page:>8} {offset_time * 1000:>10.3f} {keyset_time * 1000:>11.3f}')
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
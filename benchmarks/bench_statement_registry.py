@@ -0,0 +1,63 @@
+"""Per call cost of building the statements of the hot GET paths with text() on every call,
+as the model layer did, compared to the statements built once in blog.model.statements.
+Compiling a statement happens once per dialect either way, SQLAlchemy finds it in the compiled cache.
+
+python -m benchmarks.bench_statement_registry"""
+import asyncio
+import timeit
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import asyncpg
+
+from benchmarks.common import seeded_engine, median_seconds
+from blog.model import post, statements
+
+# statements of GET /posts/{post_id}, GET /posts and GET /posts?ids=
+HOT_STATEMENTS = ['post.get_post_with_version', 'post.get_post_version', 'post.get_all_posts_rows',
+                  'post.get_posts_after_rows', 'post.get_posts_with_versions']
+NUMBER = 10_000
+POSTS_COUNT = 1000
+CALLS = 1000
+
+
+def _rebuilt(name: str):
+    """the statement as it was built on every call"""
+    statement = statements.registry[name]
+    return lambda: text(statement.text).bindparams(*(bind for bind in statement._bindparams.values() if bind.expanding))
+
+
+def _per_call_us(call, number: int = NUMBER) -> float:
+    return min(timeit.repeat(call, number=number, repeat=5)) / number * 1e6
+
+
+async def _execute_us(connection, make_statement) -> float:
+    async def calls():
+        for post_id in range(1, CALLS + 1):
+            async with connection.begin():
+                result = await connection.execute(make_statement(), parameters={'post_id': post_id})
+                result.fetchone()
+    return await median_seconds(calls, repeat=5) / CALLS * 1e6
+
+
+async def main():
+    dialect = asyncpg.dialect()
+    print('client side cost per call of the hot GET statements')
+    for name in HOT_STATEMENTS:
+        statement = statements.registry[name]
+        print(f'{name:30} text() on every call: {_per_call_us(_rebuilt(name)):6.2f} us, '
+              f'compile (once per dialect): {_per_call_us(lambda: statement.compile(dialect=dialect), 1000):6.2f} us')
+
+    engine = await seeded_engine(posts_count=POSTS_COUNT, users_count=10)
+    async with engine.connect() as connection:
+        rebuilt, registered = [], []
+        for _ in range(3):  # alternated, so that both see the same warm caches
+            rebuilt.append(await _execute_us(connection, _rebuilt('post.get_post_with_version')))
+            registered.append(await _execute_us(connection, lambda: post._GET_POST_WITH_VERSION))
+    await engine.dispose()
+    print(f'get_post_with_version on in-memory sqlite, {CALLS} calls')
+    print(f'text() on every call: {min(rebuilt):6.2f} us/call')
+    print(f'registered:           {min(registered):6.2f} us/call')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
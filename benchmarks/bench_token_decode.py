@@ -0,0 +1,23 @@
+"""Compares cost of verifying the same JWT token again (cold) and taking it from verified token cache (warm).
+
+python -m benchmarks.bench_token_decode"""
+import timeit
+
+import blog.model.auth.user_token as user_token
+
+REPEAT = 20_000
+
+
+def main():
+    token_settings = user_token.TokenSettings(JWT_SECRET_KEY='secret key',
+                                              JWT_ENCODE_ALGORITHM='HS256',
+                                              JWT_ACCESS_TOKEN_EXPIRE_MINUTES=30)
+    token = user_token._create_access_token(data={"sub": "1"}, token_settings=token_settings)
+    cold = timeit.timeit(lambda: user_token.decode_token_to_user_id(token, token_settings), number=REPEAT)
+    warm = timeit.timeit(lambda: user_token.decode_token_to_user_id_cached(token, token_settings), number=REPEAT)
+    print(f'cold decode: {cold / REPEAT * 1e6:8.2f} us/token')
+    print(f'warm decode: {warm / REPEAT * 1e6:8.2f} us/token')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""Users per second of one-by-one user.create_user_async and bulk user.import_users_async.
+On postgres (BENCH_DATABASE_URL, empty scratch database) bulk import loads rows with COPY,
+on the default in-memory sqlite it falls back to executemany INSERT.
+
+python -m benchmarks.bench_user_import"""
+import asyncio
+import os
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from benchmarks.common import CREATE_USER_TABLE
+from blog.model import user
+
+USERS_COUNT = 2000
+
+
+def users_data(prefix: str) -> list[user.UserCreationData]:
+    return [user.UserCreationData(password=f'password{i}',
+                                  user_info=user.UserInfo(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com'))
+            for i in range(USERS_COUNT)]
+
+
+async def main():
+    engine = create_async_engine(os.environ.get('BENCH_DATABASE_URL', 'sqlite+aiosqlite://'))
+    async with engine.begin() as connection:
+        await connection.execute(text(CREATE_USER_TABLE))
+    async with engine.connect() as connection:
+        start = time.perf_counter()
+        for user_data in users_data('one_by_one'):
+            await user.create_user_async(connection, user_data)
+        one_by_one_seconds = time.perf_counter() - start
+        report = await user.import_users_async(connection, users_data('bulk'))
+    print(f'one by one: {USERS_COUNT / one_by_one_seconds:10.0f} users/s')
+    print(f'bulk:       {report.users_per_second:10.0f} users/s')
+    async with engine.begin() as connection:
+        await connection.execute(text('DROP TABLE blog_user'))
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
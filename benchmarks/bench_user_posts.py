@@ -0,0 +1,38 @@
+"""Latency of a page of posts by one author, GET /users/{user_id}/posts,
+without and with (user_id, post_id) index from blog_008 migration.
+
+python -m benchmarks.bench_user_posts"""
+import asyncio
+
+from sqlalchemy import text
+
+from benchmarks.common import seeded_engine, median_seconds
+from blog.model import post
+
+POSTS_COUNT = 1_000_000
+USERS_COUNT = 1000
+PAGE_SIZE = 10
+
+
+async def main():
+    engine = await seeded_engine(posts_count=POSTS_COUNT, users_count=USERS_COUNT, body='body')
+    async with engine.connect() as connection:
+        def page(user_id: int):
+            return lambda: post.get_user_posts_async(connection, user_id=user_id, limit=PAGE_SIZE)
+
+        # posts of every user are spread evenly, primary key scan stops after PAGE_SIZE matches;
+        # an author without posts (or a cascade delete) scans the whole table
+        cases = {'typical author': page(USERS_COUNT // 2), 'author without posts': page(USERS_COUNT + 1)}
+        without_index = {name: await median_seconds(case, repeat=5) for name, case in cases.items()}
+        async with connection.begin():
+            await connection.execute(text('CREATE INDEX blog_post_user_id_post_id_idx ON blog_post (user_id, post_id)'))
+        with_index = {name: await median_seconds(case, repeat=20) for name, case in cases.items()}
+    print(f'{POSTS_COUNT} posts, first page of {PAGE_SIZE} posts of one author')
+    print(f'{"":>22} {"no index, ms":>13} {"index, ms":>10}')
+    for name in cases:
+        print(f'{name:>22} {without_index[name] * 1000:>13.3f} {with_index[name] * 1000:>10.3f}')
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
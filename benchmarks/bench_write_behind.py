@@ -0,0 +1,49 @@
+"""Throughput of concurrent post creation with a transaction per post, as POST /posts/ does by default,
+and with POST_WRITE_BEHIND, where post_writer commits the posts of concurrent requests together.
+File sqlite database, so that each commit is synced to disk.
+
+python -m benchmarks.bench_write_behind"""
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks.common import seeded_engine
+from blog.model import post
+
+CLIENTS = 50
+POSTS_PER_CLIENT = 20
+
+
+async def _posts_per_second(create) -> float:
+    async def client(client_id: int):
+        for i in range(POSTS_PER_CLIENT):
+            await create(client_id % 10 + 1, post.PostInfo(title=f'Post {client_id}.{i}', body='Some body text'))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(client_id) for client_id in range(CLIENTS)))
+    return CLIENTS * POSTS_PER_CLIENT / (time.perf_counter() - start)
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as directory:
+        engine = await seeded_engine(users_count=10,
+                                     database_url=f'sqlite+aiosqlite:///{os.path.join(directory, "blog.db")}')
+
+        async def per_post(user_id: int, post_info: post.PostInfo):
+            async with engine.connect() as db_connection:
+                await post.create_post(user_id, post_info, db_connection)
+
+        async def write_behind(user_id: int, post_info: post.PostInfo):
+            await post.create_post_write_behind_async(user_id, post_info, engine.connect)
+
+        print(f'{CLIENTS} concurrent clients, {POSTS_PER_CLIENT} posts each')
+        print(f'transaction per post: {await _posts_per_second(per_post):8.0f} posts/s')
+        print(f'write behind:         {await _posts_per_second(write_behind):8.0f} posts/s, '
+              f'{post.post_writer.stats().items_per_batch:.1f} posts per transaction')
+        await post.post_writer.close()
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,132 @@
+"""Helpers shared by benchmarks: seeded in-memory sqlite database and timing.
+Benchmarks are not run by pytest, start them as modules, e.g. python -m benchmarks.bench_pagination"""
+import os
+import statistics
+import time
+from typing import Awaitable, Callable, Optional
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
+
+# model functions log every call, keep only benchmark results in the output
+logger.remove()
+
+CREATE_POST_TABLE = """
+    CREATE TABLE blog_post(
+        post_id INTEGER NOT NULL PRIMARY KEY,
+        user_id INTEGER,
+        title VARCHAR(200),
+        body VARCHAR(100000),
+        version INTEGER NOT NULL DEFAULT 1,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP);"""
+
+CREATE_USER_TABLE = """CREATE TABLE blog_user(
+                user_id INTEGER PRIMARY KEY,
+                password_hash VARCHAR(300),
+                email VARCHAR(254),
+                username VARCHAR(100) UNIQUE,
+                name VARCHAR(200),
+                surname VARCHAR(200));"""
+
+
+async def seeded_engine(posts_count: int = 0, users_count: int = 0,
+                        body: str = 'Some body text ' * 10,
+                        database_url: str = 'sqlite+aiosqlite://') -> AsyncEngine:
+    """empty database, in-memory sqlite by default, with blog_user and blog_post tables filled with generated rows"""
+    engine = create_async_engine(database_url)
+    async with engine.begin() as connection:
+        await connection.execute(text(CREATE_USER_TABLE))
+        await connection.execute(text(CREATE_POST_TABLE))
+        if users_count:
+            await connection.execute(
+                text("""INSERT INTO blog_user(user_id, username, email, password_hash, name, surname)
+                        VALUES (:user_id, :username, :email, :password_hash, :name, :surname)"""),
+                [{'user_id': i, 'username': f'user{i}', 'email': f'user{i}@example.com',
+                  'password_hash': 'password_hash', 'name': 'Name', 'surname': 'Surname'}
+                 for i in range(1, users_count + 1)])
+        if posts_count:
+            await connection.execute(
+                text("""INSERT INTO blog_post(post_id, user_id, title, body)
+                        VALUES (:post_id, :user_id, :title, :body)"""),
+                [{'post_id': i, 'user_id': i % max(users_count, 1) + 1,
+                  'title': f'Post #{i}', 'body': body}
+                 for i in range(1, posts_count + 1)])
+    return engine
+
+
+async def median_seconds(call: Callable[[], Awaitable], repeat: int = 20) -> float:
+    """median wall-clock duration of awaiting call()"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await call()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+# settings the web api reads from the environment, the database is replaced by use_database
+WEB_API_ENVIRONMENT = {'PSQL_URL': '127.0.0.1:5432', 'PSQL_USER': 'blog_admin', 'PSQL_PASSWORD': 'password',
+                       'PSQL_DB': 'blog_db', 'LOG_LEVEL': 'INFO', 'JWT_SECRET_KEY': 'benchmark secret key',
+                       'JWT_ENCODE_ALGORITHM': 'HS256', 'JWT_ACCESS_TOKEN_EXPIRE_MINUTES': '30',
+                       'URL_PREFIX_FOR_V1_API': '/api/v1',
+                       # benchmarks measure throughput, login throttling would reject most logins
+                       'LOGIN_RATE_PER_IP_PER_MINUTE': '1000000', 'LOGIN_BURST_PER_IP': '1000000',
+                       'LOGIN_RATE_PER_USERNAME_PER_MINUTE': '1000000', 'LOGIN_BURST_PER_USERNAME': '1000000',
+                       'LOGIN_MAX_CONCURRENT': '1000000'}
+
+
+def web_api_app():
+    """blog.main.app, environment variables which are not set are taken from WEB_API_ENVIRONMENT"""
+    for name, value in WEB_API_ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+    from blog.main import app
+    return app
+
+
+def use_database(app, engine: AsyncEngine):
+    """makes app endpoints take connections from engine"""
+    from blog.dependicies import database
+
+    async def get_async_db_connection():
+        async with engine.connect() as connection:
+            yield connection
+
+    app.dependency_overrides[database.get_async_db_connection] = get_async_db_connection
+    app.dependency_overrides[database.get_async_read_connection] = get_async_db_connection
+    app.dependency_overrides[database.get_async_primary_connection] = get_async_db_connection
+
+    def connect():
+        return engine.connect()
+
+    app.dependency_overrides[database.get_read_connector] = lambda: connect
+    app.dependency_overrides[database.get_write_connector] = lambda: connect
+
+
+async def asgi_request(app, method: str, path: str, query_string: str = '',
+                       headers: Optional[dict[str, str]] = None, body: bytes = b'') -> tuple[int, bytes]:
+    """calls ASGI app in-process, without network and HTTP parsing
+    :returns (status code, response body)"""
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+             'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'root_path': '',
+             'query_string': query_string.encode(),
+             'headers': [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+             'client': ('127.0.0.1', 12345), 'server': ('127.0.0.1', 8000)}
+    request_messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status_code = 0
+    response_body = []
+
+    async def receive():
+        if request_messages:
+            return request_messages.pop()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status_code
+        if message['type'] == 'http.response.start':
+            status_code = message['status']
+        elif message['type'] == 'http.response.body':
+            response_body.append(message.get('body', b''))
+
+    await app(scope, receive, send)
+    return status_code, b''.join(response_body)
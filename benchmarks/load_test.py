@@ -0,0 +1,349 @@
+"""Load test of the web API. Concurrent clients run a mix of anonymous reads, login bursts and authenticated writes
+for a fixed time. Requests per second and p50/p95/p99 latency are reported per route and saved as JSON,
+so that runs can be compared over time.
+
+In-process (default): blog.main:app is called through ASGI, the database is a seeded temporary sqlite file.
+    python -m benchmarks.load_test --concurrency 50 --duration 20
+Local uvicorn workers started by the benchmark. Database settings are read from the environment
+(see config/env/template/webapi.env), users and posts are created through the API:
+    python -m benchmarks.load_test --workers 4
+Already running server, e.g. the docker-compose stack:
+    python -m benchmarks.load_test --url http://127.0.0.1:8100"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import requests
+from pydantic import BaseModel
+from sqlalchemy import text
+
+from benchmarks.common import seeded_engine, web_api_app, use_database, asgi_request
+
+PASSWORD = 'load test password'
+DEFAULT_MIX = 'read=80,login=5,write=15'
+# logins sent back to back by one client, like a user retrying or a script
+LOGIN_BURST = 3
+PAGE_SIZE = 10
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(__file__), 'results')
+
+
+class RouteResult(BaseModel):
+    route: str
+    requests: int
+    errors: int
+    requests_per_second: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+
+
+class LoadTestReport(BaseModel):
+    started_at: datetime.datetime
+    target: str
+    concurrency: int
+    duration_seconds: float
+    mix: dict[str, int]
+    requests: int
+    errors: int
+    requests_per_second: float
+    routes: list[RouteResult]
+
+
+class AsgiTransport:
+    """calls the app in-process"""
+
+    def __init__(self, app, prefix: str):
+        self.app = app
+        self.prefix = prefix
+        self.target = 'in-process'
+
+    async def request(self, method: str, path: str, query_string: str = '',
+                      headers: Optional[dict[str, str]] = None, body: bytes = b'') -> tuple[int, bytes]:
+        return await asgi_request(self.app, method, self.prefix + path, query_string, headers, body)
+
+    def close(self):
+        pass
+
+
+class HttpTransport:
+    """sends requests over HTTP, each thread of the executor keeps its own keep-alive session"""
+
+    def __init__(self, url: str, prefix: str, concurrency: int):
+        self.base_url = url.rstrip('/') + prefix
+        self.target = url
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='load_test')
+        self._local = threading.local()
+
+    def _send(self, method: str, url: str, headers: Optional[dict[str, str]], body: bytes) -> tuple[int, bytes]:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        response = session.request(method, url, headers=headers, data=body, allow_redirects=False)
+        return response.status_code, response.content
+
+    async def request(self, method: str, path: str, query_string: str = '',
+                      headers: Optional[dict[str, str]] = None, body: bytes = b'') -> tuple[int, bytes]:
+        url = f'{self.base_url}{path}?{query_string}' if query_string else self.base_url + path
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._send,
+                                                                method, url, headers, body)
+
+    def close(self):
+        self._executor.shutdown()
+
+
+class SeedData(BaseModel):
+    usernames: list[str]
+    user_ids: list[int]
+    post_ids: list[int]
+
+
+def _login_request(username: str) -> tuple[dict[str, str], bytes]:
+    body = urllib.parse.urlencode({'username': username, 'password': PASSWORD}).encode()
+    return {'Content-Type': 'application/x-www-form-urlencoded'}, body
+
+
+def _json_request(data, token: Optional[str] = None) -> tuple[dict[str, str], bytes]:
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    return headers, json.dumps(data).encode()
+
+
+async def _login(transport, username: str) -> tuple[int, Optional[str]]:
+    status_code, body = await transport.request('POST', '/token', '', *_login_request(username))
+    return status_code, json.loads(body)['access_token'] if status_code == 200 else None
+
+
+async def seed_in_process(users_count: int, posts_count: int):
+    """temporary sqlite file, all users have PASSWORD"""
+    from blog.model.auth import user_password
+    database_url = f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'load_test.db')}"
+    engine = await seeded_engine(posts_count=posts_count, users_count=users_count, database_url=database_url)
+    async with engine.begin() as connection:
+        await connection.execute(text('UPDATE blog_user SET password_hash = :password_hash'),
+                                 {'password_hash': user_password.hash_password(PASSWORD)})
+    return engine, SeedData(usernames=[f'user{i}' for i in range(1, users_count + 1)],
+                            user_ids=list(range(1, users_count + 1)),
+                            post_ids=list(range(1, posts_count + 1)))
+
+
+async def seed_through_api(transport, users_count: int, posts_count: int) -> SeedData:
+    """creates users with unique usernames and their posts through the API of a running server"""
+    run_tag = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    seed = SeedData(usernames=[], user_ids=[], post_ids=[])
+    posts_per_user = max(posts_count // users_count, 1)
+    for i in range(users_count):
+        username = f'load_{run_tag}_{i}'
+        status_code, body = await transport.request(
+            'POST', '/users/', '',
+            *_json_request({'password': PASSWORD,
+                            'user_info': {'username': username, 'email': f'{username}@example.com'}}))
+        assert status_code == 200, body
+        seed.usernames.append(username)
+        seed.user_ids.append(json.loads(body)['user_id'])
+        _, token = await _login(transport, username)
+        for start in range(0, posts_per_user, 100):
+            post_infos = [{'title': f'Load test post {start + j}', 'body': 'Some body text ' * 10}
+                          for j in range(min(100, posts_per_user - start))]
+            status_code, body = await transport.request('POST', '/posts/batch', '',
+                                                        *_json_request(post_infos, token))
+            assert status_code == 201, body
+            seed.post_ids.extend(result['post_id'] for result in json.loads(body))
+    return seed
+
+
+class VirtualClient:
+    """one simulated user, runs scenarios one after another"""
+
+    def __init__(self, transport, seed: SeedData, number: int, samples: dict[str, list[float]],
+                 errors: dict[str, int]):
+        self.transport = transport
+        self.seed = seed
+        self.random = random.Random(number)
+        self.username = seed.usernames[number % len(seed.usernames)]
+        self.token: Optional[str] = None
+        self.own_post_ids: list[int] = []
+        self.samples = samples
+        self.errors = errors
+        self.recording = False
+
+    async def call(self, route: str, method: str, path: str, query_string: str = '',
+                   headers: Optional[dict[str, str]] = None, body: bytes = b'') -> tuple[int, bytes]:
+        start = time.perf_counter()
+        status_code, response_body = await self.transport.request(method, path, query_string, headers, body)
+        if self.recording:
+            self.samples.setdefault(route, []).append(time.perf_counter() - start)
+            if status_code >= 400:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return status_code, response_body
+
+    async def read(self):
+        choice = self.random.randrange(4)
+        if choice == 0:
+            await self.call('GET /posts', 'GET', '/posts', f'limit={PAGE_SIZE}')
+        elif choice == 1:
+            await self.call('GET /posts/{post_id}', 'GET', f'/posts/{self.random.choice(self.seed.post_ids)}')
+        elif choice == 2:
+            await self.call('GET /users/{user_id}', 'GET', f'/users/{self.random.choice(self.seed.user_ids)}')
+        else:
+            await self.call('GET /users/{user_id}/posts', 'GET',
+                            f'/users/{self.random.choice(self.seed.user_ids)}/posts', f'limit={PAGE_SIZE}')
+
+    async def login(self):
+        for _ in range(LOGIN_BURST):
+            status_code, body = await self.call('POST /token', 'POST', '/token', '', *_login_request(self.username))
+            if status_code == 200:
+                self.token = json.loads(body)['access_token']
+
+    async def write(self):
+        if self.token is None:
+            await self.login()
+        post_info = {'title': f'Post of {self.username}', 'body': 'Some body text ' * 10}
+        if self.own_post_ids and self.random.random() < 0.5:
+            await self.call('PUT /posts/{post_id}', 'PUT', f'/posts/{self.random.choice(self.own_post_ids)}', '',
+                            *_json_request(post_info, self.token))
+        else:
+            status_code, body = await self.call('POST /posts/', 'POST', '/posts/', '',
+                                                *_json_request(post_info, self.token))
+            if status_code == 201:
+                self.own_post_ids.append(json.loads(body)['post_id'])
+
+    async def run(self, scenarios: list[str], weights: list[int], until: float):
+        while time.perf_counter() < until:
+            scenario = self.random.choices(scenarios, weights)[0]
+            await getattr(self, scenario)()
+
+
+def _percentile_ms(sorted_seconds: list[float], q: float) -> float:
+    """nearest-rank percentile"""
+    index = max(0, min(len(sorted_seconds) - 1, round(q / 100 * len(sorted_seconds)) - 1))
+    return sorted_seconds[index] * 1000
+
+
+async def run_load(transport, seed: SeedData, concurrency: int, duration: float, warmup: float,
+                   mix: dict[str, int]) -> LoadTestReport:
+    samples: dict[str, list[float]] = {}
+    errors: dict[str, int] = {}
+    clients = [VirtualClient(transport, seed, n, samples, errors) for n in range(concurrency)]
+    scenarios, weights = list(mix), list(mix.values())
+    started_at = datetime.datetime.now(datetime.timezone.utc)
+    if warmup > 0:
+        await asyncio.gather(*(c.run(scenarios, weights, time.perf_counter() + warmup) for c in clients))
+    for c in clients:
+        c.recording = True
+    start = time.perf_counter()
+    await asyncio.gather(*(c.run(scenarios, weights, start + duration) for c in clients))
+    elapsed = time.perf_counter() - start
+    routes = []
+    for route, durations in sorted(samples.items()):
+        durations.sort()
+        routes.append(RouteResult(route=route, requests=len(durations), errors=errors.get(route, 0),
+                                  requests_per_second=len(durations) / elapsed,
+                                  p50_ms=_percentile_ms(durations, 50),
+                                  p95_ms=_percentile_ms(durations, 95),
+                                  p99_ms=_percentile_ms(durations, 99)))
+    requests_count = sum(r.requests for r in routes)
+    return LoadTestReport(started_at=started_at, target=transport.target, concurrency=concurrency,
+                          duration_seconds=elapsed, mix=mix, requests=requests_count,
+                          errors=sum(r.errors for r in routes), requests_per_second=requests_count / elapsed,
+                          routes=routes)
+
+
+def _parse_mix(mix: str) -> dict[str, int]:
+    weights = {}
+    for item in mix.split(','):
+        scenario, weight = item.split('=')
+        if scenario not in ('read', 'login', 'write'):
+            raise argparse.ArgumentTypeError(f'unknown scenario {scenario}, use read, login and write')
+        weights[scenario] = int(weight)
+    return weights
+
+
+def _start_uvicorn(workers: int, port: int) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, '-m', 'uvicorn', 'blog.main:app', '--workers', str(workers),
+                             '--port', str(port), '--log-level', 'warning'])
+
+
+async def _wait_until_up(transport, seconds: float = 30):
+    deadline = time.perf_counter() + seconds
+    while True:
+        try:
+            status_code, _ = await transport.request('GET', '/posts', 'limit=1')
+            if status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        if time.perf_counter() > deadline:
+            raise TimeoutError('web api did not start')
+        await asyncio.sleep(0.5)
+
+
+def print_report(report: LoadTestReport):
+    print(f'{report.target}, {report.concurrency} clients, {report.duration_seconds:.1f} s, '
+          f'{report.requests_per_second:.1f} requests/s, {report.errors} errors')
+    print(f'{"route":<26} {"requests":>8} {"errors":>6} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for r in report.routes:
+        print(f'{r.route:<26} {r.requests:>8} {r.errors:>6} {r.requests_per_second:>8.1f} '
+              f'{r.p50_ms:>8.2f} {r.p95_ms:>8.2f} {r.p99_ms:>8.2f}')
+
+
+async def main(args):
+    mix = _parse_mix(args.mix)
+    engine = worker_process = None
+    if args.url is None and args.workers is None:
+        app = web_api_app()
+        engine, seed = await seed_in_process(args.users, args.posts)
+        use_database(app, engine)
+        transport = AsgiTransport(app, args.prefix)
+    else:
+        url = args.url
+        if url is None:
+            worker_process = _start_uvicorn(args.workers, args.port)
+            url = f'http://127.0.0.1:{args.port}'
+        transport = HttpTransport(url, args.prefix, args.concurrency)
+    try:
+        if engine is None:
+            await _wait_until_up(transport)
+            seed = await seed_through_api(transport, args.users, args.posts)
+        report = await run_load(transport, seed, args.concurrency, args.duration, args.warmup, mix)
+    finally:
+        transport.close()
+        if worker_process is not None:
+            worker_process.terminate()
+            worker_process.wait()
+        if engine is not None:
+            await engine.dispose()
+    print_report(report)
+    output = args.output or os.path.join(RESULTS_DIRECTORY,
+                                         f'load_test_{report.started_at.strftime("%Y%m%dT%H%M%S")}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        file.write(report.json(indent=2))
+    print(f'saved to {output}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test of the web API')
+    parser.add_argument('--concurrency', type=int, default=20, help='simultaneous clients')
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds before measurement')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'scenario weights, {DEFAULT_MIX} by default')
+    parser.add_argument('--users', type=int, default=20, help='users to create')
+    parser.add_argument('--posts', type=int, default=1000, help='posts to create')
+    parser.add_argument('--workers', type=int, help='start uvicorn with this many workers and test over HTTP')
+    parser.add_argument('--port', type=int, default=8200, help='port of uvicorn started with --workers')
+    parser.add_argument('--url', help='test already running server, e.g. http://127.0.0.1:8100')
+    parser.add_argument('--prefix', default='/api/v1', help='URL_PREFIX_FOR_V1_API of the server')
+    parser.add_argument('--output', help=f'JSON report path, a new file in {RESULTS_DIRECTORY} by default')
+    asyncio.run(main(parser.parse_args()))
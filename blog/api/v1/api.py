@@ -1,15 +1,22 @@
 from typing import Optional, Any
 
-from fastapi import Query, Path, HTTPException, Depends, APIRouter
-from pydantic import BaseModel
-from sqlalchemy.engine import Connection
+from fastapi import Query, Path, Header, HTTPException, Depends, APIRouter, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, conlist
 from sqlalchemy.ext.asyncio import AsyncConnection
 from starlette import status
 
-from blog.dependicies import auth, database
+from blog.api.v1 import conditional, fast_json
+from blog.dependicies import auth, database, throttling
 from blog.dependicies.auth import generate_JWT_token_from_login_pass
 from blog.model import user
 from blog.model import post
+from blog.model import pagination
+from blog.model import cache
+from blog.model import single_flight
+from blog.model import batch_loader
+from blog.model import group_commit
+from blog.model import statements
 from loguru import logger
 import blog.model.auth.user_token as user_token
 from blog.model.auth.user_password import NullInPusswordException
@@ -17,11 +24,51 @@ from blog.model.user import UserInfo
 
 api_router = APIRouter()
 
+# list endpoints return the cursor of the next page in this header
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+# rows fetched from server side cursor at once by export endpoints
+EXPORT_BATCH_SIZE = 1000
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+# max items in one request of batch endpoints
+MAX_BATCH_SIZE = 100
+# max users in one request of bulk import, use blog.import_users CLI for larger files
+MAX_IMPORT_SIZE = 10000
+
+
+def _after_id_from_cursor(cursor: str) -> int:
+    """decodes opaque cursor from the list endpoints into the last seen id
+    :raises HTTPException if cursor is malformed"""
+    try:
+        after_id, = pagination.decode_cursor(cursor)
+    except pagination.BadCursorException:
+        after_id = None
+    if not isinstance(after_id, int):
+        logger.info('Bad cursor {}', cursor)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='bad cursor')
+    return after_id
+
+
+def _post_ids_from_query(ids: str) -> list[int]:
+    """parses comma separated post_ids of the multi-get
+    :raises HTTPException if ids are malformed or too many"""
+    try:
+        post_ids = [int(post_id) for post_id in ids.split(',')]
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='ids must be comma separated integers')
+    if len(post_ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f'at most {MAX_BATCH_SIZE} ids in one request')
+    return post_ids
+
 
 @api_router.post("/token", status_code=status.HTTP_200_OK, response_model=auth.Token)
 async def access_token_from_login_pass(
+        _: None = Depends(throttling.throttle_login),  # before password check
         encoded_JWT_access_token: auth.Token = Depends(generate_JWT_token_from_login_pass)) -> auth.Token:
     """login form is redirected here
+    Attempts are limited per IP and username, 429 with Retry-After header is returned over the limit
     :returns {"access_token": encoded_JWT_access_token, "token_type": "bearer"}
     :raises HTTPException if authentication failed"""
     try:
@@ -37,34 +84,83 @@ async def access_token_from_login_pass(
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def _after_rank_from_cursor(cursor: str) -> tuple[float, int]:
+    """decodes opaque cursor from the search endpoint into rank and post_id of the last result
+    :raises HTTPException if cursor is malformed"""
+    try:
+        after_rank, after_post_id = pagination.decode_cursor(cursor, keys_count=2)
+    except pagination.BadCursorException:
+        after_rank, after_post_id = None, None
+    if not isinstance(after_rank, (int, float)) or not isinstance(after_post_id, int):
+        logger.info('Bad cursor {}', cursor)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='bad cursor')
+    return float(after_rank), after_post_id
+
+
 @api_router.get("/users", status_code=status.HTTP_200_OK, response_model=list[user.UserInfo])
-async def get_all_users(skip: int = Query(0, ge=0.0, example=0),
+async def get_all_users(response: Response,
+                        skip: int = Query(0, ge=0.0, example=0),
                         limit: int = 10,
-                        async_db_connection: AsyncConnection = Depends(database.get_async_db_connection)) -> Any:
-    """get list of all users
+                        cursor: Optional[str] = None,
+                        async_db_connection: AsyncConnection = Depends(database.get_async_read_connection)) -> Any:
+    """get list of all users ordered by user_id
+    If the page is full, X-Next-Cursor header holds the cursor of the next page.
     :param async_db_connection:
-    :param skip. skip >= 0. optional
+    :param skip. skip >= 0. optional. Legacy, deep pages are slow, use cursor instead
     :param limit. default 10. optional
+    :param cursor. X-Next-Cursor header of the previous page. optional, skip is ignored if set
     """
+    after_user_id = _after_id_from_cursor(cursor) if cursor is not None else None
     try:
-        users = await user.get_all_users_async(async_db_connection, skip, limit)
+        if fast_json.fast_json_settings.FAST_JSON_RESPONSES:
+            # rows were validated when written, serialize them as is
+            if after_user_id is None:
+                rows = await user.get_all_users_rows_async(async_db_connection, skip, limit)
+            else:
+                rows = await user.get_users_after_rows_async(async_db_connection, after_user_id, limit)
+            fast_response = fast_json.FastJSONResponse([user.user_info_row_to_dict(row) for row in rows])
+            if rows and len(rows) == limit:
+                fast_response.headers[NEXT_CURSOR_HEADER] = pagination.encode_cursor(rows[-1][0])
+            return fast_response
+        if after_user_id is None:
+            users = await user.get_all_users_async(async_db_connection, skip, limit)
+        else:
+            users = await user.get_users_after_async(async_db_connection, after_user_id, limit)
+        if users and len(users) == limit:
+            response.headers[NEXT_CURSOR_HEADER] = pagination.encode_cursor(users[-1].user_id)
         return [u.user_info for u in users]
     except Exception:
         logger.exception('Unknown exception')
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_router.get("/users/export", status_code=status.HTTP_200_OK, response_class=StreamingResponse)
+async def export_users(async_db_connection: AsyncConnection = Depends(database.get_async_read_connection)):
+    """all users as newline delimited JSON, one {"user_id": ..., "user_info": {...}} per line.
+    Streamed in batches, memory usage does not depend on the number of users"""
+    async def users_ndjson():
+        try:
+            async for users in user.stream_all_users_async(async_db_connection, EXPORT_BATCH_SIZE):
+                yield ''.join(u.json(exclude={'password_hash'}) + '\n' for u in users)
+        except Exception:
+            # response is already started, can only log and break the stream
+            logger.exception('Unknown exception')
+            raise
+    return StreamingResponse(users_ndjson(), media_type=NDJSON_MEDIA_TYPE)
+
+
 @api_router.get("/users/{user_id}",
                 status_code=status.HTTP_302_FOUND,
                 response_model=Optional[user.UserInfo])
-def get_user(user_id: int = Path(..., ge=0.0),
-             db_connection: Connection = Depends(database.get_database_connection)) -> Optional[user.UserInfo]:
+async def get_user(user_id: int = Path(..., ge=0.0),
+                   db_connection: AsyncConnection = Depends(database.get_async_read_connection)
+                   ) -> Optional[user.UserInfo]:
     """get specific user
     :param db_connection:
     :param user_id is required, greater than 0
     """
     try:
-        found_user = user.get_user_by_id(user_id, db_connection)
+        found_user = await user.get_user_by_id_async(user_id, db_connection)
     except Exception:
         logger.exception('Unknown exception')
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -74,18 +170,62 @@ def get_user(user_id: int = Path(..., ge=0.0),
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
 
+def _page_not_modified(etag: str, versions: list[tuple[int, int]], limit: int) -> Response:
+    """304 for a list page with the headers of its 200 response"""
+    headers = {'ETag': etag}
+    if versions and len(versions) == limit:
+        headers[NEXT_CURSOR_HEADER] = pagination.encode_cursor(versions[-1][0])
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+
+@api_router.get("/users/{user_id}/posts", status_code=status.HTTP_200_OK, response_model=list[post.Post])
+async def get_user_posts(response: Response,
+                         user_id: int = Path(..., ge=0.0),
+                         limit: int = Query(10, ge=1, le=1000),
+                         cursor: Optional[str] = None,
+                         if_none_match: Optional[str] = Header(None),
+                         db_connection: AsyncConnection = Depends(database.get_async_read_connection)
+                         ) -> list[post.Post]:
+    """posts of the user ordered by post_id
+    If the page is full, X-Next-Cursor header holds the cursor of the next page.
+    Pages have ETag of the versions of their posts. If it matches If-None-Match, 304 is returned,
+    titles and bodies are not read from the database.
+    :param cursor. X-Next-Cursor header of the previous page. optional
+    """
+    after_post_id = _after_id_from_cursor(cursor) if cursor is not None else 0
+    try:
+        versions = await post.get_page_versions_async(db_connection, limit, after_post_id=after_post_id,
+                                                      user_id=user_id)
+        etag = conditional.page_etag(versions)
+        if if_none_match is not None and conditional.etag_matches(if_none_match, etag):
+            return _page_not_modified(etag, versions, limit)
+        posts = await post.get_user_posts_async(db_connection, user_id, after_post_id=after_post_id, limit=limit)
+    except Exception:
+        logger.exception('Unknown exception')
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    response.headers['ETag'] = etag
+    if posts and len(posts) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = pagination.encode_cursor(posts[-1].post_id)
+    return posts
+
+
 class ReturnedUserInfo(BaseModel):
     user_id: int
     user_info: user.UserInfo
 
 
 @api_router.post("/users/", status_code=status.HTTP_200_OK, response_model=ReturnedUserInfo)
-def create_user(user_create_data: user.UserCreationData,
-                db_connection: Connection = Depends(database.get_database_connection)) -> ReturnedUserInfo:
+async def create_user(user_create_data: user.UserCreationData,
+                      db_connection: AsyncConnection = Depends(database.get_async_db_connection)
+                      ) -> ReturnedUserInfo:
     """creates a new user, returning it as a result"""
     try:
-        created_user: user.User = user.create_user(db_connection, user_create_data)
+        created_user: user.User = await user.create_user_async(db_connection, user_create_data)
         return ReturnedUserInfo(user_id=created_user.user_id, user_info=created_user.user_info)
+    except NullInPusswordException:
+        logger.warning('Someone trying to use null byte in password')
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Null bytes are prohibited in password")
     except user.DuplicateUserCreationException as e:
         logger.info('Trying to create duplicate username:{}', user_create_data.user_info.username)
         raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED,
@@ -95,15 +235,34 @@ def create_user(user_create_data: user.UserCreationData,
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_router.post("/admin/users/import", status_code=status.HTTP_200_OK, response_model=user.UserImportReport)
+async def import_users(users_data: conlist(user.UserCreationData, min_items=1, max_items=MAX_IMPORT_SIZE),
+                       admin_user_id: int = Depends(auth.get_current_admin_user_id),
+                       db_connection: AsyncConnection = Depends(database.get_async_db_connection)
+                       ) -> user.UserImportReport:
+    """creates many users at once, duplicate usernames are skipped and reported
+    Admins only"""
+    try:
+        report = await user.import_users_async(db_connection, users_data)
+    except user.DuplicateUserCreationException as e:
+        logger.info('Concurrent user creation during import by admin {}', admin_user_id)
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except Exception:
+        logger.exception('Unknown exception')
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    logger.info('Admin {} imported {} users', admin_user_id, report.imported)
+    return report
+
+
 @api_router.put("/users", status_code=status.HTTP_200_OK, response_model=user.UserInfo)
-def update_user_info(user_info: user.UserInfo,
-                     user_id: int = Depends(auth.get_current_authenticated_user_id),
-                     db_connection: Connection = Depends(database.get_database_connection)) -> UserInfo:
+async def update_user_info(user_info: user.UserInfo,
+                           user_id: int = Depends(auth.get_current_authenticated_user_id),
+                           db_connection: AsyncConnection = Depends(database.get_async_db_connection)) -> UserInfo:
     """Update name or surname for user"""
     try:
-        return user.update_user_info(user_id=user_id,
-                                     user_info=user_info,
-                                     db_connection=db_connection)
+        return await user.update_user_info_async(user_id=user_id,
+                                                 user_info=user_info,
+                                                 db_connection=db_connection)
     except NullInPusswordException:
         logger.warning('Someone trying to use null byte in password')
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
@@ -118,12 +277,14 @@ def update_user_info(user_info: user.UserInfo,
 
 
 @api_router.delete("/users", status_code=status.HTTP_200_OK)
-def delete_user(user_id: int = Depends(auth.get_current_authenticated_user_id),
-                db_connection: Connection = Depends(database.get_database_connection)):
+async def delete_user(user_id: int = Depends(auth.get_current_authenticated_user_id),
+                      db_connection: AsyncConnection = Depends(database.get_async_db_connection)):
     """Delete user by id.
     :raises HTTPException if user is not found, nothing is deleted"""
     try:
-        user.delete_user(user_id, db_connection)
+        await user.delete_user_async(user_id, db_connection)
+        # user posts are deleted with CASCADE
+        post.post_cache.clear()
     except user.UserNotFoundException:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f'user with user_id={user_id} not found')
@@ -133,45 +294,238 @@ def delete_user(user_id: int = Depends(auth.get_current_authenticated_user_id),
 
 
 @api_router.get("/posts", status_code=status.HTTP_200_OK, response_model=list[post.Post])
-async def get_all_posts(skip: int = Query(0, ge=0.0, example=0),
+async def get_all_posts(response: Response,
+                        skip: int = Query(0, ge=0.0, example=0),
                         limit: int = 10,
-                        db_connection: AsyncConnection = Depends(database.get_async_db_connection)) -> list[post.Post]:
-    """get all posts"""
+                        cursor: Optional[str] = None,
+                        ids: Optional[str] = Query(None, example='1,2,3'),
+                        if_none_match: Optional[str] = Header(None),
+                        connect: post.Connect = Depends(database.get_read_connector)
+                        ) -> list[post.Post]:
+    """get all posts ordered by post_id
+    If the page is full, X-Next-Cursor header holds the cursor of the next page.
+    Pages have ETag of the versions of their posts. If it matches If-None-Match, 304 is returned,
+    titles and bodies are not read from the database.
+    Concurrent requests of the same page by skip share one query.
+    :param skip. Legacy, deep pages are slow, use cursor instead
+    :param cursor. X-Next-Cursor header of the previous page. optional, skip is ignored if set
+    :param ids. comma separated post_ids, up to MAX_BATCH_SIZE. optional, multi-get:
+    found posts in the order of ids are returned with one query, skip, limit and cursor are ignored
+    """
     # return post.get_all_posts(db_connection, skip=skip, limit=limit)
+    post_ids = _post_ids_from_query(ids) if ids is not None else None
+    after_post_id = _after_id_from_cursor(cursor) if cursor is not None else None
     try:
+        if post_ids is not None:
+            return await post.get_posts_cached_async(post_ids, connect)
+        async with connect() as db_connection:
+            versions = await post.get_page_versions_async(db_connection, limit, skip=skip,
+                                                          after_post_id=after_post_id)
+        etag = conditional.page_etag(versions)
+        if if_none_match is not None and conditional.etag_matches(if_none_match, etag):
+            return _page_not_modified(etag, versions, limit)
+        response.headers['ETag'] = etag
         # note, that this only works for IO-bound tasks, because of GIL. Use subprocesses for CPU-bound
-        posts = await post.get_all_posts_async(db_connection, skip=skip, limit=limit)
+        if fast_json.fast_json_settings.FAST_JSON_RESPONSES:
+            # rows were validated when written, serialize them as is
+            async with connect() as db_connection:
+                if after_post_id is None:
+                    rows = await post.get_all_posts_rows_async(db_connection, skip=skip, limit=limit)
+                else:
+                    rows = await post.get_posts_after_rows_async(db_connection, after_post_id=after_post_id,
+                                                                 limit=limit)
+            fast_response = fast_json.FastJSONResponse([post.post_row_to_dict(row) for row in rows],
+                                                       headers={'ETag': etag})
+            if rows and len(rows) == limit:
+                fast_response.headers[NEXT_CURSOR_HEADER] = pagination.encode_cursor(rows[-1][0])
+            return fast_response
+        if after_post_id is None:
+            posts = await post.get_all_posts_coalesced_async(connect, skip=skip, limit=limit)
+        else:
+            async with connect() as db_connection:
+                posts = await post.get_posts_after_async(db_connection, after_post_id=after_post_id, limit=limit)
+        if posts and len(posts) == limit:
+            response.headers[NEXT_CURSOR_HEADER] = pagination.encode_cursor(posts[-1].post_id)
         return posts
     except Exception:
         logger.exception('Unknown exception')
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class PostBatchResult(BaseModel):
+    """result of one item of batch request"""
+    post_id: int
+    status_code: int
+    detail: Optional[str] = None
+    post: Optional[post.Post]  # None if failed or deleted
+
+
+def _batch_error_result(post_id: int, e: Exception) -> PostBatchResult:
+    if isinstance(e, post.NotYourPostException):
+        return PostBatchResult(post_id=post_id, status_code=status.HTTP_401_UNAUTHORIZED, detail='not your post_id')
+    return PostBatchResult(post_id=post_id, status_code=status.HTTP_404_NOT_FOUND,
+                           detail=f'post with post_id={post_id} not found')
+
+
+@api_router.post("/posts/batch", status_code=status.HTTP_201_CREATED, response_model=list[PostBatchResult])
+async def create_posts(post_infos: conlist(post.PostInfo, min_items=1, max_items=MAX_BATCH_SIZE),
+                       user_id: int = Depends(auth.get_current_authenticated_user_id),
+                       db_connection: AsyncConnection = Depends(database.get_async_db_connection)
+                       ) -> list[PostBatchResult]:
+    """create many posts in one transaction, all or nothing"""
+    try:
+        created_posts = await post.create_posts(user_id, post_infos, db_connection)
+        return [PostBatchResult(post_id=created_post.post_id, status_code=status.HTTP_201_CREATED, post=created_post)
+                for created_post in created_posts]
+    except post.NoSuchUseridException:
+        logger.debug('User not found')
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='No user with such user_id')
+    except Exception:
+        logger.exception('Unknown exception')
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_router.put("/posts/batch", status_code=status.HTTP_200_OK, response_model=list[PostBatchResult])
+async def update_posts(post_updates: conlist(post.PostUpdate, min_items=1, max_items=MAX_BATCH_SIZE),
+                       user_id: int = Depends(auth.get_current_authenticated_user_id),
+                       db_connection: AsyncConnection = Depends(database.get_async_db_connection)
+                       ) -> list[PostBatchResult]:
+    """Update title or body of many posts in one transaction.
+    Result of each item is returned in the order of the request, failed items do not stop the others"""
+    try:
+        results = await post.update_posts(user_id, post_updates, db_connection)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='post_id is repeated')
+    except Exception:
+        logger.exception('Unknown exception')
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    batch_results = []
+    for post_update in post_updates:
+        result = results[post_update.post_id]
+        if isinstance(result, Exception):
+            batch_results.append(_batch_error_result(post_update.post_id, result))
+        else:
+            batch_results.append(PostBatchResult(post_id=post_update.post_id, status_code=status.HTTP_200_OK,
+                                                 post=result))
+    return batch_results
+
+
+@api_router.delete("/posts/batch", status_code=status.HTTP_200_OK, response_model=list[PostBatchResult])
+async def delete_posts(ids: list[int] = Query(...),
+                       user_id: int = Depends(auth.get_current_authenticated_user_id),
+                       db_connection: AsyncConnection = Depends(database.get_async_db_connection)
+                       ) -> list[PostBatchResult]:
+    """Delete many posts in one transaction, e.g. DELETE /posts/batch?ids=1&ids=2
+    Result of each item is returned in the order of the request, failed items do not stop the others"""
+    if len(ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f'at most {MAX_BATCH_SIZE} ids are allowed')
+    try:
+        results = await post.delete_posts(user_id, ids, db_connection)
+    except Exception:
+        logger.exception('Unknown exception')
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return [PostBatchResult(post_id=post_id, status_code=status.HTTP_200_OK) if results[post_id] is None
+            else _batch_error_result(post_id, results[post_id])
+            for post_id in ids]
+
+
+@api_router.get("/posts/search", status_code=status.HTTP_200_OK, response_model=list[post.Post])
+async def search_posts(response: Response,
+                       q: str = Query(..., min_length=1, max_length=300),
+                       limit: int = Query(10, ge=1, le=100),
+                       cursor: Optional[str] = None,
+                       db_connection: AsyncConnection = Depends(database.get_async_read_connection)) -> list[post.Post]:
+    """full-text search in titles and bodies of posts, best matches first
+    If the page is full, X-Next-Cursor header holds the cursor of the next page.
+    :param q words to search for
+    :param cursor. X-Next-Cursor header of the previous page. optional
+    """
+    after_rank, after_post_id = _after_rank_from_cursor(cursor) if cursor is not None else (None, 0)
+    try:
+        found = await post.search_posts_async(db_connection, q,
+                                              after_rank=after_rank, after_post_id=after_post_id, limit=limit)
+    except Exception:
+        logger.exception('Unknown exception')
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    if found and len(found) == limit:
+        last_post, last_rank = found[-1]
+        response.headers[NEXT_CURSOR_HEADER] = pagination.encode_cursor(last_rank, last_post.post_id)
+    return [found_post for found_post, _ in found]
+
+
+@api_router.get("/posts/export", status_code=status.HTTP_200_OK, response_class=StreamingResponse)
+async def export_posts(db_connection: AsyncConnection = Depends(database.get_async_read_connection)):
+    """all posts as newline delimited JSON, one post per line.
+    Streamed in batches, memory usage does not depend on the number of posts"""
+    async def posts_ndjson():
+        try:
+            async for posts in post.stream_all_posts_async(db_connection, EXPORT_BATCH_SIZE):
+                yield ''.join(p.json() + '\n' for p in posts)
+        except Exception:
+            # response is already started, can only log and break the stream
+            logger.exception('Unknown exception')
+            raise
+    return StreamingResponse(posts_ndjson(), media_type=NDJSON_MEDIA_TYPE)
+
+
 @api_router.get("/posts/{post_id}", status_code=status.HTTP_302_FOUND, response_model=post.Post)
-async def get_post(post_id: int = Path(..., ge=0.0),  # required, no default value. = None to make optional
-                   db_connection: AsyncConnection = Depends(database.get_async_db_connection)):
+async def get_post(response: Response,
+                   post_id: int = Path(..., ge=0.0),  # required, no default value. = None to make optional
+                   if_none_match: Optional[str] = Header(None),
+                   connect: post.Connect = Depends(database.get_read_connector)):
     """get specific post
-    :param db_connection:
+    Response has ETag and Last-Modified headers. If ETag matches If-None-Match, 304 is returned.
+    If the post is not cached, only its version is read to check If-None-Match,
+    title and body are read if it does not match.
+    Concurrent requests of the same post share one query and one connection.
+    :param connect: opens connection if post is not cached
     :param post_id path param. post_id >= 0. required.
+    :param if_none_match ETag of the post the client already has. optional
     """
     try:
-        found_post = await post.get_post_by_id_async(post_id, db_connection)
+        if if_none_match is not None and not post.is_post_cached(post_id, connect):
+            post_version = await post.get_post_version_async(post_id, connect)
+            if post_version is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+            if conditional.etag_matches(if_none_match, conditional.post_etag(post_id, post_version.version)):
+                return _post_not_modified(post_id, post_version)
+        found = await post.get_post_with_version_cached_async(post_id, connect)
+    except HTTPException:
+        raise
     except Exception:
         logger.exception('Unknown exception')
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    if found_post:
-        return found_post
-    else:
+    if not found:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    found_post, post_version = found
+    etag = conditional.post_etag(post_id, post_version.version)
+    if if_none_match is not None and conditional.etag_matches(if_none_match, etag):
+        return _post_not_modified(post_id, post_version)
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = conditional.http_date(post_version.updated_at)
+    return found_post
+
+
+def _post_not_modified(post_id: int, post_version: post.PostVersion) -> Response:
+    """304 for a post with the headers of its 200 response"""
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                    headers={'ETag': conditional.post_etag(post_id, post_version.version),
+                             'Last-Modified': conditional.http_date(post_version.updated_at)})
 
 
 @api_router.post("/posts/", status_code=status.HTTP_201_CREATED, response_model=post.Post)
 async def create_post(post_info: post.PostInfo,
                       user_id: int = Depends(auth.get_current_authenticated_user_id),
-                      db_connection: AsyncConnection = Depends(database.get_async_db_connection)) -> post.Post:
-    """create new post"""
+                      connect: post.Connect = Depends(database.get_write_connector)) -> post.Post:
+    """create new post
+    With POST_WRITE_BEHIND posts of concurrent requests are created in one transaction,
+    the response waits for its commit, at most POST_WRITE_BEHIND_MAX_DELAY_SECONDS longer"""
     try:
-        created_post = await post.create_post(user_id, post_info, db_connection)
+        if post.post_write_settings.POST_WRITE_BEHIND:
+            return await post.create_post_write_behind_async(user_id, post_info, connect)
+        async with connect() as db_connection:
+            created_post = await post.create_post(user_id, post_info, db_connection)
         return created_post
     except post.NoSuchUseridException:
         logger.debug('User not found')
@@ -184,11 +538,24 @@ async def create_post(post_info: post.PostInfo,
 @api_router.put("/posts/{post_id}", status_code=status.HTTP_200_OK, response_model=post.Post)
 async def update_post_info(post_info: post.PostInfo,
                            post_id: int = Path(...),
+                           if_match: Optional[str] = Header(None),
                            user_id: int = Depends(auth.get_current_authenticated_user_id),
                            db_connection: AsyncConnection = Depends(database.get_async_db_connection)):
-    """Update title or body for specific post"""
+    """Update title or body for specific post
+    :param if_match ETag of GET /posts/{post_id}, post is updated only if it was not changed since. optional
+    """
+    expected_version = None
+    if if_match is not None and if_match.strip() != '*':
+        expected_version = conditional.version_from_etag(post_id, if_match.strip())
+        if expected_version is None:
+            raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
+                                detail=f'If-Match is not an ETag of post_id={post_id}')
     try:
-        return await post.update_post(user_id, post_id, post_info, db_connection)
+        return await post.update_post(user_id, post_id, post_info, db_connection, expected_version)
+    except post.PostVersionMismatchException:
+        logger.info('Post {} was changed since version {}', post_id, expected_version)
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
+                            detail='post was changed, get it again')
     except post.NotYourPostException:
         logger.info('Trying to update post {} by non-owner {}', post_id, user_id)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
@@ -221,3 +588,50 @@ async def delete_post(post_id: int,
     except Exception:
         logger.exception('Unknown exception')
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_router.get("/stats/post_cache", status_code=status.HTTP_200_OK, response_model=cache.CacheStats)
+async def get_post_cache_stats(admin_user_id: int = Depends(auth.get_current_admin_user_id)) -> cache.CacheStats:
+    """hit, miss and eviction counters of GET /posts/{post_id} cache in this worker process
+    Admins only"""
+    return post.post_cache.stats()
+
+
+@api_router.get("/stats/single_flight", status_code=status.HTTP_200_OK, response_model=single_flight.SingleFlightStats)
+async def get_single_flight_stats(admin_user_id: int = Depends(auth.get_current_admin_user_id)
+                                  ) -> single_flight.SingleFlightStats:
+    """reads of posts which shared a query with a concurrent identical read, in this worker process
+    Admins only"""
+    return post.single_flight.stats()
+
+
+@api_router.get("/stats/post_loader", status_code=status.HTTP_200_OK, response_model=batch_loader.BatchLoaderStats)
+async def get_post_loader_stats(admin_user_id: int = Depends(auth.get_current_admin_user_id)
+                                ) -> batch_loader.BatchLoaderStats:
+    """post lookups and the queries which read them in batches, in this worker process
+    Admins only"""
+    return post.post_loader.stats()
+
+
+@api_router.get("/stats/statements", status_code=status.HTTP_200_OK,
+                response_model=statements.StatementRegistryStats)
+async def get_statement_stats(admin_user_id: int = Depends(auth.get_current_admin_user_id)
+                              ) -> statements.StatementRegistryStats:
+    """SQL statements of the model layer and compiled cache hits of the DB engines, in this worker process
+    Admins only"""
+    return statements.registry.stats()
+
+
+@api_router.get("/stats/post_writer", status_code=status.HTTP_200_OK, response_model=group_commit.GroupCommitStats)
+async def get_post_writer_stats(admin_user_id: int = Depends(auth.get_current_admin_user_id)
+                                ) -> group_commit.GroupCommitStats:
+    """posts created with POST_WRITE_BEHIND and the transactions which wrote them, in this worker process
+    Admins only"""
+    return post.post_writer.stats()
+
+
+@api_router.get("/stats/pool", status_code=status.HTTP_200_OK, response_model=database.PoolStats)
+async def get_pool_stats(admin_user_id: int = Depends(auth.get_current_admin_user_id)) -> database.PoolStats:
+    """checked out and idle connections, connection wait times of the DB pool in this worker process
+    Admins only"""
+    return database.get_pool_stats()
@@ -0,0 +1,90 @@
+"""ETag and Last-Modified headers, conditional GET and If-Match preconditions"""
+import datetime
+import email.utils
+import hashlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+def post_etag(post_id: int, version: int) -> str:
+    """strong ETag of a post version"""
+    return f'"{post_id}.{version}"'
+
+
+def page_etag(versions: list[tuple[int, int]]) -> str:
+    """strong ETag of a list page, from (post_id, version) of its posts"""
+    page = ','.join(f'{post_id}.{version}' for post_id, version in versions)
+    return f'"page-{hashlib.sha256(page.encode()).hexdigest()[:32]}"'
+
+
+def version_from_etag(post_id: int, etag: str) -> Optional[int]:
+    """:returns version of post_etag or None if etag is not an ETag of post_id"""
+    prefix = f'"{post_id}.'
+    if not (etag.startswith(prefix) and etag.endswith('"')):
+        return None
+    version = etag[len(prefix):-1]
+    return int(version) if version.isdigit() else None
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match uses weak comparison: W/ prefix is ignored"""
+    if if_none_match.strip() == '*':
+        return True
+    return any(candidate.strip().removeprefix('W/') == etag for candidate in if_none_match.split(','))
+
+
+def http_date(moment: datetime.datetime) -> str:
+    """Last-Modified format, naive datetime is treated as UTC"""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return email.utils.format_datetime(moment.astimezone(datetime.timezone.utc), usegmt=True)
+
+
+class ConditionalGetMiddleware:
+    """adds ETag, a hash of the body, to complete 200 responses of GET requests of route_paths which have no ETag yet,
+    e.g. user lists, which have no versions, and replaces the response with 304 Not Modified
+    if it matches If-None-Match. The response is still built, this saves only the transfer.
+    Endpoints with cheaper ETags, e.g. post lists by page_etag, set them and answer 304 themselves.
+    Streamed responses are passed as is."""
+
+    def __init__(self, app: ASGIApp, route_paths: set[str]):
+        """:param route_paths path templates of the routes, e.g. /api/v1/users"""
+        self.app = app
+        self.route_paths = route_paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or scope['method'] != 'GET':
+            await self.app(scope, receive, send)
+            return
+        if_none_match = Headers(scope=scope).get('if-none-match')
+        start_message: Optional[Message] = None
+
+        async def send_wrapper(message: Message):
+            nonlocal start_message
+            if message['type'] == 'http.response.start':
+                # the router puts the matched route into the scope
+                route_path = getattr(scope.get('route'), 'path_format', None)
+                if (message['status'] == 200 and route_path in self.route_paths
+                        and 'etag' not in Headers(raw=message['headers'])):
+                    start_message = message  # held until the body is known
+                    return
+            elif message['type'] == 'http.response.body' and start_message is not None:
+                held_start, start_message = start_message, None
+                if message.get('more_body', False):  # streamed
+                    await send(held_start)
+                    await send(message)
+                    return
+                etag = f'"{hashlib.sha256(message.get("body", b"")).hexdigest()[:32]}"'
+                headers = MutableHeaders(raw=held_start['headers'])
+                headers['ETag'] = etag
+                if if_none_match is not None and etag_matches(if_none_match, etag):
+                    del headers['content-length']
+                    await send({**held_start, 'status': 304})
+                    await send({'type': 'http.response.body', 'body': b''})
+                    return
+                await send(held_start)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
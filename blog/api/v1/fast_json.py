@@ -0,0 +1,34 @@
+import json
+from typing import Any
+
+from pydantic import BaseSettings
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:  # optional dependency, standard json is used instead
+    orjson = None
+
+
+class FastJSONSettings(BaseSettings):
+    """ Pydantic will read these parameters from the environment variables, defaults are used if not set"""
+    # list endpoints serialize DB rows directly, skipping pydantic models and response_model validation
+    FAST_JSON_RESPONSES: bool = False
+
+
+fast_json_settings = FastJSONSettings()
+
+
+def dumps(content: Any) -> bytes:
+    """same bytes as starlette JSONResponse renders, but faster if orjson is installed"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """JSON response for plain dicts and lists, content is not validated"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
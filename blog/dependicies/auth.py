@@ -1,13 +1,13 @@
 import os
 
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel
+from pydantic import BaseModel, BaseSettings
 from sqlalchemy.ext.asyncio import AsyncConnection
 from loguru import logger
 from starlette import status
 
-from blog.dependicies import database
+from blog.dependicies import database, throttling
 import blog.model.user as user
 import blog.model.auth.user_password
 import blog.model.auth.user_token as user_token
@@ -19,12 +19,21 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl=os.environ['URL_PREFIX_FOR_V1_API'
 token_settings = blog.model.auth.user_token.TokenSettings()
 
 
+class AdminSettings(BaseSettings):
+    """ Pydantic will read these parameters from the environment variables, defaults are used if not set"""
+    # JSON list, e.g. ADMIN_USER_IDS='[1]'
+    ADMIN_USER_IDS: list[int] = []
+
+
+admin_settings = AdminSettings()
+
+
 def get_current_authenticated_user_id(token: str = Depends(oauth2_scheme)) -> int:
     """finds current user using OAuth2 token
     :returns user_id
     :raises HTTPException if authorization went wrong"""
     try:
-        return blog.model.auth.user_token.decode_token_to_user_id(token, token_settings)
+        return blog.model.auth.user_token.decode_token_to_user_id_cached(token, token_settings)
     except blog.model.auth.user_token.BadTokenException:
         logger.info('Smth wrong with token {}', token)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
@@ -32,14 +41,26 @@ def get_current_authenticated_user_id(token: str = Depends(oauth2_scheme)) -> in
                             headers={"WWW-Authenticate": "Bearer"})
 
 
+def get_current_admin_user_id(user_id: int = Depends(get_current_authenticated_user_id)) -> int:
+    """same as get_current_authenticated_user_id, but only for users from ADMIN_USER_IDS
+    :returns user_id
+    :raises HTTPException if user is not admin"""
+    if user_id not in admin_settings.ADMIN_USER_IDS:
+        logger.info('Non-admin user_id={} tried admin endpoint', user_id)
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Admin rights are required")
+    return user_id
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
 
 
-async def generate_JWT_token_from_login_pass(form_data: OAuth2PasswordRequestForm = Depends(),
+async def generate_JWT_token_from_login_pass(request: Request,
+                                             form_data: OAuth2PasswordRequestForm = Depends(),
                                              db_connection: AsyncConnection = Depends(
-                                                 database.get_async_db_connection)) -> Token:
+                                                 database.get_async_primary_connection)) -> Token:
     try:
         access_token = await user_token.authenticate_user(form_data.username,
                                                           form_data.password,
@@ -48,5 +69,6 @@ async def generate_JWT_token_from_login_pass(form_data: OAuth2PasswordRequestFor
         return Token(access_token=access_token)
     except (user.UserNotFoundException, user_token.PasswordDoesNotMatchException):
         logger.info('Failed authentication for username:{}', form_data.username)
+        throttling.charge_failed_login(request, form_data.username)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail='wrong username or password')
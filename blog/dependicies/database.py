@@ -1,9 +1,22 @@
-from typing import Generator, AsyncGenerator
-from pydantic import BaseSettings
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from http.cookies import SimpleCookie
+from typing import AsyncContextManager, AsyncGenerator, AsyncIterator, Awaitable, Callable, Optional
+from fastapi import Request
+from fastapi.security.utils import get_authorization_scheme_param
+from loguru import logger
+from pydantic import BaseModel, BaseSettings
 
-import sqlalchemy
-from sqlalchemy.engine import Connection
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncConnection
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncConnection, AsyncEngine
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from blog import metrics
+from blog.dependicies import query_timing
+from blog.dependicies.replica_pool import ReadYourWrites, ReplicaPool
+from blog.model.auth import user_token
+from blog.model import statements
 
 
 class DatabaseSettings(BaseSettings):
@@ -13,37 +26,292 @@ class DatabaseSettings(BaseSettings):
     PSQL_DB: str
     LOG_LEVEL: str
     PSQL_URL: str
+    # connection pool of each worker process, defaults are SQLAlchemy defaults
+    PSQL_POOL_SIZE: int = 5
+    # connections opened by warm_up_pools on startup of each worker, up to PSQL_POOL_SIZE
+    PSQL_POOL_MIN_SIZE: int = 2
+    PSQL_POOL_MAX_OVERFLOW: int = 10
+    # seconds to wait for a free connection before failing
+    PSQL_POOL_TIMEOUT: float = 30.0
+    # reconnect connections older than this many seconds, -1 to never reconnect
+    PSQL_POOL_RECYCLE: int = -1
+    # check that connection is alive before each checkout
+    PSQL_POOL_PRE_PING: bool = False
+    # prepared statements cached per connection by asyncpg and by its SQLAlchemy adapter,
+    # 0 to disable (e.g. behind pgbouncer). Keep it above the number of statements in blog.model.statements
+    PSQL_STATEMENT_CACHE_SIZE: int = 100
+    # read replicas with the same user, password and database as PSQL_URL, JSON list, e.g. '["replica:5432"]'
+    PSQL_REPLICA_URLS: list[str] = []
+    # replica which failed to connect is skipped for this many seconds
+    PSQL_REPLICA_RETRY_SECONDS: float = 10.0
+    # after a write, reads of the client go to the primary for this many seconds, longer than replication lag
+    READ_YOUR_WRITES_SECONDS: float = 5.0
+    # authenticated users with recent writes remembered by each worker process, the others rely on the cookie
+    READ_YOUR_WRITES_MAX_USERS: int = 10000
 
 
 db_settings = DatabaseSettings()
+# reads the user_id of Bearer tokens for read_your_writes, auth dependencies verify them for the endpoints
+token_settings = user_token.TokenSettings()
+
+
+def _create_engine(url: str) -> AsyncEngine:
+    """engine of PSQL_DB at url, host:port. Put echo=True to log all queries"""
+    engine = create_async_engine(f"postgresql+asyncpg://"
+                                 f"{db_settings.PSQL_USER}:"
+                                 f"{db_settings.PSQL_PASSWORD}"
+                                 f"@{url}/{db_settings.PSQL_DB}",
+                                 pool_size=db_settings.PSQL_POOL_SIZE,
+                                 max_overflow=db_settings.PSQL_POOL_MAX_OVERFLOW,
+                                 pool_timeout=db_settings.PSQL_POOL_TIMEOUT,
+                                 pool_recycle=db_settings.PSQL_POOL_RECYCLE,
+                                 pool_pre_ping=db_settings.PSQL_POOL_PRE_PING,
+                                 connect_args={'statement_cache_size': db_settings.PSQL_STATEMENT_CACHE_SIZE,
+                                               'prepared_statement_cache_size': db_settings.PSQL_STATEMENT_CACHE_SIZE})
+    # SQL statements are timed by the model function executing them
+    query_timing.instrument_engine(engine.sync_engine)
+    statements.registry.count_compiled_cache(engine.sync_engine)
+    return engine
+
+
+# Engines are created by start_engines in each worker process on startup, not on import.
+# Pool connections opened before the fork of preloaded app would be shared by the workers.
+# connection pool of the primary, all writes go here. All endpoints are async
+async_engine: Optional[AsyncEngine] = None
+# read-only endpoints take connections from replicas, see get_async_read_connection
+replica_pool: Optional[ReplicaPool] = None
+# set by warm_up_pools
+pools_warm = False
+
+
+def start_engines():
+    """creates engines of the primary and of the replicas, connections are opened on demand"""
+    global async_engine, replica_pool
+    async_engine = _create_engine(db_settings.PSQL_URL)
+    replica_pool = ReplicaPool([_create_engine(url) for url in db_settings.PSQL_REPLICA_URLS],
+                               async_engine,
+                               db_settings.PSQL_REPLICA_RETRY_SECONDS)
+
+
+def check_statement_cache_size(registry: statements.StatementRegistry):
+    """warns if PSQL_STATEMENT_CACHE_SIZE is too small to keep the statements of registry prepared,
+    call it after start_engines, when the model modules have added their statements"""
+    count = len(registry.names(async_engine.dialect.name))
+    logger.info('{} statements for {}', count, async_engine.dialect.name)
+    if 0 < db_settings.PSQL_STATEMENT_CACHE_SIZE < count:
+        logger.warning('PSQL_STATEMENT_CACHE_SIZE={} is less than {} statements, prepared statements are evicted',
+                       db_settings.PSQL_STATEMENT_CACHE_SIZE, count)
+
+
+async def _open_connections(engine: AsyncEngine, count: int):
+    """opens count connections at once and returns them to the pool, where they stay open"""
+    connections = await asyncio.gather(*(engine.connect() for _ in range(count)))
+    for connection in connections:
+        await connection.close()
+
+
+async def warm_up_pools():
+    """opens PSQL_POOL_MIN_SIZE connections to the primary and to each replica,
+    so that the first requests do not wait for connection setup.
+    Unavailable replicas are skipped, they are retried by ReplicaPool.
+    :raises exception of the driver if the primary is unavailable"""
+    global pools_warm
+    count = min(db_settings.PSQL_POOL_MIN_SIZE, db_settings.PSQL_POOL_SIZE)
+    await _open_connections(async_engine, count)
+    for i, engine in enumerate(replica_pool.engines):
+        try:
+            await _open_connections(engine, count)
+        except Exception:
+            logger.exception('Replica {} is unavailable, pool is not warmed up', i)
+    pools_warm = True
+
 
-# holds connection pool
-# put echo=True to log all queries
-engine = sqlalchemy.create_engine(f"postgresql://"
-                                  f"{db_settings.PSQL_USER}:"
-                                  f"{db_settings.PSQL_PASSWORD}"
-                                  f"@{db_settings.PSQL_URL}/{db_settings.PSQL_DB}")
+async def dispose_engines():
+    """closes all connections of the primary and of the replicas"""
+    global async_engine, replica_pool, pools_warm
+    pools_warm = False
+    if replica_pool is not None:
+        for engine in replica_pool.engines:
+            await engine.dispose()
+    if async_engine is not None:
+        await async_engine.dispose()
+    async_engine = replica_pool = None
 
-# holds connection pool
-# put echo=True to log all queries
-async_engine = create_async_engine(f"postgresql+asyncpg://"
-                                   f"{db_settings.PSQL_USER}:"
-                                   f"{db_settings.PSQL_PASSWORD}"
-                                   f"@{db_settings.PSQL_URL}/{db_settings.PSQL_DB}")
+# cookie with time until which reads of the client go to the primary, set by requests which can write
+READ_PRIMARY_UNTIL_COOKIE = 'read_primary_until'
 
 
-def get_database_connection() -> Generator:
-    """get a connection from pool"""
-    connection: Connection = engine.connect()
+class PoolStats(BaseModel):
+    pool_size: int
+    max_overflow: int
+    checked_out: int
+    idle: int
+    overflow: int
+    # waits for connection in get_async_db_connection and get_async_read_connection,
+    # including opening new connections
+    checkouts: int
+    wait_seconds_total: float
+    wait_seconds_max: float
+    replicas: int
+    healthy_replicas: int
+
+
+class _ConnectionWaits:
+    """counts time spent waiting for a connection from the pool"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+
+_connection_waits = _ConnectionWaits()
+
+
+def get_pool_stats() -> PoolStats:
+    """state of the connection pool of this worker process"""
+    pool = async_engine.pool
+    return PoolStats(pool_size=pool.size(),
+                     max_overflow=db_settings.PSQL_POOL_MAX_OVERFLOW,
+                     checked_out=pool.checkedout(),
+                     idle=pool.checkedin(),
+                     overflow=max(pool.overflow(), 0),
+                     checkouts=_connection_waits.count,
+                     wait_seconds_total=_connection_waits.total_seconds,
+                     wait_seconds_max=_connection_waits.max_seconds,
+                     replicas=len(replica_pool.engines),
+                     healthy_replicas=replica_pool.healthy_count())
+
+
+# clients which have written recently, by user_id and by READ_PRIMARY_UNTIL_COOKIE
+read_your_writes = ReadYourWrites(db_settings.READ_YOUR_WRITES_SECONDS, db_settings.READ_YOUR_WRITES_MAX_USERS)
+
+
+# scope key set by the dependencies of requests which write, read by ReadYourWritesMiddleware
+_WRITES_SCOPE_KEY = 'blog.writes'
+
+
+def _authenticated_user_id(headers: Headers) -> Optional[int]:
+    """user_id of the Bearer token of request headers, None if there is no valid token"""
+    scheme, token = get_authorization_scheme_param(headers.get('Authorization'))
+    if scheme.lower() != 'bearer' or not token:
+        return None
     try:
+        return user_token.decode_token_to_user_id_cached(token, token_settings)
+    except user_token.BadTokenException:
+        return None
+
+
+def _reads_pinned_to_primary(request: Request) -> bool:
+    try:
+        read_primary_until = float(request.cookies.get(READ_PRIMARY_UNTIL_COOKIE, 0))
+    except ValueError:
+        read_primary_until = None
+    return read_your_writes.is_pinned(_authenticated_user_id(request.headers), read_primary_until)
+
+
+def _mark_write(request: Request):
+    if request.method not in ('GET', 'HEAD'):
+        request.scope[_WRITES_SCOPE_KEY] = True
+
+
+class ReadYourWritesMiddleware:
+    """after a successful request which has written to the primary, reads of the client go to the primary
+    for READ_YOUR_WRITES_SECONDS: the user_id of its token is pinned and the read_primary_until cookie is set.
+    Failed writes, 4xx and 5xx responses, do not pin"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or scope['method'] in ('GET', 'HEAD'):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message: Message):
+            # the endpoint has committed its transaction before the response is started
+            if (message['type'] == 'http.response.start' and scope.get(_WRITES_SCOPE_KEY)
+                    and message['status'] < 400 and replica_pool is not None and replica_pool.engines):
+                read_primary_until = read_your_writes.pin(_authenticated_user_id(Headers(scope=scope)))
+                cookie = SimpleCookie()
+                cookie[READ_PRIMARY_UNTIL_COOKIE] = str(read_primary_until)
+                cookie[READ_PRIMARY_UNTIL_COOKIE]['max-age'] = int(db_settings.READ_YOUR_WRITES_SECONDS) + 1
+                cookie[READ_PRIMARY_UNTIL_COOKIE]['path'] = '/'
+                cookie[READ_PRIMARY_UNTIL_COOKIE]['httponly'] = True
+                MutableHeaders(raw=message['headers']).append('set-cookie', cookie.output(header='').strip())
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+async def get_async_db_connection(request: Request) -> AsyncGenerator:
+    """returns async connection to the primary. Use .begin to start transaction
+    After successful requests other than GET, reads of the client go to the primary for READ_YOUR_WRITES_SECONDS"""
+    _mark_write(request)
+    async with primary_connection() as connection:
         yield connection
-    finally:  # executed when response is sent
-        connection.close()
 
 
-async def get_async_db_connection() -> AsyncGenerator:
-    """returns async connection. Use .begin to start transaction"""
-    connection: AsyncConnection = await async_engine.connect()
+async def get_async_primary_connection() -> AsyncGenerator:
+    """returns async connection to the primary for requests which only read, e.g. login,
+    which must see users created just now, but do not pin reads of the client to the primary"""
+    async with primary_connection() as connection:
+        yield connection
+
+
+def get_write_connector(request: Request) -> Callable[[], AsyncContextManager[AsyncConnection]]:
+    """returns primary_connection, for endpoints which write through a queue and do not hold a connection.
+    After successful requests other than GET, reads of the client go to the primary for READ_YOUR_WRITES_SECONDS"""
+    _mark_write(request)
+    return primary_connection
+
+
+def get_read_connector(request: Request) -> Callable[[], AsyncContextManager[AsyncConnection]]:
+    """returns primary_connection, pinned_primary_connection or replica_connection, for endpoints which do not write
+    and may not need a connection at all.
+    Replicas may lag behind the primary. The primary is used if no replicas are configured,
+    or if the client has written recently, see read_your_writes"""
+    if not replica_pool.engines:
+        return primary_connection
+    if _reads_pinned_to_primary(request):
+        return pinned_primary_connection
+    return replica_connection
+
+
+async def get_async_read_connection(request: Request) -> AsyncGenerator:
+    """returns async connection of get_read_connector"""
+    async with get_read_connector(request)() as connection:
+        yield connection
+
+
+def primary_connection() -> AsyncContextManager[AsyncConnection]:
+    return _connection(async_engine.connect)
+
+
+def pinned_primary_connection() -> AsyncContextManager[AsyncConnection]:
+    """primary_connection for clients reading their writes. Their write may have been served by another
+    worker process, which did not invalidate post_cache of this one, so their reads do not use caches"""
+    return _connection(async_engine.connect)
+
+
+def replica_connection() -> AsyncContextManager[AsyncConnection]:
+    """connection to the next healthy replica or to the primary if no replica is available"""
+    return _connection(replica_pool.connect)
+
+
+@asynccontextmanager
+async def _connection(connect: Callable[[], Awaitable[AsyncConnection]]) -> AsyncIterator[AsyncConnection]:
+    """connection which is closed on exit, time waiting for it is recorded"""
+    wait_start = time.perf_counter()
+    connection: AsyncConnection = await connect()
+    wait_seconds = time.perf_counter() - wait_start
+    _connection_waits.record(wait_seconds)
+    metrics.DB_CONNECTION_WAIT.observe(wait_seconds)
     try:
         yield connection
     finally:  # executed when response is sent
@@ -0,0 +1,86 @@
+"""Times every SQL statement of an engine, attributing it to the model function which executed it.
+Durations go to db_query_duration_seconds histogram, statements slower than SLOW_QUERY_SECONDS are logged."""
+import sys
+import time
+from types import FrameType
+from typing import Any, Optional
+
+import greenlet
+from loguru import logger
+from pydantic import BaseSettings
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from blog import metrics
+
+# statements executed outside of model functions, e.g. by migrations or tests
+UNKNOWN_FUNCTION = '<unknown>'
+_MODEL_PACKAGE = 'blog.model'
+
+
+class QueryTimingSettings(BaseSettings):
+    """ Pydantic will read these parameters from the environment variables, defaults are used if not set"""
+    # statements running longer are logged with warning level, parameter values are not logged
+    SLOW_QUERY_SECONDS: float = 0.5
+
+
+query_timing_settings = QueryTimingSettings()
+
+
+def _frames(frame: Optional[FrameType]):
+    while frame is not None:
+        yield frame
+        frame = frame.f_back
+
+
+def _calling_model_function() -> str:
+    """name of the innermost blog.model function on the stack, e.g. blog.model.post.get_post_by_id_async.
+    With async engine the statement runs in a greenlet, the awaiting coroutines are on the stack of its parent."""
+    current = greenlet.getcurrent()
+    stacks = [_frames(sys._getframe(2))]
+    if current.parent is not None:
+        stacks.append(_frames(current.parent.gr_frame))
+    for stack in stacks:
+        for frame in stack:
+            module = frame.f_globals.get('__name__', '')
+            if module.startswith(_MODEL_PACKAGE):
+                return f'{module}.{frame.f_code.co_name}'
+    return UNKNOWN_FUNCTION
+
+
+def _redacted(parameters: Any, executemany: bool) -> str:
+    """parameter names and types without values, which can be passwords or personal data"""
+    if executemany:
+        return f'{len(parameters)} x {_redacted(parameters[0], False)}' if parameters else '[]'
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{name}: {type(value).__name__}' for name, value in parameters.items()) + '}'
+    if isinstance(parameters, (list, tuple)):
+        return '(' + ', '.join(type(value).__name__ for value in parameters) + ')'
+    return type(parameters).__name__
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_timing', []).append((time.perf_counter(), _calling_model_function()))
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start, function = conn.info['query_timing'].pop()
+    duration = time.perf_counter() - start
+    metrics.DB_QUERY_DURATION.labels(function).observe(duration)
+    if duration >= query_timing_settings.SLOW_QUERY_SECONDS:
+        logger.warning('Slow query {:.3f}s in {}: {} parameters: {}',
+                       duration, function, ' '.join(statement.split()), _redacted(parameters, executemany))
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute is not called for failed statements
+    timings = exception_context.connection.info.get('query_timing') if exception_context.connection else None
+    if timings:
+        timings.pop()
+
+
+def instrument_engine(engine: Engine):
+    """adds timing to all statements of engine, pass AsyncEngine.sync_engine for async engines"""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
@@ -0,0 +1,63 @@
+import itertools
+import time
+from typing import Optional
+
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from blog.model.cache import LRUTTLCache
+
+
+class ReplicaPool:
+    """read replicas chosen round-robin. Replica which fails to connect is skipped for retry_seconds,
+    if no replica is available, the primary is used"""
+
+    def __init__(self, engines: list[AsyncEngine], primary: AsyncEngine, retry_seconds: float):
+        self.engines = engines
+        self.primary = primary
+        self.retry_seconds = retry_seconds
+        self._next = itertools.cycle(range(len(engines)))
+        self._unhealthy_until = [0.0] * len(engines)
+
+    async def connect(self) -> AsyncConnection:
+        """:returns connection to the next healthy replica or to the primary"""
+        for _ in range(len(self.engines)):
+            i = next(self._next)
+            if self._unhealthy_until[i] > time.monotonic():
+                continue
+            try:
+                return await self.engines[i].connect()
+            except Exception:
+                logger.exception('Replica {} is unavailable for {} seconds', i, self.retry_seconds)
+                self._unhealthy_until[i] = time.monotonic() + self.retry_seconds
+        return await self.primary.connect()
+
+    def healthy_count(self) -> int:
+        now = time.monotonic()
+        return sum(1 for until in self._unhealthy_until if until <= now)
+
+
+class ReadYourWrites:
+    """clients which have written in the last seconds, their reads go to the primary, not to a lagging replica.
+    Authenticated clients are remembered by user_id in this worker process, which covers Bearer token clients.
+    Any client also gets the time until which it reads from the primary, e.g. for a cookie,
+    which covers clients without a token and reads served by other worker processes"""
+
+    def __init__(self, seconds: float, max_users: int):
+        self.seconds = seconds
+        # user_id -> True, expires after seconds
+        self._users = LRUTTLCache(max_size=max_users, ttl_seconds=seconds)
+
+    def pin(self, user_id: Optional[int]) -> float:
+        """records a write of the client
+        :param user_id of the client, None if it is not authenticated
+        :returns unix time until which reads of the client go to the primary"""
+        if user_id is not None:
+            self._users.put(user_id, True)
+        return time.time() + self.seconds
+
+    def is_pinned(self, user_id: Optional[int], read_primary_until: Optional[float] = None) -> bool:
+        """:param read_primary_until returned by pin, if the client has it"""
+        if user_id is not None and self._users.get(user_id):
+            return True
+        return read_primary_until is not None and read_primary_until > time.time()
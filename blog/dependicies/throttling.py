@@ -0,0 +1,118 @@
+"""Admission control of /token: every attempt costs a DB lookup and a CPU-heavy password verification.
+Attempts are limited per client IP and failed attempts per username and IP with token buckets,
+and logins in progress are capped. Rejected attempts get 429 before any work is done.
+Failed attempts from other IPs do not lock a user out. Limits are per worker process."""
+import math
+import time
+from typing import AsyncGenerator, Callable
+
+from fastapi import Depends, HTTPException, Request
+from fastapi.security import OAuth2PasswordRequestForm
+from pydantic import BaseSettings, Field
+from starlette import status
+
+from blog import metrics
+from blog.model.cache import LRUTTLCache
+
+
+class LoginThrottlingSettings(BaseSettings):
+    """ Pydantic will read these parameters from the environment variables, defaults are used if not set"""
+    # sustained attempts per minute and burst size
+    LOGIN_RATE_PER_IP_PER_MINUTE: float = Field(30, gt=0)
+    LOGIN_BURST_PER_IP: int = Field(10, ge=1)
+    # failed attempts per username from one IP
+    LOGIN_RATE_PER_USERNAME_PER_MINUTE: float = Field(10, gt=0)
+    LOGIN_BURST_PER_USERNAME: int = Field(5, ge=1)
+    # IPs and usernames tracked at once, least recently seen are forgotten
+    LOGIN_THROTTLING_MAX_KEYS: int = 100000
+    # logins, and so password verifications, in progress at once, others are rejected at once
+    LOGIN_MAX_CONCURRENT: int = 16
+    # use the first address of X-Forwarded-For as client IP, only behind a trusted proxy
+    TRUST_X_FORWARDED_FOR: bool = False
+
+
+login_throttling_settings = LoginThrottlingSettings()
+
+
+class TokenBucket:
+    """token bucket per key: capacity tokens at most, refilled with rate_per_second.
+    Buckets of keys unseen until they are full again are forgotten"""
+
+    def __init__(self, capacity: int, rate_per_second: float, max_keys: int,
+                 clock: Callable[[], float] = time.monotonic):
+        self.capacity = capacity
+        self.rate_per_second = rate_per_second
+        self._clock = clock
+        # key -> (tokens, updated_at)
+        self._buckets = LRUTTLCache(max_size=max_keys, ttl_seconds=capacity / rate_per_second, clock=clock)
+
+    def _tokens(self, key, now: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return self.capacity
+        return min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate_per_second)
+
+    def try_acquire(self, key) -> float:
+        """takes a token of key
+        :returns 0 if token is taken, else seconds until a token is available"""
+        now = self._clock()
+        tokens = self._tokens(key, now)
+        if tokens < 1:
+            self._buckets.put(key, (tokens, now))
+            return (1 - tokens) / self.rate_per_second
+        self._buckets.put(key, (tokens - 1, now))
+        return 0
+
+    def retry_after(self, key) -> float:
+        """like try_acquire, but the token is not taken
+        :returns 0 if a token is available, else seconds until it is"""
+        tokens = self._tokens(key, self._clock())
+        return 0 if tokens >= 1 else (1 - tokens) / self.rate_per_second
+
+
+ip_buckets = TokenBucket(login_throttling_settings.LOGIN_BURST_PER_IP,
+                         login_throttling_settings.LOGIN_RATE_PER_IP_PER_MINUTE / 60,
+                         login_throttling_settings.LOGIN_THROTTLING_MAX_KEYS)
+username_buckets = TokenBucket(login_throttling_settings.LOGIN_BURST_PER_USERNAME,
+                               login_throttling_settings.LOGIN_RATE_PER_USERNAME_PER_MINUTE / 60,
+                               login_throttling_settings.LOGIN_THROTTLING_MAX_KEYS)
+_logins_in_progress = 0
+
+
+def _client_ip(request: Request) -> str:
+    if login_throttling_settings.TRUST_X_FORWARDED_FOR and 'x-forwarded-for' in request.headers:
+        return request.headers['x-forwarded-for'].split(',')[0].strip()
+    return request.client.host if request.client else ''
+
+
+def _too_many_requests(reason: str, retry_after: float) -> HTTPException:
+    metrics.LOGINS_THROTTLED.labels(reason).inc()
+    return HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                         detail='Too many login attempts, try again later',
+                         headers={'Retry-After': str(max(1, math.ceil(retry_after)))})
+
+
+def charge_failed_login(request: Request, username: str):
+    """takes a token of username and client IP, call it when the password verification fails"""
+    username_buckets.try_acquire((username, _client_ip(request)))
+
+
+async def throttle_login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()) -> AsyncGenerator:
+    """dependency of /token, add it before the dependencies which do the work
+    :raises HTTPException 429 if IP or failed attempts of username from the IP are over their rate
+    or too many logins are in progress"""
+    global _logins_in_progress
+    client_ip = _client_ip(request)
+    retry_after = ip_buckets.try_acquire(client_ip)
+    if retry_after:
+        raise _too_many_requests('ip', retry_after)
+    retry_after = username_buckets.retry_after((form_data.username, client_ip))
+    if retry_after:
+        raise _too_many_requests('username', retry_after)
+    if _logins_in_progress >= login_throttling_settings.LOGIN_MAX_CONCURRENT:
+        raise _too_many_requests('concurrency', 1)
+    _logins_in_progress += 1
+    try:
+        yield
+    finally:
+        _logins_in_progress -= 1
@@ -0,0 +1,61 @@
+"""Bulk import of users from a newline delimited JSON file, one user per line:
+{"password": "...", "user_info": {"username": "...", "email": "...", "name": "...", "surname": "..."}}
+
+Database connection is configured with the same environment variables as the web api.
+poetry run python -m blog.import_users users.ndjson"""
+import argparse
+import asyncio
+import itertools
+from typing import Iterator, Optional
+
+from loguru import logger
+
+from blog.dependicies import database
+from blog.model import user
+from blog.model.auth import user_password
+
+
+def _read_users(path: str) -> Iterator[user.UserCreationData]:
+    with open(path) as users_file:
+        for line in users_file:
+            if line.strip():
+                yield user.UserCreationData.parse_raw(line)
+
+
+async def import_users_file(path: str, batch_size: int, hashing_workers: Optional[int]):
+    imported = 0
+    duplicates = 0
+    seconds = 0.0
+    users = _read_users(path)
+    database.start_engines()
+    try:
+        async with database.async_engine.connect() as db_connection:
+            while batch := list(itertools.islice(users, batch_size)):
+                report = await user.import_users_async(db_connection, batch, hashing_workers)
+                imported += report.imported
+                duplicates += len(report.duplicate_usernames)
+                seconds += report.seconds
+                if report.duplicate_usernames:
+                    logger.warning('Skipped duplicate usernames: {}', ', '.join(report.duplicate_usernames))
+                if report.rejected_usernames:
+                    logger.warning('Skipped null bytes in passwords: {}', ', '.join(report.rejected_usernames))
+    finally:
+        # also when a batch fails, batches before it are committed
+        await database.dispose_engines()
+        user_password.shutdown_executor()
+    logger.info('Imported {} users, skipped {} duplicates, {:.0f} users/s',
+                imported, duplicates, imported / seconds if seconds > 0 else 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk import of users from NDJSON file')
+    parser.add_argument('path', help='NDJSON file, one UserCreationData per line')
+    parser.add_argument('--batch-size', type=int, default=10000, help='users loaded with a single COPY')
+    parser.add_argument('--hashing-workers', type=int, default=None,
+                        help='password hashing processes, CPU count by default')
+    args = parser.parse_args()
+    asyncio.run(import_users_file(args.path, args.batch_size, args.hashing_workers))
+
+
+if __name__ == '__main__':
+    main()
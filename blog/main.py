@@ -1,7 +1,16 @@
-from fastapi import FastAPI
+import asyncio
+
+from fastapi import FastAPI, Response
+from loguru import logger
 from pydantic import BaseSettings
+from starlette import status
 
-from blog.api.v1 import api as api_v1
+from blog import metrics
+from blog.api.v1 import api as api_v1, conditional
+from blog.dependicies import database
+# statements of the model layer are added to statements.registry on import of post and user
+from blog.model import post, statements, user  # noqa: F401
+from blog.model.auth import user_password
 
 
 class BlogUrlsConfig(BaseSettings):
@@ -16,3 +25,62 @@ url_config = BlogUrlsConfig()
 
 # connect V1 API using prefix
 app.include_router(api_v1.api_router, prefix=url_config.URL_PREFIX_FOR_V1_API)
+
+# ETag of list pages without versions and 304 Not Modified for them, post lists set their own ETags
+app.add_middleware(conditional.ConditionalGetMiddleware,
+                   route_paths={url_config.URL_PREFIX_FOR_V1_API + path for path in ('/users', '/posts')})
+# reads of clients go to the primary after their successful writes
+app.add_middleware(database.ReadYourWritesMiddleware)
+# request count, latency and status codes per route, for Prometheus
+app.add_middleware(metrics.PrometheusMiddleware)
+app.add_route('/metrics', metrics.metrics_endpoint, include_in_schema=False)
+
+
+@app.on_event("startup")
+async def start_database():
+    # in each worker process, after the fork
+    database.start_engines()
+    # a post read from a lagging replica would be served from post_cache to the clients reading their writes
+    post.lagging_connects.add(database.replica_connection)
+    # post_cache of this worker is not invalidated by the writes served by the other workers
+    post.fresh_connects.add(database.pinned_primary_connection)
+    database.check_statement_cache_size(statements.registry)
+    try:
+        await database.warm_up_pools()
+    except Exception:
+        logger.exception('Database is unavailable, worker is not ready')
+
+
+@app.get('/ready', include_in_schema=False)
+async def readiness(response: Response):
+    """200 when connection pools are warmed up, 503 otherwise. Warm up is retried if the database was unavailable"""
+    if not database.pools_warm:
+        try:
+            await database.warm_up_pools()
+        except Exception:
+            logger.exception('Database is unavailable, worker is not ready')
+            response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+            return {'ready': False}
+    return {'ready': True}
+
+
+@app.on_event("shutdown")
+async def shutdown_password_hashing():
+    # waits for running hashes in a thread, the loop keeps serving the other shutdown hooks
+    await asyncio.to_thread(user_password.shutdown_executor)
+
+
+@app.on_event("shutdown")
+def shutdown_metrics():
+    metrics.mark_worker_stopped()
+
+
+@app.on_event("shutdown")
+async def flush_post_writer():
+    # before the engines are disposed
+    await post.post_writer.close()
+
+
+@app.on_event("shutdown")
+async def shutdown_database():
+    await database.dispose_engines()
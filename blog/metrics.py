@@ -0,0 +1,84 @@
+"""Prometheus metrics of the web API, served at /metrics.
+
+With several uvicorn workers set PROMETHEUS_MULTIPROC_DIR to an empty directory, shared by the workers
+and cleaned before the start. Each worker writes its metrics there and /metrics sums them up."""
+import os
+import time
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# requests which did not match any route are counted together, so that random urls do not add label values
+UNMATCHED_ROUTE = '<unmatched>'
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests by route template and status code',
+                   ['method', 'route', 'status_code'])
+REQUESTS_IN_PROGRESS = Gauge('http_requests_in_progress', 'HTTP requests being processed',
+                             ['method'], multiprocess_mode='livesum')
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'HTTP request latency by route template',
+                             ['method', 'route'],
+                             buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+DB_QUERY_DURATION = Histogram('db_query_duration_seconds', 'SQL statement execution time by calling model function',
+                              ['function'],
+                              buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+LOGINS_THROTTLED = Counter('login_throttled_total', 'Login attempts rejected with 429 by limit',
+                           ['reason'])
+DB_CONNECTION_WAIT = Histogram('db_connection_wait_seconds', 'Time waiting for a connection from the pool',
+                               buckets=(0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+
+
+class PrometheusMiddleware:
+    """records count, latency and status code of each HTTP request, labeled by route template,
+    e.g. /api/v1/posts/{post_id} instead of the requested path"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        method = scope['method']
+        status_code = 500  # if app fails before the response is started
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            in_progress.dec()
+            # the router puts the matched route into the scope
+            route = scope.get('route')
+            route_template = getattr(route, 'path_format', UNMATCHED_ROUTE)
+            REQUESTS.labels(method, route_template, status_code).inc()
+            REQUEST_DURATION.labels(method, route_template).observe(duration)
+
+
+def _registry() -> CollectorRegistry:
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    """metrics of all workers in Prometheus text format"""
+    return Response(generate_latest(_registry()), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+
+def mark_worker_stopped():
+    """removes live gauges of this worker from PROMETHEUS_MULTIPROC_DIR"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
@@ -1,9 +1,40 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import weakref
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Literal, Optional
+
 from loguru import logger
 from passlib.context import CryptContext
+from pydantic import BaseSettings
 
 _pwd_context = CryptContext(schemes=["md5_crypt"], deprecated="auto")
 
 
+class PasswordHashingSettings(BaseSettings):
+    """ Pydantic will read these parameters from the environment variables, defaults are used if not set"""
+    # 'process' uses all cores, 'thread' is cheaper to start but hashing holds the GIL
+    PASSWORD_HASHING_EXECUTOR: Literal['thread', 'process'] = 'thread'
+    PASSWORD_HASHING_WORKERS: int = 2
+    # hashes running or waiting in the executor at once, other callers wait on the event loop
+    PASSWORD_HASHING_MAX_CONCURRENCY: int = 4
+    # processes hashing passwords of bulk imports, shared by concurrent imports, 0 for CPU count
+    PASSWORD_IMPORT_HASHING_WORKERS: int = 0
+
+
+password_hashing_settings = PasswordHashingSettings()
+
+# created on first use, so that forked worker processes do not share it
+_executor: Optional[Executor] = None
+# process pool of bulk imports and its number of processes, created on first import
+_import_executor: Optional[ProcessPoolExecutor] = None
+_import_workers = 0
+# asyncio.Semaphore is bound to the event loop it is used in
+_semaphores: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
 class NullInPusswordException(Exception):
     pass
 
@@ -22,3 +53,92 @@ def verify_password(plaintext_password: str, correct_password_hash: str) -> bool
     except Exception:
         logger.exception("can't verify password")
         return False
+
+
+def _process_pool(workers: int) -> ProcessPoolExecutor:
+    # the web worker already runs threads, fork would copy their locks in whatever state they are
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if password_hashing_settings.PASSWORD_HASHING_EXECUTOR == 'process':
+            _executor = _process_pool(password_hashing_settings.PASSWORD_HASHING_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=password_hashing_settings.PASSWORD_HASHING_WORKERS,
+                                           thread_name_prefix='password_hashing')
+    return _executor
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(password_hashing_settings.PASSWORD_HASHING_MAX_CONCURRENCY)
+        _semaphores[loop] = semaphore
+    return semaphore
+
+
+async def hash_password_async(password: str) -> str:
+    """hash_password in the executor, does not block the event loop
+    :raises NullInPusswordException"""
+    async with _get_semaphore():
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), hash_password, password)
+
+
+async def verify_password_async(plaintext_password: str, correct_password_hash: str) -> bool:
+    """verify_password in the executor, does not block the event loop"""
+    async with _get_semaphore():
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), verify_password,
+                                                                plaintext_password, correct_password_hash)
+
+
+def hash_passwords(passwords: list[str]) -> list[str]:
+    """hash_password for each password
+    :raises NullInPusswordException"""
+    return [hash_password(password) for password in passwords]
+
+
+def _get_import_executor(workers: Optional[int]) -> ProcessPoolExecutor:
+    global _import_executor, _import_workers
+    if _import_executor is None:
+        _import_workers = workers or password_hashing_settings.PASSWORD_IMPORT_HASHING_WORKERS or os.cpu_count() or 1
+        _import_executor = _process_pool(_import_workers)
+    return _import_executor
+
+
+async def hash_passwords_in_processes(passwords: list[str], workers: Optional[int] = None) -> list[str]:
+    """hashes many passwords for bulk imports in the import process pool, shared by concurrent imports
+    :param workers number of processes if the pool is not started yet,
+    PASSWORD_IMPORT_HASHING_WORKERS or CPU count by default
+    :returns hashes in the order of passwords
+    :raises NullInPusswordException"""
+    if not passwords:
+        return []
+    executor = _get_import_executor(workers)
+    # a few chunks per worker, so that workers finish at about the same time
+    chunk_size = max(1, len(passwords) // (_import_workers * 4))
+    loop = asyncio.get_running_loop()
+    chunks = [loop.run_in_executor(executor, hash_passwords, passwords[i:i + chunk_size])
+              for i in range(0, len(passwords), chunk_size)]
+    try:
+        hashes = await asyncio.gather(*chunks)
+    except BaseException:
+        # on error or cancellation chunks which have not started are dropped, running ones finish in the pool
+        for chunk in chunks:
+            chunk.cancel()
+        raise
+    return list(itertools.chain.from_iterable(hashes))
+
+
+def shutdown_executor():
+    """waits for running hashes and stops executor workers, and the workers of the import pool.
+    Blocks until the workers exit, call it from a thread in async code"""
+    global _executor, _import_executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+    if _import_executor is not None:
+        _import_executor.shutdown(cancel_futures=True)
+        _import_executor = None
@@ -1,3 +1,5 @@
+import hashlib
+import time
 from datetime import datetime, timedelta
 from jose import jwt, JWTError, ExpiredSignatureError
 from jose.exceptions import JWTClaimsError
@@ -7,6 +9,7 @@ from sqlalchemy.ext.asyncio import AsyncConnection
 
 from blog.model import user
 from blog.model.auth import user_password
+from blog.model.cache import LRUTTLCache
 
 
 class TokenSettings(BaseSettings):
@@ -16,6 +19,18 @@ class TokenSettings(BaseSettings):
     JWT_ACCESS_TOKEN_EXPIRE_MINUTES: int
 
 
+class VerifiedTokenCacheSettings(BaseSettings):
+    """ Pydantic will read these parameters from the environment variables, defaults are used if not set"""
+    VERIFIED_TOKEN_CACHE_MAX_SIZE: int = 10000
+
+
+verified_token_cache_settings = VerifiedTokenCacheSettings()
+
+# (token digest, secret, algorithm) -> user_id. Entries expire together with the token
+verified_token_cache = LRUTTLCache(max_size=verified_token_cache_settings.VERIFIED_TOKEN_CACHE_MAX_SIZE,
+                                   ttl_seconds=0)
+
+
 class PasswordDoesNotMatchException(Exception):
     pass
 
@@ -31,7 +46,7 @@ async def authenticate_user(username: str,
     found_user = await user.get_user_by_username(username, db_connection)
     if not found_user:
         raise user.UserNotFoundException()
-    if not user_password.verify_password(password, found_user.password_hash):
+    if not await user_password.verify_password_async(password, found_user.password_hash):
         raise PasswordDoesNotMatchException()
     jwt_token_subject = str(found_user.user_id)
     return _create_access_token(data={"sub": jwt_token_subject},
@@ -57,24 +72,54 @@ class BadTokenException(Exception):
     pass
 
 
-def decode_token_to_user_id(token: str, token_settings: TokenSettings) -> int:
-    """decodes user_if from token
-    :return user_id
+def _decode_token(token: str, token_settings: TokenSettings) -> tuple[int, float]:
+    """verifies token signature and expiration
+    :returns (user_id, expiration unix timestamp)
     :raises BadTokenException"""
-    bad_token_exception = BadTokenException()
     try:
         payload = jwt.decode(token, token_settings.JWT_SECRET_KEY,
                              algorithms=[token_settings.JWT_ENCODE_ALGORITHM])
-        user_id: int = int(payload.get("sub"))
-        if user_id is None:
-            raise bad_token_exception
+        subject = payload.get("sub")
+        if subject is None:
+            raise BadTokenException()
+        user_id: int = int(subject)
     except ExpiredSignatureError:
         logger.info('signature is expired')
-        raise bad_token_exception
+        raise BadTokenException()
     except JWTClaimsError:
         logger.info('If any claim is invalid in any way')
-        raise bad_token_exception
+        raise BadTokenException()
     except JWTError:
         logger.info('the token signature is invalid in any way')
-        raise bad_token_exception
+        raise BadTokenException()
+    except ValueError:
+        logger.info('subject is not user_id')
+        raise BadTokenException()
+    return user_id, float(payload.get("exp", 0))
+
+
+def decode_token_to_user_id(token: str, token_settings: TokenSettings) -> int:
+    """decodes user_if from token
+    :return user_id
+    :raises BadTokenException"""
+    user_id, _ = _decode_token(token, token_settings)
+    return user_id
+
+
+def decode_token_to_user_id_cached(token: str, token_settings: TokenSettings) -> int:
+    """decode_token_to_user_id, remembering verified tokens in verified_token_cache until they expire.
+    Only successfully verified tokens are cached.
+    :return user_id
+    :raises BadTokenException"""
+    # secret is a part of the key, so the token is verified again if settings change
+    key = (hashlib.sha256(token.encode()).digest(),
+           token_settings.JWT_SECRET_KEY,
+           token_settings.JWT_ENCODE_ALGORITHM)
+    user_id = verified_token_cache.get(key)
+    if user_id is not None:
+        return user_id
+    user_id, expires_at = _decode_token(token, token_settings)
+    ttl_seconds = expires_at - time.time()
+    if ttl_seconds > 0:
+        verified_token_cache.put(key, user_id, ttl_seconds=ttl_seconds)
     return user_id
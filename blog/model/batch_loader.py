@@ -0,0 +1,82 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, Iterable, Optional
+
+from pydantic import BaseModel
+
+
+class BatchLoaderStats(BaseModel):
+    # keys requested by callers
+    loads: int
+    # calls of load_batch, e.g. queries
+    batches: int
+    keys_per_batch: float
+
+
+class BatchLoader:
+    """DataLoader style batching: keys requested in the same event loop iteration are loaded
+    with one call of load_batch(source, keys), e.g. one WHERE id IN (...) query instead of one query per key.
+    Batches are per event loop and per source, e.g. per connect function.
+    A cancelled caller does not cancel the batch for the others. Results are not kept, it is not a cache."""
+
+    def __init__(self, load_batch: Callable[[Hashable, list[Hashable]], Awaitable[dict[Hashable, Any]]],
+                 max_batch_size: int = 100):
+        """:param load_batch returns key -> value for the found keys, missing keys are loaded as None"""
+        self._load_batch = load_batch
+        self.max_batch_size = max_batch_size
+        # (event loop, source) -> key -> future of the batch being collected
+        self._pending: dict[tuple[asyncio.AbstractEventLoop, Hashable], dict[Hashable, asyncio.Future]] = {}
+        # tasks of dispatched batches, referenced until they are done
+        self._running: set[asyncio.Task] = set()
+        self.loads = 0
+        self.batches = 0
+
+    async def load(self, source: Hashable, key: Hashable) -> Optional[Any]:
+        """:returns value of key or None if it is not found"""
+        return (await self.load_many(source, [key]))[key]
+
+    async def load_many(self, source: Hashable, keys: Iterable[Hashable]) -> dict[Hashable, Optional[Any]]:
+        """:returns key -> value or None if it is not found, for each of keys"""
+        loop = asyncio.get_running_loop()
+        batch_key = (loop, source)
+        pending = self._pending.get(batch_key)
+        if pending is None:
+            pending = self._pending[batch_key] = {}
+            # runs after the callbacks which are ready now, i.e. after the other callers of this iteration
+            loop.call_soon(self._dispatch, batch_key)
+        futures = {}
+        for key in keys:
+            self.loads += 1
+            if key not in pending:
+                pending[key] = loop.create_future()
+            futures[key] = pending[key]
+        results = await asyncio.shield(asyncio.gather(*futures.values()))
+        return dict(zip(futures.keys(), results))
+
+    def _dispatch(self, batch_key):
+        pending = self._pending.pop(batch_key)
+        keys = list(pending.keys())
+        for start in range(0, len(keys), self.max_batch_size):
+            batch = {key: pending[key] for key in keys[start:start + self.max_batch_size]}
+            task = asyncio.ensure_future(self._run(batch_key[1], batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, source: Hashable, batch: dict[Hashable, asyncio.Future]):
+        self.batches += 1
+        try:
+            found = await self._load_batch(source, list(batch.keys()))
+        except asyncio.CancelledError:
+            for future in batch.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in batch.values():
+                future.set_exception(e)
+                future.exception()  # retrieved, even if all callers were cancelled
+        else:
+            for key, future in batch.items():
+                future.set_result(found.get(key))
+
+    def stats(self) -> BatchLoaderStats:
+        return BatchLoaderStats(loads=self.loads, batches=self.batches,
+                                keys_per_batch=self.loads / self.batches if self.batches else 0.0)
@@ -0,0 +1,112 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from pydantic import BaseModel
+
+
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+    max_size: int
+
+
+class LRUTTLCache:
+    """In-process cache, bounded by size and by entry time to live.
+    Least recently used entry is evicted when the cache is full.
+    Not shared between worker processes.
+
+    Every write of a key, put without generation or invalidate, bumps the generation of the key.
+    A read through fill takes generation(key) before reading the source and passes it to put,
+    the value is not cached if the key was written meanwhile, so a slow read does not overwrite a newer write."""
+
+    def __init__(self, max_size: int, ttl_seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        # key -> (expires_at, value), most recently used at the end
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> generation of its last write, the oldest are forgotten beyond max_size keys
+        self._written: OrderedDict[Hashable, int] = OrderedDict()
+        self._last_generation = 0
+        # generation of keys without a write in _written, the newest forgotten one
+        self._forgotten_generation = 0
+
+    def generation(self, key: Hashable) -> int:
+        """changes on every write of key, pass it to put when caching a value read from the source"""
+        return self._written.get(key, self._forgotten_generation)
+
+    @property
+    def last_generation(self) -> int:
+        """changes on every write of any key"""
+        return self._last_generation
+
+    def _bump(self, key: Hashable):
+        self._last_generation += 1
+        self._written[key] = self._last_generation
+        self._written.move_to_end(key)
+        while len(self._written) > max(self.max_size, 1):
+            _, self._forgotten_generation = self._written.popitem(last=False)
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """cached value or None, without counting a hit or a miss and without making it recently used"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= self._clock():
+            return None
+        return entry[1]
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """:returns cached value or None if key is not cached or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None,
+            generation: Optional[int] = None) -> bool:
+        """caches value, evicting least recently used entries if cache is full
+        :param ttl_seconds overrides cache ttl_seconds for this entry
+        :param generation of key before value was read, None if value is written by the caller
+        :returns False if value is not cached because key was written after generation"""
+        if generation is None:
+            self._bump(key)
+        elif generation != self.generation(key):
+            return False
+        if self.max_size <= 0:
+            return False
+        if ttl_seconds is None:
+            ttl_seconds = self.ttl_seconds
+        self._entries[key] = (self._clock() + ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return True
+
+    def invalidate(self, key: Hashable):
+        self._bump(key)
+        self._entries.pop(key, None)
+
+    def clear(self):
+        """writes all keys, values read before are not cached"""
+        self._entries.clear()
+        self._written.clear()
+        self._last_generation += 1
+        self._forgotten_generation = self._last_generation
+
+    def stats(self) -> CacheStats:
+        return CacheStats(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                          size=len(self._entries), max_size=self.max_size)
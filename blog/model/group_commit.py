@@ -0,0 +1,124 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, Optional, Union
+
+from pydantic import BaseModel
+
+
+class GroupCommitStats(BaseModel):
+    # items submitted by callers
+    items: int
+    # calls of write_batch, e.g. transactions
+    batches: int
+    items_per_batch: float
+    # items waiting for the next batch
+    queued: int
+
+
+class _Writer:
+    """items waiting to be written for one event loop and source, and the task writing them"""
+
+    def __init__(self):
+        # (item, future of its result, loop time when it was submitted)
+        self.queue: list[tuple[Any, asyncio.Future, float]] = []
+        self.has_items = asyncio.Event()
+        self.batch_full = asyncio.Event()
+        self.closing = False
+        self.task: Optional[asyncio.Task] = None
+
+
+class GroupCommitQueue:
+    """Write-behind queue: items submitted by concurrent callers are written by a background task
+    with one call of write_batch(source, items), e.g. one transaction instead of one per item.
+    A batch is written max_delay_seconds after its first item or when it has max_batch_size items,
+    whichever comes first, so each caller waits at most max_delay_seconds longer than the write itself.
+    Writers are per event loop and per source, e.g. per connect function.
+    Each caller gets the result or the exception of its own item. A cancelled caller does not cancel its write."""
+
+    def __init__(self, write_batch: Callable[[Hashable, list[Any]], Awaitable[list[Union[Any, Exception]]]],
+                 max_batch_size: int = 100, max_delay_seconds: float = 0.005):
+        """:param write_batch returns result or exception of each of items, in the order of items.
+        If it raises, the exception goes to all callers of the batch"""
+        self._write_batch = write_batch
+        self.max_batch_size = max_batch_size
+        self.max_delay_seconds = max_delay_seconds
+        # (event loop, source) -> writer
+        self._writers: dict[tuple[asyncio.AbstractEventLoop, Hashable], _Writer] = {}
+        self.items = 0
+        self.batches = 0
+
+    async def submit(self, source: Hashable, item: Any) -> Any:
+        """:returns result of item, after the batch with it is written
+        :raises exception of item"""
+        loop = asyncio.get_running_loop()
+        writer_key = (loop, source)
+        writer = self._writers.get(writer_key)
+        if writer is None or writer.closing or writer.task.done():
+            writer = self._writers[writer_key] = _Writer()
+            writer.task = asyncio.ensure_future(self._write_forever(source, writer))
+        future = loop.create_future()
+        writer.queue.append((item, future, loop.time()))
+        self.items += 1
+        writer.has_items.set()
+        if len(writer.queue) >= self.max_batch_size:
+            writer.batch_full.set()
+        return await asyncio.shield(future)
+
+    async def _write_forever(self, source: Hashable, writer: _Writer):
+        try:
+            while writer.queue or not writer.closing:
+                await writer.has_items.wait()
+                delay = 0.0
+                if writer.queue and not writer.closing:
+                    # items submitted during the previous write have waited already
+                    delay = writer.queue[0][2] + self.max_delay_seconds - asyncio.get_running_loop().time()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(writer.batch_full.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                batch, writer.queue = writer.queue[:self.max_batch_size], writer.queue[self.max_batch_size:]
+                if len(writer.queue) < self.max_batch_size:
+                    writer.batch_full.clear()
+                if not writer.queue and not writer.closing:
+                    writer.has_items.clear()
+                if batch:
+                    await self._write(source, batch)
+        finally:
+            # e.g. the writer is cancelled, callers of the items left in the queue do not wait forever
+            for _, future, _ in writer.queue:
+                future.cancel()
+
+    async def _write(self, source: Hashable, batch: list[tuple[Any, asyncio.Future, float]]):
+        self.batches += 1
+        try:
+            try:
+                results = await self._write_batch(source, [item for item, _, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, future, _), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                    future.exception()  # retrieved, even if the caller was cancelled
+                else:
+                    future.set_result(result)
+        finally:
+            # e.g. the write is cancelled or write_batch returned too few results, callers do not wait forever
+            for _, future, _ in batch:
+                if not future.done():
+                    future.cancel()
+
+    async def close(self):
+        """writes the queued items and stops the writers of the running event loop, e.g. on shutdown"""
+        loop = asyncio.get_running_loop()
+        writers = [(key, writer) for key, writer in self._writers.items() if key[0] is loop]
+        for key, writer in writers:
+            writer.closing = True
+            writer.has_items.set()
+            writer.batch_full.set()  # stops waiting for the delay
+            del self._writers[key]
+        await asyncio.gather(*(writer.task for _, writer in writers))
+
+    def stats(self) -> GroupCommitStats:
+        return GroupCommitStats(items=self.items, batches=self.batches,
+                                items_per_batch=self.items / self.batches if self.batches else 0.0,
+                                queued=sum(len(writer.queue) for writer in self._writers.values()))
@@ -0,0 +1,27 @@
+import base64
+import json
+from typing import Any
+
+
+class BadCursorException(Exception):
+    pass
+
+
+def encode_cursor(*keys: Any) -> str:
+    """packs keyset pagination keys (e.g. last seen post_id) into an opaque url-safe string"""
+    raw = json.dumps(list(keys), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, keys_count: int = 1) -> list[Any]:
+    """unpacks cursor created by encode_cursor
+    :returns list of keys_count keys
+    :raises BadCursorException if cursor was not created by encode_cursor"""
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        keys = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (ValueError, TypeError):
+        raise BadCursorException()
+    if not isinstance(keys, list) or len(keys) != keys_count:
+        raise BadCursorException()
+    return keys
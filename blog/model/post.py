@@ -1,14 +1,23 @@
-from typing import Optional
+import datetime
+import json
+import re
+from typing import Optional, AsyncIterator, Union, Callable, AsyncContextManager
 
 import sqlalchemy
 from loguru import logger
-from pydantic import BaseModel, Field
-from sqlalchemy import text
+from pydantic import BaseModel, BaseSettings, Field
+from sqlalchemy import bindparam
 from sqlalchemy.engine import LegacyCursorResult
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncConnection
 from retry import retry
 
+from blog.model import statements
+from blog.model.batch_loader import BatchLoader
+from blog.model.cache import LRUTTLCache
+from blog.model.group_commit import GroupCommitQueue
+from blog.model.single_flight import SingleFlight
+
 
 class PostInfo(BaseModel):
     title: str = Field(..., min_length=1,
@@ -16,56 +25,463 @@ class PostInfo(BaseModel):
     body: str = Field(..., min_length=0,
                       max_length=10000)
 
+    class Config:
+        # shared by the callers of a coalesced read and kept in post_cache
+        allow_mutation = False
+
 
 class Post(BaseModel):
     post_id: int
     author_id: int
     post_info: PostInfo
 
+    class Config:
+        # shared by the callers of a coalesced read and kept in post_cache
+        allow_mutation = False
+
+
+class PostUpdate(BaseModel):
+    post_id: int
+    post_info: PostInfo
+
+
+class PostVersion(BaseModel):
+    """incremented by every update of the post, blog_009 migration"""
+    version: int
+    updated_at: datetime.datetime
+
+    class Config:
+        allow_mutation = False
+
+
+class PostCacheSettings(BaseSettings):
+    """ Pydantic will read these parameters from the environment variables, defaults are used if not set"""
+    POST_CACHE_MAX_SIZE: int = 1024
+    POST_CACHE_TTL_SECONDS: float = 30.0
+    # post_ids read with one query by post_loader
+    POST_LOADER_MAX_BATCH_SIZE: int = 100
+
+
+post_cache_settings = PostCacheSettings()
+
+
+class PostWriteSettings(BaseSettings):
+    """ Pydantic will read these parameters from the environment variables, defaults are used if not set"""
+    # POST /posts/ creates posts of concurrent requests in one transaction, one commit instead of one per post
+    POST_WRITE_BEHIND: bool = False
+    # a batch is written this long after its first post or when it is full, the added latency at most
+    POST_WRITE_BEHIND_MAX_DELAY_SECONDS: float = 0.005
+    POST_WRITE_BEHIND_MAX_BATCH_SIZE: int = 100
+
+
+post_write_settings = PostWriteSettings()
+
+# post_id -> (Post, PostVersion), filled by get_post_with_version_cached_async,
+# updated by update_post and delete_post_async, which bump the generation of post_id
+post_cache = LRUTTLCache(max_size=post_cache_settings.POST_CACHE_MAX_SIZE,
+                         ttl_seconds=post_cache_settings.POST_CACHE_TTL_SECONDS)
+
+# opens a connection on demand, e.g. database.replica_connection.
+# Reads which share a query do not take connections at all
+Connect = Callable[[], AsyncContextManager[AsyncConnection]]
+
+# connect functions which may read older data than the last write, e.g. database.replica_connection.
+# Posts read through them are not put into post_cache, where clients reading from the primary would find them
+lagging_connects: set[Connect] = set()
+# connect functions of clients which must read their own writes, e.g. database.pinned_primary_connection.
+# Reads through them do not look up post_cache, a write served by another worker process did not invalidate it
+fresh_connects: set[Connect] = set()
+
+# concurrent identical reads of *_coalesced_async functions share one query.
+# Keys include post_cache generations, so a read which starts after a write does not join a query started before it
+single_flight = SingleFlight()
+
+
+def post_row_to_dict(row: sqlalchemy.engine.Row) -> dict:
+    """(post_id, user_id, title, body) row to a dict, which is serialized to the same JSON as Post"""
+    post_id, user_id, title, body = row
+    return {'post_id': post_id, 'author_id': user_id, 'post_info': {'title': title, 'body': body}}
+
+
+def _post_from_row(row: sqlalchemy.engine.Row) -> Post:
+    """Post from a (post_id, user_id, title, body) row without validation.
+    Columns are already checked by the DB schema and by validation of the data that was written."""
+    post_id, user_id, title, body = row
+    return Post.construct(author_id=user_id,
+                          post_id=post_id,
+                          post_info=PostInfo.construct(title=title,
+                                                       body=body))
+
+
+_GET_ALL_POSTS_ROWS = statements.registry.add(
+    'post.get_all_posts_rows',
+    """SELECT post_id, user_id, title, body
+    FROM blog_post
+    ORDER BY post_id
+    LIMIT :limit OFFSET :skip""")
+
 
 @retry(tries=2, logger=logger)
+async def get_all_posts_rows_async(db_connection: AsyncConnection,
+                                   skip: int = 0, limit: int = 10 ** 6) -> list[sqlalchemy.engine.Row]:
+    """Same as get_all_posts_async, but returns (post_id, user_id, title, body) rows without validation.
+    Starts and commits a new transaction.
+    """
+    params = {'skip': skip, 'limit': limit}
+    async with db_connection.begin():  # within transaction
+        result = await db_connection.execute(_GET_ALL_POSTS_ROWS, parameters=params)
+        return result.fetchall()
+
+
+async def get_all_posts_coalesced_async(connect: Connect, skip: int = 0, limit: int = 10) -> list[Post]:
+    """get_all_posts_async, concurrent calls with the same arguments share one query on one connection"""
+    async def query():
+        async with connect() as db_connection:
+            return await get_all_posts_async(db_connection, skip, limit)
+    return await single_flight.do(('get_all_posts_async', connect, skip, limit, post_cache.last_generation), query)
+
+
 async def get_all_posts_async(db_connection: AsyncConnection,
                               skip: int = 0, limit: int = 10 ** 6) -> list[Post]:
     """Returns all posts from database asynchronously.
     params skip and limit work the same way as for lists
     Starts and commits a new transaction.
     """
-    posts = []
-    statement = text("""SELECT
-                            post_id, user_id, title, body
-                        FROM blog_post
-                        LIMIT :limit OFFSET :skip""")
-    params = {'skip': skip, 'limit': limit}
+    return [_post_from_row(row) for row in await get_all_posts_rows_async(db_connection, skip, limit)]
+
+
+_GET_POSTS_AFTER_ROWS = statements.registry.add(
+    'post.get_posts_after_rows',
+    """SELECT post_id, user_id, title, body
+    FROM blog_post
+    WHERE post_id > :after_post_id
+    ORDER BY post_id
+    LIMIT :limit""")
+
+
+async def get_posts_after_rows_async(db_connection: AsyncConnection,
+                                     after_post_id: int = 0, limit: int = 10) -> list[sqlalchemy.engine.Row]:
+    """Same as get_posts_after_async, but returns (post_id, user_id, title, body) rows without validation.
+    Starts and commits a new transaction.
+    """
+    params = {'after_post_id': after_post_id, 'limit': limit}
+    async with db_connection.begin():  # within transaction
+        result = await db_connection.execute(_GET_POSTS_AFTER_ROWS, parameters=params)
+        return result.fetchall()
+
+
+async def get_posts_after_async(db_connection: AsyncConnection,
+                                after_post_id: int = 0, limit: int = 10) -> list[Post]:
+    """Returns 'limit' posts with post_id > after_post_id, ordered by post_id.
+    Keyset pagination: uses primary key index seek, so deep pages cost the same as the first one.
+    Starts and commits a new transaction.
+    """
+    return [_post_from_row(row) for row in await get_posts_after_rows_async(db_connection, after_post_id, limit)]
+
+
+_GET_USER_POSTS = statements.registry.add(
+    'post.get_user_posts',
+    """SELECT post_id, user_id, title, body
+    FROM blog_post
+    WHERE user_id = :user_id AND post_id > :after_post_id
+    ORDER BY post_id
+    LIMIT :limit""")
+
+
+async def get_user_posts_async(db_connection: AsyncConnection, user_id: int,
+                               after_post_id: int = 0, limit: int = 10) -> list[Post]:
+    """Returns 'limit' posts of user_id with post_id > after_post_id, ordered by post_id.
+    Keyset pagination over (user_id, post_id) index from blog_008 migration.
+    Starts and commits a new transaction.
+    """
+    params = {'user_id': user_id, 'after_post_id': after_post_id, 'limit': limit}
+    async with db_connection.begin():  # within transaction
+        result = await db_connection.execute(_GET_USER_POSTS, parameters=params)
+        return [_post_from_row(row) for row in result.fetchall()]
+
+
+_GET_PAGE_VERSIONS = statements.registry.add(
+    'post.get_page_versions',
+    """SELECT post_id, version
+    FROM blog_post
+    ORDER BY post_id
+    LIMIT :limit OFFSET :skip""")
+_GET_PAGE_VERSIONS_AFTER = statements.registry.add(
+    'post.get_page_versions_after',
+    """SELECT post_id, version
+    FROM blog_post
+    WHERE post_id > :after_post_id
+    ORDER BY post_id
+    LIMIT :limit""")
+_GET_USER_PAGE_VERSIONS = statements.registry.add(
+    'post.get_user_page_versions',
+    """SELECT post_id, version
+    FROM blog_post
+    WHERE user_id = :user_id AND post_id > :after_post_id
+    ORDER BY post_id
+    LIMIT :limit""")
+
+
+async def get_page_versions_async(db_connection: AsyncConnection, limit: int, skip: int = 0,
+                                  after_post_id: Optional[int] = None,
+                                  user_id: Optional[int] = None) -> list[tuple[int, int]]:
+    """(post_id, version) of the posts of the page of get_all_posts_async, of get_posts_after_async
+    if after_post_id is set, or of get_user_posts_async if user_id is set, without reading titles and bodies.
+    Starts and commits a new transaction.
+    """
+    if user_id is not None:
+        statement = _GET_USER_PAGE_VERSIONS
+        params = {'user_id': user_id, 'after_post_id': after_post_id or 0, 'limit': limit}
+    elif after_post_id is not None:
+        statement = _GET_PAGE_VERSIONS_AFTER
+        params = {'after_post_id': after_post_id, 'limit': limit}
+    else:
+        statement = _GET_PAGE_VERSIONS
+        params = {'skip': skip, 'limit': limit}
     async with db_connection.begin():  # within transaction
         result = await db_connection.execute(statement, parameters=params)
-        rows = result.fetchall()
-        for post_id, user_id, title, body in rows:
-            posts.append(Post(author_id=user_id,
-                              post_id=post_id,
-                              post_info=PostInfo(title=title,
-                                                 body=body)))
-    return posts
+        return [(post_id, version) for post_id, version in result.fetchall()]
+
+
+_STREAM_ALL_POSTS = statements.registry.add(
+    'post.stream_all_posts',
+    """SELECT post_id, user_id, title, body
+    FROM blog_post
+    ORDER BY post_id""")
+
+
+async def stream_all_posts_async(db_connection: AsyncConnection,
+                                 batch_size: int = 1000) -> AsyncIterator[list[Post]]:
+    """Yields all posts ordered by post_id in batches of batch_size.
+    Rows are read through server side cursor, so memory usage does not depend on the table size.
+    Starts a new transaction, which is committed when all batches are consumed.
+    """
+    async with db_connection.begin():  # within transaction
+        result = await db_connection.stream(_STREAM_ALL_POSTS)
+        async for rows in result.partitions(batch_size):
+            yield [_post_from_row(row) for row in rows]
+
+
+_GET_POST_BY_ID = statements.registry.add(
+    'post.get_post_by_id',
+    """SELECT post_id, user_id, title, body
+    FROM blog_post
+    WHERE post_id = :post_id""")
 
 
 async def get_post_by_id_async(post_id: int, db_connection: AsyncConnection) -> Optional[Post]:
     """filter posts by post_id"""
     logger.debug(f'Looking for post {post_id}')
     try:
-        statement = text("""SELECT post_id, user_id, title, body
-        FROM blog_post
-        WHERE post_id = :post_id""")
         params = {'post_id': post_id}
-        result = await db_connection.execute(statement, parameters=params)
+        result = await db_connection.execute(_GET_POST_BY_ID, parameters=params)
         rows = result.fetchall()
     except Exception:
         logger.exception('Unknown DB exception')
         return None
     else:
-        for post_id, user_id, title, body in rows:
-            return Post(post_id=post_id, author_id=user_id,
-                        post_info=PostInfo(title=title,
-                                           body=body))
+        for row in rows:
+            return _post_from_row(row)
+        return None
+
+
+_GET_POST_WITH_VERSION = statements.registry.add(
+    'post.get_post_with_version',
+    """SELECT post_id, user_id, title, body, version, updated_at
+    FROM blog_post
+    WHERE post_id = :post_id""")
+
+
+async def get_post_with_version_async(post_id: int,
+                                      db_connection: AsyncConnection) -> Optional[tuple[Post, PostVersion]]:
+    """filter posts by post_id
+    Starts and commits a new transaction.
+
+    :returns post and its version or None if post is not found"""
+    async with db_connection.begin():  # within transaction
+        result = await db_connection.execute(_GET_POST_WITH_VERSION, parameters={'post_id': post_id})
+        row = result.fetchone()
+    if row is None:
+        return None
+    return _post_with_version_from_row(row)
+
+
+def _post_with_version_from_row(row: sqlalchemy.engine.Row) -> tuple[Post, PostVersion]:
+    post_id, user_id, title, body, version, updated_at = row
+    return _post_from_row((post_id, user_id, title, body)), PostVersion(version=version, updated_at=updated_at)
+
+
+_GET_POSTS_WITH_VERSIONS = statements.registry.add(
+    'post.get_posts_with_versions',
+    """SELECT post_id, user_id, title, body, version, updated_at
+    FROM blog_post
+    WHERE post_id IN :post_ids""",
+    bindparam('post_ids', expanding=True))
+
+
+async def get_posts_with_versions_async(post_ids: list[int],
+                                        db_connection: AsyncConnection) -> dict[int, tuple[Post, PostVersion]]:
+    """filter posts by many post_ids with one query
+    Starts and commits a new transaction.
+
+    :returns post_id -> post and its version, for the found posts"""
+    async with db_connection.begin():  # within transaction
+        result = await db_connection.execute(_GET_POSTS_WITH_VERSIONS, parameters={'post_ids': post_ids})
+        rows = result.fetchall()
+    return {row[0]: _post_with_version_from_row(row) for row in rows}
+
+
+def _fill_post_cache(post_id: int, post_with_version: tuple[Post, PostVersion], generation: int):
+    """caches a post read when post_cache had generation for post_id.
+    A post updated or deleted during the read is cached only if the read found a newer version than the cached one,
+    so a read which started before a write does not bring back the old post"""
+    if post_cache.put(post_id, post_with_version, generation=generation):
+        return
+    cached = post_cache.peek(post_id)
+    if cached is not None and cached[1].version < post_with_version[1].version:
+        post_cache.put(post_id, post_with_version, generation=post_cache.generation(post_id))
+
+
+async def _load_posts_with_versions(connect: Connect, post_ids: list[int]) -> dict[int, tuple[Post, PostVersion]]:
+    generations = {post_id: post_cache.generation(post_id) for post_id in post_ids}
+    async with connect() as db_connection:
+        found = await get_posts_with_versions_async(post_ids, db_connection)
+    if connect in lagging_connects:
+        return found
+    for post_id, post_with_version in found.items():
+        _fill_post_cache(post_id, post_with_version, generations[post_id])
+    return found
+
+
+# cache misses of get_post_with_version_cached_async and get_posts_cached_async
+# in the same event loop iteration are read with one query, per connect function
+post_loader = BatchLoader(_load_posts_with_versions, max_batch_size=post_cache_settings.POST_LOADER_MAX_BATCH_SIZE)
+
+
+_GET_POST_VERSION = statements.registry.add(
+    'post.get_post_version',
+    """SELECT version, updated_at FROM blog_post WHERE post_id = :post_id""")
+
+
+async def _get_post_version_async(post_id: int, db_connection: AsyncConnection) -> Optional[PostVersion]:
+    async with db_connection.begin():  # within transaction
+        result = await db_connection.execute(_GET_POST_VERSION, parameters={'post_id': post_id})
+        row = result.fetchone()
+    if row is None:
         return None
+    version, updated_at = row
+    return PostVersion(version=version, updated_at=updated_at)
+
+
+async def get_post_version_async(post_id: int, connect: Connect) -> Optional[PostVersion]:
+    """version of the post without reading its title and body. post_cache is not used,
+    check is_post_cached first, a cached post has its version.
+    Concurrent calls for the same post_id share one query.
+
+    :returns None if post is not found"""
+    async def query():
+        async with connect() as db_connection:
+            return await _get_post_version_async(post_id, db_connection)
+    return await single_flight.do(('get_post_version_async', connect, post_id, post_cache.generation(post_id)), query)
+
+
+def is_post_cached(post_id: int, connect: Connect) -> bool:
+    """whether get_post_with_version_cached_async finds the post in post_cache, a hit or a miss is not counted"""
+    return connect not in fresh_connects and post_cache.peek(post_id) is not None
+
+
+async def get_post_with_version_cached_async(post_id: int, connect: Connect) -> Optional[tuple[Post, PostVersion]]:
+    """get_post_with_version_async, reading through post_cache.
+    Concurrent cache misses for the same post_id share one query,
+    misses for other post_ids in the same event loop iteration are read with it by post_loader.
+    Posts changed by other worker processes may be stale for up to POST_CACHE_TTL_SECONDS,
+    except for reads through fresh_connects"""
+    cached = post_cache.get(post_id) if connect not in fresh_connects else None
+    if cached is not None:
+        return cached
+
+    async def query():
+        return await post_loader.load(connect, post_id)
+    key = ('get_post_with_version_async', connect, post_id, post_cache.generation(post_id))
+    return await single_flight.do(key, query)
+
+
+async def get_post_by_id_cached_async(post_id: int, connect: Connect) -> Optional[Post]:
+    """filter posts by post_id, reading through post_cache."""
+    found = await get_post_with_version_cached_async(post_id, connect)
+    return found[0] if found else None
+
+
+async def get_posts_cached_async(post_ids: list[int], connect: Connect) -> list[Post]:
+    """filter posts by many post_ids, reading through post_cache.
+    Cache misses are read with one query, together with the other misses of this event loop iteration.
+
+    :returns found posts in the order of post_ids, without duplicates"""
+    post_ids = list(dict.fromkeys(post_ids))
+    found = {}
+    if connect not in fresh_connects:
+        for post_id in post_ids:
+            cached = post_cache.get(post_id)
+            if cached is not None:
+                found[post_id] = cached
+    missing = [post_id for post_id in post_ids if post_id not in found]
+    if missing:
+        found.update(await post_loader.load_many(connect, missing))
+    return [found[post_id][0] for post_id in post_ids if found[post_id] is not None]
+
+
+# ts_rank of title and body against the query, blog_007 migration keeps search_vector and its GIN index
+_SEARCH_POSTGRES = """SELECT post_id, user_id, title, body, rank FROM (
+                            SELECT post_id, user_id, title, body, ts_rank(search_vector, query) AS rank
+                            FROM blog_post, websearch_to_tsquery('english', :query) query
+                            WHERE search_vector @@ query) ranked"""
+# sqlite stand-in for tests: FTS5 table blog_post_search(title, body) with content='blog_post'
+_SEARCH_SQLITE = """SELECT post_id, user_id, title, body, rank FROM (
+                            SELECT blog_post.post_id, blog_post.user_id, blog_post.title, blog_post.body,
+                                -bm25(blog_post_search) AS rank
+                            FROM blog_post_search JOIN blog_post ON blog_post.post_id = blog_post_search.rowid
+                            WHERE blog_post_search MATCH :query) ranked"""
+# keyset pagination and order of both searches
+_SEARCH_AFTER = """
+                        WHERE rank < :after_rank OR (rank = :after_rank AND post_id > :after_post_id)"""
+_SEARCH_ORDER = """
+                        ORDER BY rank DESC, post_id
+                        LIMIT :limit"""
+# (search, page after the first) -> statement
+_SEARCH_STATEMENTS = {
+    (search, after): statements.registry.add(f'post.search_posts.{search}' + ('.after' if after else ''),
+                                             sql + (_SEARCH_AFTER if after else '') + _SEARCH_ORDER,
+                                             dialect=dialect)
+    for search, dialect, sql in (('postgres', 'postgresql', _SEARCH_POSTGRES), ('sqlite', 'sqlite', _SEARCH_SQLITE))
+    for after in (False, True)}
+
+
+async def search_posts_async(db_connection: AsyncConnection,
+                             query: str,
+                             after_rank: Optional[float] = None,
+                             after_post_id: int = 0,
+                             limit: int = 10) -> list[tuple[Post, float]]:
+    """Full-text search in post titles and bodies, best matches first.
+    Keyset pagination: pass rank and post_id of the last result of the previous page.
+    Starts and commits a new transaction.
+
+    :returns (post, rank) pairs ordered by rank descending, then by post_id"""
+    if db_connection.dialect.name == 'sqlite':
+        # FTS5 query syntax treats punctuation as operators, search for quoted words only
+        query = ' '.join(f'"{word}"' for word in re.findall(r'\w+', query))
+        search = 'sqlite'
+    else:
+        search = 'postgres'
+    if not query.strip():
+        return []
+    params = {'query': query, 'limit': limit}
+    if after_rank is not None:
+        params.update({'after_rank': after_rank, 'after_post_id': after_post_id})
+    statement = _SEARCH_STATEMENTS[search, after_rank is not None]
+    async with db_connection.begin():  # within transaction
+        result = await db_connection.execute(statement, parameters=params)
+        return [(_post_from_row((post_id, user_id, title, body)), rank)
+                for post_id, user_id, title, body, rank in result.fetchall()]
 
 
 class UnknownException(Exception):
@@ -76,6 +492,13 @@ class NoSuchUseridException(Exception):
     pass
 
 
+_CREATE_POST = statements.registry.add(
+    'post.create_post',
+    """INSERT INTO blog_post(user_id, title, body)
+    VALUES (:user_id, :title, :body)
+    RETURNING post_id""")
+
+
 async def create_post(user_id: int, post_info: PostInfo, db_connection: AsyncConnection) -> Post:
     """creates new post and saves it
     Starts and commits a new transaction.
@@ -83,21 +506,18 @@ async def create_post(user_id: int, post_info: PostInfo, db_connection: AsyncCon
     :raises NoSuchUseridException if user_id is not found in system"""
     async with db_connection.begin():
         try:
-            statement = text(
-                """INSERT INTO blog_post(user_id, title, body)
-                VALUES (:user_id, :title, :body)
-                RETURNING post_id""")
             params = {'user_id': user_id, 'title': post_info.title, 'body': post_info.body}
-            result = await db_connection.execute(statement, parameters=params)
+            result = await db_connection.execute(_CREATE_POST, parameters=params)
             row: sqlalchemy.engine.Row = result.fetchone()
             post_id = row[0]
         # except (UniqueViolation, sqlite3.IntegrityError) as uve:
         except IntegrityError:
-            logger.debug('No user with id={user_id} ', user_id)
+            logger.debug('No user with id={} ', user_id)
             raise NoSuchUseridException()
-        else:
-            logger.debug('post_id={} for user_id={} is created', post_id, user_id)
-            return Post(post_id=post_id, author_id=user_id, post_info=post_info)
+    # transaction is committed, lists of posts read before are not shared with later reads
+    post_cache.invalidate(post_id)
+    logger.debug('post_id={} for user_id={} is created', post_id, user_id)
+    return Post(post_id=post_id, author_id=user_id, post_info=post_info)
 
 
 class PostNotFoundException(Exception):
@@ -108,77 +528,342 @@ class NotYourPostException(Exception):
     pass
 
 
-@retry(exceptions=IntegrityError)
+class PostVersionMismatchException(Exception):
+    """post was changed since the version the client has seen"""
+    pass
+
+
+_NOT_CHANGED_REASON = statements.registry.add(
+    'post.not_changed_reason',
+    """SELECT user_id FROM blog_post WHERE post_id = :post_id""")
+
+
+async def _not_changed_reason(post_id: int, db_connection: AsyncConnection,
+                              caller_user_id: Optional[int] = None) -> Exception:
+    """called when owner-checked UPDATE or DELETE changed nothing, only on this failure path.
+    :param caller_user_id set if UPDATE also checked the version
+    :returns PostNotFoundException, NotYourPostException or PostVersionMismatchException"""
+    result = await db_connection.execute(_NOT_CHANGED_REASON, parameters={'post_id': post_id})
+    row = result.fetchone()
+    if row is None:
+        return PostNotFoundException()
+    if caller_user_id is not None and row[0] == caller_user_id:
+        return PostVersionMismatchException()
+    return NotYourPostException()
+
+
+_UPDATE_POST = statements.registry.add(
+    'post.update_post',
+    """UPDATE blog_post
+    SET title = :title, body = :body,
+        version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE post_id = :post_id AND user_id = :caller_user_id
+    RETURNING user_id, title, body, version, updated_at""")
+_UPDATE_POST_IF_VERSION = statements.registry.add(
+    'post.update_post.if_version',
+    """UPDATE blog_post
+    SET title = :title, body = :body,
+        version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE post_id = :post_id AND user_id = :caller_user_id AND version = :expected_version
+    RETURNING user_id, title, body, version, updated_at""")
+
+
 async def update_post(caller_user_id: int,
                       post_id: int,
                       post_info: PostInfo,
-                      db_connection: AsyncConnection) -> Post:
+                      db_connection: AsyncConnection,
+                      expected_version: Optional[int] = None) -> Post:
     """updates title or body for the post in db.
     title and body are optional. If they are not set, title and body are not updated
+    Ownership is checked by the UPDATE itself, successful update is a single round trip.
     Starts and commits a new transaction.
 
     :param caller_user_id who requested to update post
+    :param expected_version update only if the post still has this version, optimistic concurrency
     :returns Post object if update was successful
     :raises PostNotFoundException if post_id is invalid
     :raises NotYourPostException if user_id is wrong
+    :raises PostVersionMismatchException if post has other version than expected_version
     :raises ValidationError if title and body a wrong"""
     async with db_connection.begin():  # start transaction
-        # check that post exists
-        to_update_post = await get_post_by_id_async(post_id, db_connection)
-        if not to_update_post:
-            raise PostNotFoundException()
-        if to_update_post.author_id != caller_user_id:
-            raise NotYourPostException()
         try:
-            statement = text("""UPDATE blog_post
-                                    SET title = :title, body = :body
-                                    WHERE post_id = :post_id
-                                    RETURNING user_id, title, body""")
             params = {'title': post_info.title,
                       'body': post_info.body,
-                      'post_id': to_update_post.post_id}
+                      'post_id': post_id,
+                      'caller_user_id': caller_user_id}
+            statement = _UPDATE_POST
+            if expected_version is not None:
+                statement = _UPDATE_POST_IF_VERSION
+                params['expected_version'] = expected_version
             result = await db_connection.execute(statement, parameters=params)
             row = result.fetchone()
-        except IntegrityError as ie:
-            logger.exception('Should I retry?')
-            raise ie
         except Exception:
             logger.exception('Unknown DB query error')
             raise UnknownException
         else:
             if row is None:
-                raise PostNotFoundException()
+                raise await _not_changed_reason(post_id, db_connection,
+                                                caller_user_id if expected_version is not None else None)
             else:
-                caller_user_id, title, body = row
-                return Post(post_id=post_id, author_id=caller_user_id,
-                            post_info=PostInfo(title=title,
-                                               body=body))
+                user_id, title, body, version, updated_at = row
+                updated_post = _post_from_row((post_id, user_id, title, body))
+                post_version = PostVersion(version=version, updated_at=updated_at)
+    # transaction is committed, refresh cache
+    post_cache.put(post_id, (updated_post, post_version))
+    return updated_post
+
+
+_DELETE_POST = statements.registry.add(
+    'post.delete_post',
+    """DELETE FROM blog_post
+    WHERE post_id = :post_id AND user_id = :caller_user_id""")
 
 
 async def delete_post_async(caller_user_id: int, post_id: int, db_connection: AsyncConnection):
     """Delete post by post_id. Note, that all post posts will be deleted with CASCADE.
+    Ownership is checked by the DELETE itself, successful delete is a single round trip.
     Starts and commits a new transaction.
 
     :raises PostNotFoundException if nothing is deleted from database
     :raises NotYourPostException if user_id is wrong"""
     async with db_connection.begin():
-        to_delete_post = await get_post_by_id_async(post_id, db_connection)
-        if not to_delete_post:
-            raise PostNotFoundException()
-        if to_delete_post.author_id != caller_user_id:
-            raise NotYourPostException()
         try:
-            statement = text("""DELETE FROM
-                blog_post
-                WHERE post_id = :post_id""")
-            params = {'post_id': post_id}
-            result: LegacyCursorResult = await db_connection.execute(statement, params)
+            params = {'post_id': post_id, 'caller_user_id': caller_user_id}
+            result: LegacyCursorResult = await db_connection.execute(_DELETE_POST, params)
             deleted_rows: int = result.rowcount
         except Exception as e:
             logger.exception('Deleting post_id={} failed. Probably should retry.', post_id)
             raise UnknownException(e)
         else:
             if deleted_rows == 0:
-                raise PostNotFoundException()
+                raise await _not_changed_reason(post_id, db_connection)
             if deleted_rows > 1:
                 logger.error(f'Many posts with post_id={post_id} were deleted')
+    # transaction is committed
+    post_cache.invalidate(post_id)
+
+
+_POST_OWNERS = statements.registry.add(
+    'post.post_owners',
+    """SELECT post_id, user_id FROM blog_post WHERE post_id IN :post_ids""",
+    bindparam('post_ids', expanding=True))
+
+
+async def _post_owners(post_ids: list[int], db_connection: AsyncConnection) -> dict[int, int]:
+    """:returns post_id -> user_id for existing posts"""
+    result = await db_connection.execute(_POST_OWNERS, parameters={'post_ids': post_ids})
+    return {post_id: user_id for post_id, user_id in result.fetchall()}
+
+
+def _not_changed_reasons(post_ids: list[int], owners: dict[int, int]) -> dict[int, Exception]:
+    """:returns post_id -> PostNotFoundException or NotYourPostException for posts that were not changed"""
+    return {post_id: PostNotFoundException() if post_id not in owners else NotYourPostException()
+            for post_id in post_ids}
+
+
+def _rows_parameters(db_connection: AsyncConnection, **columns: list) -> dict:
+    """parameters of the batch statements below, one statement for any number of rows:
+    column name -> array of its values for unnest on postgres, JSON list of rows for json_each on sqlite"""
+    if db_connection.dialect.name == 'sqlite':
+        return {'rows': json.dumps(list(zip(*columns.values())))}
+    return columns
+
+
+# dialect name -> statement, parameters are built by _rows_parameters
+_INSERT_POSTS = {
+    'postgresql': statements.registry.add(
+        'post.insert_posts.postgres',
+        """INSERT INTO blog_post(user_id, title, body)
+        SELECT user_id, title, body
+        FROM unnest(CAST(:user_ids AS INT[]), CAST(:titles AS VARCHAR[]), CAST(:bodies AS VARCHAR[]))
+            AS new_posts(user_id, title, body)
+        RETURNING post_id, user_id, title, body""",
+        dialect='postgresql'),
+    # sqlite stand-in for tests
+    'sqlite': statements.registry.add(
+        'post.insert_posts.sqlite',
+        """INSERT INTO blog_post(user_id, title, body)
+        SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]'), json_extract(value, '$[2]')
+        FROM json_each(:rows)
+        RETURNING post_id, user_id, title, body""",
+        dialect='sqlite')}
+
+
+async def _insert_posts(new_posts: list[tuple[int, PostInfo]], db_connection: AsyncConnection) -> list[Post]:
+    """inserts (user_id, post_info) pairs with a single INSERT.
+    Starts and commits a new transaction.
+
+    :returns created posts in the order of new_posts
+    :raises IntegrityError if any of user_ids is not found, nothing is created"""
+    params = _rows_parameters(db_connection,
+                              user_ids=[user_id for user_id, _ in new_posts],
+                              titles=[post_info.title for _, post_info in new_posts],
+                              bodies=[post_info.body for _, post_info in new_posts])
+    async with db_connection.begin():
+        # neither the order of RETURNING nor the order of post_ids is guaranteed to follow the input,
+        # each row is matched to its input by its own values
+        result = await db_connection.execute(_INSERT_POSTS[db_connection.dialect.name], parameters=params)
+        rows = result.fetchall()
+    # (user_id, title, body) -> post_ids, posts with the same values are interchangeable
+    post_ids: dict[tuple[int, str, str], list[int]] = {}
+    for post_id, user_id, title, body in sorted(rows, reverse=True):
+        post_ids.setdefault((user_id, title, body), []).append(post_id)
+    # transaction is committed, lists of posts read before are not shared with later reads
+    for post_id, *_ in rows:
+        post_cache.invalidate(post_id)
+    return [Post(post_id=post_ids[user_id, post_info.title, post_info.body].pop(), author_id=user_id,
+                 post_info=post_info)
+            for user_id, post_info in new_posts]
+
+
+async def create_posts(user_id: int, post_infos: list[PostInfo], db_connection: AsyncConnection) -> list[Post]:
+    """creates many posts with a single INSERT.
+    Starts and commits a new transaction.
+
+    :returns created posts in the order of post_infos
+    :raises NoSuchUseridException if user_id is not found in system, nothing is created"""
+    if not post_infos:
+        return []
+    try:
+        created_posts = await _insert_posts([(user_id, post_info) for post_info in post_infos], db_connection)
+    except IntegrityError:
+        logger.debug('No user with id={} ', user_id)
+        raise NoSuchUseridException()
+    logger.debug('{} posts for user_id={} are created', len(created_posts), user_id)
+    return created_posts
+
+
+async def _write_posts(connect: Connect, new_posts: list[tuple[int, PostInfo]]) -> list[Union[Post, Exception]]:
+    """writes a batch of post_writer in one transaction. If it fails, e.g. an author was deleted meanwhile,
+    posts are created one by one, so that only the callers of the failed posts get the exception"""
+    async with connect() as db_connection:
+        try:
+            return await _insert_posts(new_posts, db_connection)
+        except IntegrityError:
+            logger.debug('Batch of {} posts failed, creating them one by one', len(new_posts))
+        results = []
+        for user_id, post_info in new_posts:
+            try:
+                results.append(await create_post(user_id, post_info, db_connection))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+# posts of create_post_write_behind_async, per connect function
+post_writer = GroupCommitQueue(_write_posts,
+                               max_batch_size=post_write_settings.POST_WRITE_BEHIND_MAX_BATCH_SIZE,
+                               max_delay_seconds=post_write_settings.POST_WRITE_BEHIND_MAX_DELAY_SECONDS)
+
+
+async def create_post_write_behind_async(user_id: int, post_info: PostInfo, connect: Connect) -> Post:
+    """create_post, but the post is inserted by post_writer, together with the posts of concurrent calls.
+    Returns after the transaction with the post is committed.
+
+    :raises NoSuchUseridException if user_id is not found in system"""
+    return await post_writer.submit(connect, (user_id, post_info))
+
+
+_UPDATE_POSTS_SET = """
+    UPDATE blog_post
+    SET title = new_values.title, body = new_values.body,
+        version = blog_post.version + 1, updated_at = CURRENT_TIMESTAMP
+    FROM new_values
+    WHERE blog_post.post_id = new_values.post_id AND blog_post.user_id = :caller_user_id
+    RETURNING blog_post.post_id, blog_post.user_id, blog_post.title, blog_post.body,
+        blog_post.version, blog_post.updated_at"""
+# dialect name -> statement, parameters are built by _rows_parameters
+_UPDATE_POSTS = {
+    'postgresql': statements.registry.add(
+        'post.update_posts.postgres',
+        """WITH new_values(post_id, title, body) AS (
+            SELECT * FROM unnest(CAST(:post_ids AS INT[]), CAST(:titles AS VARCHAR[]), CAST(:bodies AS VARCHAR[])))"""
+        + _UPDATE_POSTS_SET,
+        dialect='postgresql'),
+    # sqlite stand-in for tests
+    'sqlite': statements.registry.add(
+        'post.update_posts.sqlite',
+        """WITH new_values(post_id, title, body) AS (
+            SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]'), json_extract(value, '$[2]')
+            FROM json_each(:rows))"""
+        + _UPDATE_POSTS_SET,
+        dialect='sqlite')}
+
+
+async def update_posts(caller_user_id: int,
+                       post_updates: list[PostUpdate],
+                       db_connection: AsyncConnection) -> dict[int, Union[Post, Exception]]:
+    """updates many posts of caller_user_id with a single UPDATE.
+    Posts of other users and missing posts are not updated, other updates are committed.
+    Starts and commits a new transaction.
+
+    :returns post_id -> updated Post, PostNotFoundException or NotYourPostException
+    :raises ValueError if post_id is repeated"""
+    if len({post_update.post_id for post_update in post_updates}) != len(post_updates):
+        raise ValueError('post_id is repeated')
+    if not post_updates:
+        return {}
+    params = _rows_parameters(db_connection,
+                              post_ids=[post_update.post_id for post_update in post_updates],
+                              titles=[post_update.post_info.title for post_update in post_updates],
+                              bodies=[post_update.post_info.body for post_update in post_updates])
+    params['caller_user_id'] = caller_user_id
+    async with db_connection.begin():
+        try:
+            result = await db_connection.execute(_UPDATE_POSTS[db_connection.dialect.name], parameters=params)
+            rows = result.fetchall()
+            updated_posts = {row[0]: _post_from_row(row[:4]) for row in rows}
+            post_versions = {row[0]: PostVersion(version=row[4], updated_at=row[5]) for row in rows}
+        except Exception as e:
+            logger.exception('Unknown DB query error')
+            raise UnknownException(e)
+        not_updated = [post_update.post_id for post_update in post_updates
+                       if post_update.post_id not in updated_posts]
+        if not_updated:
+            owners = await _post_owners(not_updated, db_connection)
+    # transaction is committed, refresh cache
+    for post_id, updated_post in updated_posts.items():
+        post_cache.put(post_id, (updated_post, post_versions[post_id]))
+    results: dict[int, Union[Post, Exception]] = dict(updated_posts)
+    if not_updated:
+        results.update(_not_changed_reasons(not_updated, owners))
+    return results
+
+
+_DELETE_POSTS = statements.registry.add(
+    'post.delete_posts',
+    """DELETE FROM blog_post
+    WHERE post_id IN :post_ids AND user_id = :caller_user_id
+    RETURNING post_id""",
+    bindparam('post_ids', expanding=True))
+
+
+async def delete_posts(caller_user_id: int,
+                       post_ids: list[int],
+                       db_connection: AsyncConnection) -> dict[int, Optional[Exception]]:
+    """deletes many posts of caller_user_id with a single DELETE.
+    Posts of other users and missing posts are not deleted, other deletes are committed.
+    Starts and commits a new transaction.
+
+    :returns post_id -> None if deleted, PostNotFoundException or NotYourPostException"""
+    post_ids = list(dict.fromkeys(post_ids))
+    if not post_ids:
+        return {}
+    async with db_connection.begin():
+        try:
+            result = await db_connection.execute(_DELETE_POSTS,
+                                                 parameters={'post_ids': post_ids, 'caller_user_id': caller_user_id})
+            deleted = {post_id for post_id, in result.fetchall()}
+        except Exception as e:
+            logger.exception('Unknown DB query error')
+            raise UnknownException(e)
+        not_deleted = [post_id for post_id in post_ids if post_id not in deleted]
+        if not_deleted:
+            owners = await _post_owners(not_deleted, db_connection)
+    # transaction is committed
+    for post_id in deleted:
+        post_cache.invalidate(post_id)
+    results: dict[int, Optional[Exception]] = {post_id: None for post_id in deleted}
+    if not_deleted:
+        results.update(_not_changed_reasons(not_deleted, owners))
+    return results
@@ -0,0 +1,45 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+from pydantic import BaseModel
+
+
+class SingleFlightStats(BaseModel):
+    calls: int
+    # calls which waited for the result of a call already in flight
+    shared: int
+    in_flight: int
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one execution and its result or exception.
+    The execution runs in its own task: a cancelled caller does not cancel it for the others.
+    Results are not kept after the execution ends, it is not a cache."""
+
+    def __init__(self):
+        # (event loop, key) -> task
+        self._tasks: dict[tuple[asyncio.AbstractEventLoop, Hashable], asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        """:returns result of call(), or of the call with the same key already in flight"""
+        self.calls += 1
+        task_key = (asyncio.get_running_loop(), key)
+        task = self._tasks.get(task_key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self._tasks[task_key] = task
+            task.add_done_callback(lambda done_task: self._forget(task_key, done_task))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, task_key, task: asyncio.Task):
+        if self._tasks.get(task_key) is task:
+            del self._tasks[task_key]
+        if not task.cancelled():
+            task.exception()  # retrieved, even if all callers were cancelled
+
+    def stats(self) -> SingleFlightStats:
+        return SingleFlightStats(calls=self.calls, shared=self.shared, in_flight=len(self._tasks))
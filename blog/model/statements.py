@@ -0,0 +1,78 @@
+"""SQL statements of the model layer, built once on import instead of on every call.
+
+text() parses the bind parameters of its SQL string, which costs more than the rest of the statement
+preparation on the client. A statement built once is compiled once per dialect by SQLAlchemy,
+its compiled form is found in the compiled cache of the engine by the cache key of the statement.
+On asyncpg connections the compiled SQL is prepared on the server on the first execution
+and kept prepared by the adapter, see PSQL_STATEMENT_CACHE_SIZE.
+Nothing is prepared ahead, errors in the SQL are found by the database on the first execution of a statement."""
+from typing import Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.elements import BindParameter, TextClause
+from pydantic import BaseModel
+
+
+class StatementRegistryStats(BaseModel):
+    statements: int
+    # executions on engines passed to count_compiled_cache which found their compiled form in the cache,
+    # misses are compiled, e.g. the first execution of a statement or statements built on every call
+    compiled_cache_hits: int
+    compiled_cache_misses: int
+
+
+class StatementRegistry:
+    """named statements, added by the model modules on import"""
+
+    def __init__(self):
+        self._statements: dict[str, TextClause] = {}
+        # statement name -> name of the only dialect it is executed on
+        self._dialects: dict[str, str] = {}
+        self.compiled_cache_hits = 0
+        self.compiled_cache_misses = 0
+
+    def add(self, name: str, sql: str, *bindparams: BindParameter, dialect: Optional[str] = None) -> TextClause:
+        """builds statement once, e.g. _GET_POST = registry.add('post.get_post', 'SELECT ...')
+        :param bindparams e.g. bindparam('post_ids', expanding=True) for IN lists
+        :param dialect name, e.g. 'sqlite', if the statement is executed only on this dialect
+        :raises ValueError if name is already added"""
+        if name in self._statements:
+            raise ValueError(f'statement {name} is already added')
+        statement = text(sql)
+        if bindparams:
+            statement = statement.bindparams(*bindparams)
+        self._statements[name] = statement
+        if dialect is not None:
+            self._dialects[name] = dialect
+        return statement
+
+    def __getitem__(self, name: str) -> TextClause:
+        return self._statements[name]
+
+    def __len__(self) -> int:
+        return len(self._statements)
+
+    def names(self, dialect_name: str) -> list[str]:
+        """names of the statements executed on the dialect, e.g. to count the statements prepared per connection"""
+        return [name for name in self._statements if self._dialects.get(name, dialect_name) == dialect_name]
+
+    def count_compiled_cache(self, engine: Engine):
+        """counts compiled cache hits and misses of engine, pass AsyncEngine.sync_engine for async engines"""
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is None:
+            return
+        if context.cache_hit is conn.dialect.CACHE_HIT:
+            self.compiled_cache_hits += 1
+        elif context.cache_hit is conn.dialect.CACHE_MISS:
+            self.compiled_cache_misses += 1
+
+    def stats(self) -> StatementRegistryStats:
+        return StatementRegistryStats(statements=len(self._statements),
+                                      compiled_cache_hits=self.compiled_cache_hits,
+                                      compiled_cache_misses=self.compiled_cache_misses)
+
+
+registry = StatementRegistry()
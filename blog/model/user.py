@@ -1,16 +1,18 @@
 import asyncio
-from typing import Optional
+import time
+from typing import Optional, AsyncIterator
 
-from retry import retry
+import asyncpg
 from sqlalchemy.exc import IntegrityError
 import sqlalchemy.engine
 from pydantic import BaseModel, Field, EmailStr
-from sqlalchemy import text
-from sqlalchemy.engine import Connection, Result, CursorResult
+from sqlalchemy import bindparam
+from sqlalchemy.engine import Result, CursorResult
 from sqlalchemy.ext.asyncio import AsyncConnection
 from loguru import logger
 
-from blog.model.auth.user_password import hash_password
+from blog.model import statements
+from blog.model.auth.user_password import hash_password_async, hash_passwords_in_processes
 
 
 class UserInfo(BaseModel):
@@ -28,58 +30,147 @@ class User(BaseModel):
     password_hash: str = Field(..., min_length=1, max_length=100)
 
 
+def user_info_row_to_dict(row: sqlalchemy.engine.Row) -> dict:
+    """(user_id, username, name, surname, email, password_hash) row to a dict,
+    which is serialized to the same JSON as UserInfo"""
+    _, username, name, surname, email, _ = row
+    return {'username': username, 'email': email, 'name': name, 'surname': surname}
+
+
+def _user_info_from_row(row: sqlalchemy.engine.Row) -> UserInfo:
+    """UserInfo from a (username, name, surname, email) row without validation"""
+    username, name, surname, email = row
+    return UserInfo.construct(username=username,
+                              name=name,
+                              surname=surname,
+                              email=email)
+
+
+def _user_from_row(row: sqlalchemy.engine.Row) -> User:
+    """User from a (user_id, username, name, surname, email, password_hash) row without validation.
+    Columns are already checked by the DB schema and by validation of the data that was written."""
+    user_id, username, name, surname, email, password_hash = row
+    return User.construct(user_id=user_id,
+                          user_info=_user_info_from_row((username, name, surname, email)),
+                          password_hash=password_hash)
+
+
+_GET_ALL_USERS_ROWS = statements.registry.add(
+    'user.get_all_users_rows',
+    """SELECT user_id, username, name, surname, email, password_hash
+    FROM blog_user
+    ORDER BY user_id
+    LIMIT :limit OFFSET :skip""")
+
+
+async def get_all_users_rows_async(db_connection: AsyncConnection, skip: int = 0, limit: int = 10 ** 6,
+                                   TIMEOUT=1.0) -> list[sqlalchemy.engine.Row]:
+    """Same as get_all_users_async, but returns (user_id, username, name, surname, email, password_hash) rows
+    without validation.
+    Starts and commits a new transaction.
+    :raises asyncio.TimeoutError
+    """
+    params = {'skip': skip, 'limit': limit}
+    async with db_connection.begin():  # within transaction
+        result: Result = await asyncio.wait_for(db_connection.execute(_GET_ALL_USERS_ROWS, parameters=params),
+                                                timeout=TIMEOUT)
+        return result.all()
+
+
 async def get_all_users_async(db_connection: AsyncConnection, skip: int = 0, limit: int = 10 ** 6,
                               TIMEOUT=1.0) -> list[User]:
     """return 'limit' number users starting from 'skip'
     Starts and commits a new transaction.
     :raises asyncio.TimeoutError
     """
-    users = []
-    statement = text("""SELECT
-        user_id, username, name, surname, email, password_hash
+    return [_user_from_row(row) for row in await get_all_users_rows_async(db_connection, skip, limit, TIMEOUT)]
+
+
+_GET_USERS_AFTER_ROWS = statements.registry.add(
+    'user.get_users_after_rows',
+    """SELECT user_id, username, name, surname, email, password_hash
     FROM blog_user
-    LIMIT :limit OFFSET :skip""")
-    params = {'skip': skip, 'limit': limit}
+    WHERE user_id > :after_user_id
+    ORDER BY user_id
+    LIMIT :limit""")
+
+
+async def get_users_after_rows_async(db_connection: AsyncConnection, after_user_id: int = 0, limit: int = 10,
+                                     TIMEOUT=1.0) -> list[sqlalchemy.engine.Row]:
+    """Same as get_users_after_async, but returns (user_id, username, name, surname, email, password_hash) rows
+    without validation.
+    Starts and commits a new transaction.
+    :raises asyncio.TimeoutError
+    """
+    params = {'after_user_id': after_user_id, 'limit': limit}
     async with db_connection.begin():  # within transaction
-        result: Result = await asyncio.wait_for(db_connection.execute(statement, parameters=params),
+        result: Result = await asyncio.wait_for(db_connection.execute(_GET_USERS_AFTER_ROWS, parameters=params),
                                                 timeout=TIMEOUT)
-        rows = result.all()
-        for user_id, username, name, surname, email, password_hash in rows:
-            users.append(User(user_id=user_id,
-                              user_info=UserInfo(username=username,
-                                                 name=name,
-                                                 surname=surname,
-                                                 email=email),
-                              password_hash=password_hash))
-    return users
-
-
-def get_user_by_id(user_id: int, db_connection: Connection) -> Optional[User]:
+        return result.all()
+
+
+async def get_users_after_async(db_connection: AsyncConnection, after_user_id: int = 0, limit: int = 10,
+                                TIMEOUT=1.0) -> list[User]:
+    """return 'limit' users with user_id > after_user_id, ordered by user_id.
+    Keyset pagination: uses primary key index seek, so deep pages cost the same as the first one.
+    Starts and commits a new transaction.
+    :raises asyncio.TimeoutError
+    """
+    return [_user_from_row(row)
+            for row in await get_users_after_rows_async(db_connection, after_user_id, limit, TIMEOUT)]
+
+
+_STREAM_ALL_USERS = statements.registry.add(
+    'user.stream_all_users',
+    """SELECT user_id, username, name, surname, email, password_hash
+    FROM blog_user
+    ORDER BY user_id""")
+
+
+async def stream_all_users_async(db_connection: AsyncConnection,
+                                 batch_size: int = 1000) -> AsyncIterator[list[User]]:
+    """Yields all users ordered by user_id in batches of batch_size.
+    Rows are read through server side cursor, so memory usage does not depend on the table size.
+    Starts a new transaction, which is committed when all batches are consumed.
+    """
+    async with db_connection.begin():  # within transaction
+        result = await db_connection.stream(_STREAM_ALL_USERS)
+        async for rows in result.partitions(batch_size):
+            yield [_user_from_row(row) for row in rows]
+
+
+_GET_USER_BY_ID = statements.registry.add(
+    'user.get_user_by_id',
+    """SELECT user_id, username, name, surname, email, password_hash
+    FROM blog_user
+    WHERE user_id = :user_id""")
+
+
+async def get_user_by_id_async(user_id: int, db_connection: AsyncConnection) -> Optional[User]:
     """find user by his id
     Starts and commits a new transaction.
 
     :returns User object, if user is found in database
     :returns None if user is not found"""
+    async with db_connection.begin():  # within transaction
+        try:
+            params = {'user_id': user_id}
+            result = await db_connection.execute(_GET_USER_BY_ID, parameters=params)
+            rows = result.fetchall()
+        except Exception:
+            logger.exception('Unknown DB query error')
+            return None
+        else:
+            for row in rows:
+                return _user_from_row(row)
+            return None
 
-    try:
-        statement = text(
-            """SELECT user_id, username, name, surname, email, password_hash
-            FROM blog_user
-            WHERE user_id = :user_id""")
-        params = {'user_id': user_id}
-        with db_connection.begin():  # within transaction
-            rows = db_connection.execute(statement, **params).fetchall()
-    except Exception:
-        logger.exception('Unknown DB query error')
-        return None
-    else:
-        for user_id, username, name, surname, email, password_hash in rows:
-            return User(user_id=user_id,
-                        user_info=UserInfo(username=username,
-                                           name=name,
-                                           surname=surname,
-                                           email=email),
-                        password_hash=password_hash)
+
+_GET_USER_BY_USERNAME = statements.registry.add(
+    'user.get_user_by_username',
+    """SELECT user_id, username, name, surname, email, password_hash
+    FROM blog_user
+    WHERE username = :username""")
 
 
 async def get_user_by_username(username: str, db_connection: AsyncConnection) -> Optional[User]:
@@ -90,24 +181,15 @@ async def get_user_by_username(username: str, db_connection: AsyncConnection) ->
     :returns None if user is not found"""
     async with db_connection.begin():  # within transaction
         try:
-            statement = text("""SELECT
-                                    user_id, username, name, surname, email, password_hash
-                                FROM blog_user
-                                WHERE username = :username""")
             params = {'username': username}
-            result = await db_connection.execute(statement, parameters=params)
+            result = await db_connection.execute(_GET_USER_BY_USERNAME, parameters=params)
             rows = result.fetchall()
         except Exception:
             logger.exception('Unknown DB query error')
             return None
         else:
-            for user_id, username, name, surname, email, password_hash in rows:
-                return User(user_id=user_id,
-                            user_info=UserInfo(username=username,
-                                               name=name,
-                                               surname=surname,
-                                               email=email),
-                            password_hash=password_hash)
+            for row in rows:
+                return _user_from_row(row)
             return None
 
 
@@ -124,26 +206,32 @@ class UserCreationData(BaseModel):
     user_info: UserInfo
 
 
-def create_user(db_connection: Connection,
-                create_user_data: UserCreationData) -> User:
+_CREATE_USER = statements.registry.add(
+    'user.create_user',
+    """INSERT INTO blog_user(username, email, password_hash, name, surname)
+    VALUES (:username, :email, :password_hash, :name, :surname)
+    RETURNING user_id""")
+
+
+async def create_user_async(db_connection: AsyncConnection,
+                            create_user_data: UserCreationData) -> User:
     """adds new user to the database.
     If email is already in db, raises exception, saves hashed password
+    Password is hashed in executor before the transaction is started.
     Starts and commits a new transaction.
 
     :raises DuplicateUserCreationException if user with such name and surname exists already
     :raises UnknownException if smth went wrong while creating the user"""
-    with db_connection.begin():  # within transaction
+    user_info = create_user_data.user_info
+    password_hash = await hash_password_async(create_user_data.password)
+    async with db_connection.begin():  # within transaction
         try:
-            user_info = create_user_data.user_info
-            password_hash = hash_password(create_user_data.password)
-            statement = text("""INSERT INTO blog_user(username, email, password_hash, name, surname)
-                                VALUES (:username, :email, :password_hash, :name, :surname)
-                                RETURNING user_id""")
             params = {'username': user_info.username, 'email': user_info.email,
                       'name': user_info.name,
                       'surname': user_info.surname,
                       'password_hash': password_hash}
-            row: sqlalchemy.engine.Row = db_connection.execute(statement, params).fetchone()
+            result = await db_connection.execute(_CREATE_USER, parameters=params)
+            row: sqlalchemy.engine.Row = result.fetchone()
             user_id = row[0]
         except IntegrityError as ie:
             raise DuplicateUserCreationException(str(ie))
@@ -158,30 +246,34 @@ class UserNotFoundException(Exception):
     pass
 
 
-@retry(exceptions=IntegrityError)
-def update_user_info(db_connection: Connection,
-                     user_id: int,
-                     user_info: UserInfo) -> UserInfo:
+_UPDATE_USER_INFO = statements.registry.add(
+    'user.update_user_info',
+    """UPDATE blog_user
+    SET
+        username = :username,
+        name = :name,
+        surname = :surname,
+        email = :email
+    WHERE user_id = :user_id
+    RETURNING username, name, surname, email""")
+
+
+async def update_user_info_async(db_connection: AsyncConnection,
+                                 user_id: int,
+                                 user_info: UserInfo) -> UserInfo:
     """Updates user info in database.
     Starts and commits a new transaction.
     :returns User object if update was successful
     :raises UserNotFoundException if user_id is invalid"""
-    with db_connection.begin():  # start transaction
+    async with db_connection.begin():  # start transaction
         try:
-            statement = text("""UPDATE blog_user
-                                SET
-                                    username = :username,
-                                    name = :name,
-                                    surname = :surname,
-                                    email = :email
-                                WHERE user_id = :user_id
-                                RETURNING username, name, surname, email""")
             params = {'username': user_info.username,
                       'name': user_info.name,
                       'surname': user_info.surname,
                       'email': user_info.email,
                       'user_id': user_id}
-            row = db_connection.execute(statement, params).fetchone()
+            result = await db_connection.execute(_UPDATE_USER_INFO, parameters=params)
+            row = result.fetchone()
         except Exception:
             logger.exception('Unknown DB query error')
             raise UnknownException()
@@ -189,23 +281,23 @@ def update_user_info(db_connection: Connection,
             if row is None:
                 raise UserNotFoundException()
             else:
-                username, name, surname, email = row
-                return UserInfo(username=username,
-                                name=name,
-                                surname=surname,
-                                email=email)
+                return _user_info_from_row(row)
+
 
+_DELETE_USER = statements.registry.add(
+    'user.delete_user',
+    """DELETE FROM blog_user WHERE user_id = :user_id""")
 
-def delete_user(user_id: int, db_connection: Connection):
+
+async def delete_user_async(user_id: int, db_connection: AsyncConnection):
     """Delete user by user_id. Note, that all user posts will be deleted with CASCADE,
     Starts and commits a new transaction.
 
     :raises UserNotFoundException if nothing is deleted from database"""
-    with db_connection.begin():  # within transaction
+    async with db_connection.begin():  # within transaction
         try:
-            statement = text("""DELETE FROM blog_user WHERE user_id = :user_id""")
             params = {'user_id': user_id}
-            result: CursorResult = db_connection.execute(statement, params)
+            result: CursorResult = await db_connection.execute(_DELETE_USER, parameters=params)
             deleted_rows = result.rowcount
         except Exception as e:
             logger.exception('Unknown DB query error')
@@ -215,3 +307,111 @@ def delete_user(user_id: int, db_connection: Connection):
                 raise UserNotFoundException()
             if deleted_rows > 1:
                 logger.error(f'Many users with user_id={user_id} were deleted')
+
+
+class UserImportReport(BaseModel):
+    imported: int
+    # already in database or repeated in the import
+    duplicate_usernames: list[str]
+    # passwords with null bytes
+    rejected_usernames: list[str]
+    seconds: float
+    users_per_second: float
+
+
+_IMPORT_COLUMNS = ['username', 'email', 'password_hash', 'name', 'surname']
+
+
+_EXISTING_USERNAMES = statements.registry.add(
+    'user.existing_usernames',
+    """SELECT username FROM blog_user WHERE username IN :usernames""",
+    bindparam('usernames', expanding=True))
+
+
+async def _existing_usernames(usernames: list[str], db_connection: AsyncConnection) -> set[str]:
+    if not usernames:
+        return set()
+    result = await db_connection.execute(_EXISTING_USERNAMES, parameters={'usernames': usernames})
+    return {username for username, in result.fetchall()}
+
+
+# executemany stand-in for COPY on other drivers than asyncpg, e.g. sqlite in tests
+_INSERT_USERS = statements.registry.add(
+    'user.insert_users',
+    """INSERT INTO blog_user(username, email, password_hash, name, surname)
+    VALUES (:username, :email, :password_hash, :name, :surname)""")
+
+
+async def _copy_users(records: list[tuple], db_connection: AsyncConnection):
+    """loads rows of _IMPORT_COLUMNS into blog_user, using COPY on postgres
+    :raises DuplicateUserCreationException if any of usernames is taken"""
+    if db_connection.dialect.driver == 'asyncpg':
+        raw_connection = await db_connection.get_raw_connection()
+        try:
+            # asyncpg transaction is started by the first statement of SQLAlchemy transaction, COPY must not be first
+            await raw_connection.driver_connection.copy_records_to_table('blog_user',
+                                                                         records=records,
+                                                                         columns=_IMPORT_COLUMNS)
+        except asyncpg.UniqueViolationError as uve:
+            # raw driver call, the error is not wrapped into IntegrityError by SQLAlchemy
+            raise DuplicateUserCreationException(str(uve))
+    else:
+        try:
+            await db_connection.execute(_INSERT_USERS, [dict(zip(_IMPORT_COLUMNS, record)) for record in records])
+        except IntegrityError as ie:
+            raise DuplicateUserCreationException(str(ie))
+
+
+async def import_users_async(db_connection: AsyncConnection,
+                             users_data: list[UserCreationData],
+                             hashing_workers: Optional[int] = None) -> UserImportReport:
+    """adds many users at once. Passwords are hashed in worker processes before the transaction is started,
+    then users are loaded with a single COPY. Duplicate usernames are skipped and reported.
+    Starts and commits two transactions.
+
+    :param hashing_workers number of password hashing processes, CPU count by default
+    :raises DuplicateUserCreationException if username was taken by a concurrent insert, nothing is imported
+    :raises UnknownException if smth went wrong while importing users"""
+    start = time.perf_counter()
+    seen_usernames = set()
+    duplicate_usernames = []
+    rejected_usernames = []
+    to_import = []
+    for user_data in users_data:
+        username = user_data.user_info.username
+        if username in seen_usernames:
+            duplicate_usernames.append(username)
+        elif '\x00' in user_data.password:
+            seen_usernames.add(username)
+            rejected_usernames.append(username)
+        else:
+            seen_usernames.add(username)
+            to_import.append(user_data)
+    # do not hash passwords of users, which are in database already
+    async with db_connection.begin():
+        existing = await _existing_usernames([u.user_info.username for u in to_import], db_connection)
+    duplicate_usernames.extend(u.user_info.username for u in to_import if u.user_info.username in existing)
+    to_import = [u for u in to_import if u.user_info.username not in existing]
+    password_hashes = await hash_passwords_in_processes([u.password for u in to_import], hashing_workers)
+    records = [(u.user_info.username, u.user_info.email, password_hash, u.user_info.name, u.user_info.surname)
+               for u, password_hash in zip(to_import, password_hashes)]
+    async with db_connection.begin():
+        try:
+            # usernames could be taken while passwords were hashed
+            taken = await _existing_usernames([record[0] for record in records], db_connection)
+            duplicate_usernames.extend(record[0] for record in records if record[0] in taken)
+            records = [record for record in records if record[0] not in taken]
+            if records:
+                await _copy_users(records, db_connection)
+        except DuplicateUserCreationException:
+            raise
+        except Exception as e:
+            logger.exception('Unknown DB query error')
+            raise UnknownException(e)
+    seconds = time.perf_counter() - start
+    logger.info('{} users imported in {:.2f}s', len(records), seconds)
+    return UserImportReport(imported=len(records),
+                            duplicate_usernames=duplicate_usernames,
+                            rejected_usernames=rejected_usernames,
+                            seconds=seconds,
+                            users_per_second=len(records) / seconds if seconds > 0 else 0.0)
@@ -0,0 +1,4 @@
+DROP INDEX blog_post_search_vector_idx;
+
+ALTER TABLE blog_post
+DROP COLUMN search_vector;
\ No newline at end of file
@@ -0,0 +1,6 @@
+-- depends: blog_005_add_initial_posts blog_006_authentification
+ALTER TABLE blog_post
+ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', coalesce(title, '') || ' ' || coalesce(body, ''))) STORED;
+
+CREATE INDEX blog_post_search_vector_idx ON blog_post USING GIN (search_vector);
\ No newline at end of file
@@ -0,0 +1 @@
+DROP INDEX blog_post_user_id_post_id_idx;
\ No newline at end of file
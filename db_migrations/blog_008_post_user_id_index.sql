@@ -0,0 +1,2 @@
+-- depends: blog_007_post_full_text_search
+CREATE INDEX blog_post_user_id_post_id_idx ON blog_post (user_id, post_id);
\ No newline at end of file
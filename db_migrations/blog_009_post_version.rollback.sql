@@ -0,0 +1,3 @@
+ALTER TABLE blog_post
+    DROP COLUMN version,
+    DROP COLUMN updated_at;
\ No newline at end of file
@@ -0,0 +1,4 @@
+-- depends: blog_008_post_user_id_index
+ALTER TABLE blog_post
+    ADD COLUMN version INTEGER NOT NULL DEFAULT 1,
+    ADD COLUMN updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
\ No newline at end of file
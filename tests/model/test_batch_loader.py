@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from blog.model.batch_loader import BatchLoader
+
+
+def _recording_loader():
+    batches = []
+
+    async def load_batch(source, keys):
+        batches.append((source, keys))
+        await asyncio.sleep(0.01)
+        if 'bad' in keys:
+            raise ValueError('failed')
+        return {key: key * 10 for key in keys if key != 4}
+    return BatchLoader(load_batch, max_batch_size=3), batches
+
+
+@pytest.mark.asyncio
+async def test_same_iteration_loads_are_batched():
+    loader, batches = _recording_loader()
+    results = await asyncio.gather(loader.load('a', 1), loader.load('a', 2), loader.load('a', 2),
+                                   loader.load_many('a', [3, 4]), loader.load('b', 1))
+    assert results == [10, 20, 20, {3: 30, 4: None}, 10]
+    assert batches == [('a', [1, 2, 3]), ('a', [4]), ('b', [1])]
+    assert loader.stats().dict() == {'loads': 6, 'batches': 3, 'keys_per_batch': 2.0}
+    # next iteration starts a new batch
+    assert await loader.load('a', 1) == 10
+    assert len(batches) == 4
+
+
+@pytest.mark.asyncio
+async def test_exception_goes_to_callers_of_the_batch():
+    loader, _ = _recording_loader()
+    results = await asyncio.gather(loader.load('a', 'bad'), loader.load('a', 1), loader.load('b', 1),
+                                   return_exceptions=True)
+    assert isinstance(results[0], ValueError) and isinstance(results[1], ValueError)
+    assert results[2] == 10
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_batch():
+    loader, _ = _recording_loader()
+    first = asyncio.ensure_future(loader.load('a', 1))
+    second = asyncio.ensure_future(loader.load('a', 1))
+    await asyncio.sleep(0.001)
+    first.cancel()
+    assert await second == 10
+    assert first.cancelled()
@@ -0,0 +1,72 @@
+from blog.model.cache import LRUTTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_hit_and_miss():
+    cache = LRUTTLCache(max_size=2, ttl_seconds=10)
+    assert cache.get(1) is None
+    cache.put(1, 'one')
+    assert cache.get(1) == 'one'
+    stats = cache.stats()
+    assert stats.hits == 1 and stats.misses == 1 and stats.size == 1
+
+
+def test_least_recently_used_is_evicted():
+    cache = LRUTTLCache(max_size=2, ttl_seconds=10)
+    cache.put(1, 'one')
+    cache.put(2, 'two')
+    cache.get(1)
+    cache.put(3, 'three')
+    assert cache.get(2) is None
+    assert cache.get(1) == 'one' and cache.get(3) == 'three'
+    assert cache.stats().evictions == 1
+
+
+def test_entry_expires():
+    clock = FakeClock()
+    cache = LRUTTLCache(max_size=2, ttl_seconds=10, clock=clock)
+    cache.put(1, 'one')
+    clock.now = 9.0
+    assert cache.get(1) == 'one'
+    clock.now = 10.0
+    assert cache.get(1) is None
+    assert cache.stats().size == 0
+
+
+def test_entry_ttl_override():
+    clock = FakeClock()
+    cache = LRUTTLCache(max_size=2, ttl_seconds=10, clock=clock)
+    cache.put(1, 'one', ttl_seconds=1)
+    clock.now = 1.0
+    assert cache.get(1) is None
+
+
+def test_read_before_write_is_not_cached():
+    cache = LRUTTLCache(max_size=2, ttl_seconds=10)
+    generation = cache.generation(1)
+    cache.put(1, 'written')
+    assert not cache.put(1, 'read before the write', generation=generation)
+    assert cache.get(1) == 'written'
+    generation = cache.generation(1)
+    cache.invalidate(1)
+    assert not cache.put(1, 'read before the invalidation', generation=generation)
+    assert cache.get(1) is None
+    assert cache.put(1, 'read after the invalidation', generation=cache.generation(1))
+    generation = cache.generation(2)
+    cache.clear()
+    assert not cache.put(2, 'read before the clear', generation=generation)
+
+
+def test_generations_of_forgotten_keys_change():
+    cache = LRUTTLCache(max_size=1, ttl_seconds=10)
+    generation = cache.generation(1)
+    cache.invalidate(1)
+    cache.invalidate(2)  # forgets the write of key 1
+    assert cache.generation(1) != generation
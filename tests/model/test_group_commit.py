@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from blog.model.group_commit import GroupCommitQueue
+
+
+def _recording_queue(max_batch_size=3, max_delay_seconds=0.01):
+    batches = []
+
+    async def write_batch(source, items):
+        batches.append((source, items))
+        await asyncio.sleep(0.001)
+        if 'fail batch' in items:
+            raise ValueError('batch failed')
+        return [ValueError(item) if item == 'bad' else item.upper() for item in items]
+    return GroupCommitQueue(write_batch, max_batch_size=max_batch_size, max_delay_seconds=max_delay_seconds), batches
+
+
+@pytest.mark.asyncio
+async def test_concurrent_items_are_written_in_batches():
+    queue, batches = _recording_queue()
+    results = await asyncio.gather(*(queue.submit('a', item) for item in ('x', 'y', 'z', 'w')), queue.submit('b', 'v'))
+    assert results == ['X', 'Y', 'Z', 'W', 'V']
+    assert sorted(batches) == [('a', ['w']), ('a', ['x', 'y', 'z']), ('b', ['v'])]
+    assert queue.stats().dict() == {'items': 5, 'batches': 3, 'items_per_batch': 5 / 3, 'queued': 0}
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_errors_go_to_their_callers():
+    queue, _ = _recording_queue()
+    results = await asyncio.gather(queue.submit('a', 'x'), queue.submit('a', 'bad'), queue.submit('b', 'fail batch'),
+                                   return_exceptions=True)
+    assert results[0] == 'X'
+    assert isinstance(results[1], ValueError) and str(results[1]) == 'bad'
+    assert isinstance(results[2], ValueError) and str(results[2]) == 'batch failed'
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_batch_is_written_after_delay():
+    queue, batches = _recording_queue(max_batch_size=100, max_delay_seconds=0.05)
+    start = asyncio.get_running_loop().time()
+    assert await queue.submit('a', 'x') == 'X'
+    assert 0.05 <= asyncio.get_running_loop().time() - start < 0.5
+
+
+@pytest.mark.asyncio
+async def test_close_writes_queued_items():
+    queue, batches = _recording_queue(max_delay_seconds=10)
+    submitted = asyncio.ensure_future(queue.submit('a', 'x'))
+    await asyncio.sleep(0.001)
+    await queue.close()
+    assert await submitted == 'X'
+    assert queue.stats().queued == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_write():
+    queue, batches = _recording_queue()
+    submitted = asyncio.ensure_future(queue.submit('a', 'x'))
+    await asyncio.sleep(0.001)
+    submitted.cancel()
+    assert await queue.submit('a', 'y') == 'Y'
+    assert batches == [('a', ['x', 'y'])]
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_write_does_not_leave_callers_waiting():
+    writing = asyncio.Event()
+
+    async def write_batch(source, items):
+        if items == ['slow']:
+            writing.set()
+            await asyncio.sleep(10)
+        return [item.upper() for item in items]
+    queue = GroupCommitQueue(write_batch, max_batch_size=1, max_delay_seconds=0)
+    callers = [asyncio.ensure_future(queue.submit('a', item)) for item in ('slow', 'queued')]
+    await writing.wait()
+    queue._writers[asyncio.get_running_loop(), 'a'].task.cancel()
+    results = await asyncio.wait_for(asyncio.gather(*callers, return_exceptions=True), 1)
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
+    assert await queue.submit('a', 'next') == 'NEXT'  # by a new writer
+    await queue.close()
@@ -0,0 +1,15 @@
+import pytest
+
+from blog.model import pagination
+
+
+def test_cursor_roundtrip():
+    cursor = pagination.encode_cursor(42)
+    assert pagination.decode_cursor(cursor) == [42]
+
+
+def test_bad_cursor():
+    with pytest.raises(pagination.BadCursorException):
+        pagination.decode_cursor('not a cursor')
+    with pytest.raises(pagination.BadCursorException):
+        pagination.decode_cursor(pagination.encode_cursor(1, 2), keys_count=1)
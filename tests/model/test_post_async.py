@@ -1,3 +1,6 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 import pytest
 import pytest_asyncio
 from sqlalchemy import text
@@ -10,7 +13,9 @@ CREATE_POST_TABLE = """
         post_id INTEGER NOT NULL PRIMARY KEY,
         user_id INTEGER,
         title VARCHAR(200),
-        body VARCHAR(100000));"""
+        body VARCHAR(100000),
+        version INTEGER NOT NULL DEFAULT 1,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP);"""
 
 
 @pytest_asyncio.fixture
@@ -41,6 +46,14 @@ async def three_posts_inmemory_table_connection(empty_inmemory_table_connection)
     return empty_inmemory_table_connection
 
 
+def _connect(db_connection: AsyncConnection) -> post.Connect:
+    """connect function which returns the same connection"""
+    @asynccontextmanager
+    async def connect():
+        yield db_connection
+    return connect
+
+
 @pytest.mark.asyncio
 async def test_get_post_by_post_id_async(three_posts_inmemory_table_connection: AsyncConnection):
     first_post = await post.get_post_by_id_async(1, three_posts_inmemory_table_connection)
@@ -108,3 +121,295 @@ async def test_create_new_post(empty_inmemory_table_connection):
                                       post_info=post.PostInfo(title='Life is going well', body='For me'),
                                       db_connection=empty_inmemory_table_connection)
     assert new_post.post_id == 1
+
+
+@pytest.mark.asyncio
+async def test_get_posts_after(three_posts_inmemory_table_connection):
+    first_page = await post.get_posts_after_async(three_posts_inmemory_table_connection, limit=2)
+    assert [p.post_id for p in first_page] == [1, 2]
+    second_page = await post.get_posts_after_async(three_posts_inmemory_table_connection,
+                                                   after_post_id=first_page[-1].post_id, limit=2)
+    assert [p.post_id for p in second_page] == [3]
+
+
+@pytest.mark.asyncio
+async def test_stream_all_posts(three_posts_inmemory_table_connection):
+    batches = [batch async for batch in post.stream_all_posts_async(three_posts_inmemory_table_connection,
+                                                                    batch_size=2)]
+    assert [[p.post_id for p in batch] for batch in batches] == [[1, 2], [3]]
+
+
+@pytest.mark.asyncio
+async def test_cached_post_is_refreshed_on_update(three_posts_inmemory_table_connection):
+    post.post_cache.clear()
+    stale_version = post.PostVersion(version=1, updated_at='2022-01-01T00:00:00')
+    post.post_cache.put(1, (post.Post(post_id=1, author_id=1, post_info=post.PostInfo(title='Stale', body='')),
+                            stale_version))
+    await post.update_post(1, 1,
+                           post.PostInfo(title='Updated_title', body='Updated_body'),
+                           three_posts_inmemory_table_connection)
+    cached_post = await post.get_post_by_id_cached_async(1, _connect(three_posts_inmemory_table_connection))
+    assert cached_post.post_info.title == 'Updated_title'
+    await post.delete_post_async(1, 1, three_posts_inmemory_table_connection)
+    assert await post.get_post_by_id_cached_async(1, _connect(three_posts_inmemory_table_connection)) is None
+
+
+@pytest.mark.asyncio
+async def test_read_started_before_write_is_not_cached(three_posts_inmemory_table_connection):
+    post.post_cache.clear()
+    old_post = await post.get_post_with_version_async(1, three_posts_inmemory_table_connection)
+    generation = post.post_cache.generation(1)
+    updated_post = await post.update_post(1, 1, post.PostInfo(title='Updated_title', body=''),
+                                          three_posts_inmemory_table_connection)
+    post._fill_post_cache(1, old_post, generation)
+    assert post.post_cache.get(1)[0] == updated_post
+    generation = post.post_cache.generation(1)
+    await post.delete_post_async(1, 1, three_posts_inmemory_table_connection)
+    post._fill_post_cache(1, old_post, generation)
+    assert post.post_cache.get(1) is None
+
+
+@pytest.mark.asyncio
+async def test_posts_read_from_replica_are_not_cached(three_posts_inmemory_table_connection):
+    post.post_cache.clear()
+    replica_connect = _connect(three_posts_inmemory_table_connection)
+    post.lagging_connects.add(replica_connect)
+    try:
+        assert await post.get_post_by_id_cached_async(1, replica_connect) is not None
+    finally:
+        post.lagging_connects.discard(replica_connect)
+    assert post.post_cache.get(1) is None
+
+
+@pytest.mark.asyncio
+async def test_fresh_reads_skip_cached_posts(three_posts_inmemory_table_connection):
+    post.post_cache.clear()
+    stale_post = post.Post(post_id=1, author_id=1, post_info=post.PostInfo(title='Stale', body=''))
+    post.post_cache.put(1, (stale_post, post.PostVersion(version=0, updated_at='2022-01-01T00:00:00')))
+    fresh_connect = _connect(three_posts_inmemory_table_connection)
+    post.fresh_connects.add(fresh_connect)
+    try:
+        found = await post.get_post_by_id_cached_async(1, fresh_connect)
+        found_many = await post.get_posts_cached_async([1], fresh_connect)
+    finally:
+        post.fresh_connects.discard(fresh_connect)
+    assert found.post_info.title == found_many[0].post_info.title != 'Stale'
+
+
+@pytest.mark.asyncio
+async def test_create_posts(empty_inmemory_table_connection):
+    created_posts = await post.create_posts(user_id=1,
+                                            post_infos=[post.PostInfo(title='First', body=''),
+                                                        post.PostInfo(title='Second', body='')],
+                                            db_connection=empty_inmemory_table_connection)
+    assert [(p.post_id, p.post_info.title) for p in created_posts] == [(1, 'First'), (2, 'Second')]
+    post_infos = [post.PostInfo(title=title, body='') for title in ('Third', 'Same', 'Fourth', 'Same')]
+    created_posts = await post.create_posts(1, post_infos, empty_inmemory_table_connection)
+    assert [p.post_info for p in created_posts] == post_infos
+    assert sorted(created_posts, key=lambda p: p.post_id) == await post.get_all_posts_async(
+        empty_inmemory_table_connection, skip=2)
+
+
+@pytest.mark.asyncio
+async def test_update_posts(three_posts_inmemory_table_connection):
+    post_info = post.PostInfo(title='Updated_title', body='Updated_body')
+    results = await post.update_posts(2,
+                                      [post.PostUpdate(post_id=post_id, post_info=post_info) for post_id in (1, 2, 4)],
+                                      three_posts_inmemory_table_connection)
+    assert isinstance(results[1], post.NotYourPostException)
+    assert results[2].post_info.title == 'Updated_title'
+    assert isinstance(results[4], post.PostNotFoundException)
+    with pytest.raises(ValueError):
+        await post.update_posts(2,
+                                [post.PostUpdate(post_id=2, post_info=post_info)] * 2,
+                                three_posts_inmemory_table_connection)
+
+
+@pytest.mark.asyncio
+async def test_delete_posts(three_posts_inmemory_table_connection):
+    results = await post.delete_posts(2, [1, 2, 3, 4], three_posts_inmemory_table_connection)
+    assert isinstance(results[1], post.NotYourPostException)
+    assert results[2] is None and results[3] is None
+    assert isinstance(results[4], post.PostNotFoundException)
+    remaining_posts = await post.get_all_posts_async(three_posts_inmemory_table_connection)
+    assert [p.post_id for p in remaining_posts] == [1]
+
+
+CREATE_POST_SEARCH_TABLE = """
+    CREATE VIRTUAL TABLE blog_post_search USING fts5(title, body, content='blog_post', content_rowid='post_id');"""
+
+
+@pytest_asyncio.fixture
+async def searchable_posts_connection(three_posts_inmemory_table_connection) -> AsyncConnection:
+    """sqlite FTS5 stand-in for postgres search_vector"""
+    async with three_posts_inmemory_table_connection.begin():
+        await three_posts_inmemory_table_connection.execute(text(CREATE_POST_SEARCH_TABLE))
+        await three_posts_inmemory_table_connection.execute(text("""
+            INSERT INTO blog_post_search(rowid, title, body) SELECT post_id, title, body FROM blog_post"""))
+    return three_posts_inmemory_table_connection
+
+
+@pytest.mark.asyncio
+async def test_search_posts(searchable_posts_connection):
+    found = await post.search_posts_async(searchable_posts_connection, 'order')
+    assert sorted(found_post.post_id for found_post, _ in found) == [2, 3]
+    found = await post.search_posts_async(searchable_posts_connection, 'migrations "work')
+    assert [found_post.post_id for found_post, _ in found] == [1]
+    assert await post.search_posts_async(searchable_posts_connection, '!!!') == []
+
+
+@pytest.mark.asyncio
+async def test_search_posts_pages(searchable_posts_connection):
+    first_page = await post.search_posts_async(searchable_posts_connection, 'order', limit=1)
+    last_post, last_rank = first_page[-1]
+    second_page = await post.search_posts_async(searchable_posts_connection, 'order',
+                                                after_rank=last_rank, after_post_id=last_post.post_id, limit=1)
+    assert len(second_page) == 1 and second_page[0][0].post_id != last_post.post_id
+
+
+@pytest.mark.asyncio
+async def test_get_user_posts(three_posts_inmemory_table_connection):
+    user_posts = await post.get_user_posts_async(three_posts_inmemory_table_connection, user_id=2, limit=1)
+    assert [p.post_id for p in user_posts] == [2]
+    user_posts = await post.get_user_posts_async(three_posts_inmemory_table_connection, user_id=2,
+                                                 after_post_id=2, limit=1)
+    assert [p.post_id for p in user_posts] == [3]
+
+
+@pytest.mark.asyncio
+async def test_get_page_versions(three_posts_inmemory_table_connection):
+    connection = three_posts_inmemory_table_connection
+    assert await post.get_page_versions_async(connection, limit=2, skip=1) == [(2, 1), (3, 1)]
+    assert await post.get_page_versions_async(connection, limit=2, after_post_id=2) == [(3, 1)]
+    assert await post.get_page_versions_async(connection, limit=2, user_id=2) == [(2, 1), (3, 1)]
+    await post.update_post(2, 3, post.PostInfo(title='Order #2', body='Edited'), connection)
+    assert await post.get_page_versions_async(connection, limit=2, user_id=2) == [(2, 1), (3, 2)]
+
+
+@pytest.mark.asyncio
+async def test_post_row_to_dict(three_posts_inmemory_table_connection):
+    rows = await post.get_all_posts_rows_async(three_posts_inmemory_table_connection)
+    posts = await post.get_all_posts_async(three_posts_inmemory_table_connection)
+    assert [post.post_row_to_dict(row) for row in rows] == [p.dict() for p in posts]
+    assert list(post.post_row_to_dict(rows[0])) == list(posts[0].dict())
+
+
+@pytest.mark.asyncio
+async def test_post_from_row_matches_validated(three_posts_inmemory_table_connection):
+    rows = await post.get_all_posts_rows_async(three_posts_inmemory_table_connection)
+    for post_id, user_id, title, body in rows:
+        validated = post.Post(post_id=post_id, author_id=user_id, post_info=post.PostInfo(title=title, body=body))
+        assert post._post_from_row((post_id, user_id, title, body)) == validated
+
+
+@pytest.mark.asyncio
+async def test_update_post_increments_version(three_posts_inmemory_table_connection):
+    post.post_cache.clear()
+    _, first_version = await post.get_post_with_version_async(1, three_posts_inmemory_table_connection)
+    await post.update_post(1, 1, post.PostInfo(title='Updated_title', body=''), three_posts_inmemory_table_connection,
+                           expected_version=first_version.version)
+    second_version = await post.get_post_version_async(1, _connect(three_posts_inmemory_table_connection))
+    assert second_version.version == first_version.version + 1
+    with pytest.raises(post.PostVersionMismatchException):
+        await post.update_post(1, 1, post.PostInfo(title='Lost update', body=''), three_posts_inmemory_table_connection,
+                               expected_version=first_version.version)
+    with pytest.raises(post.NotYourPostException):
+        await post.update_post(2, 1, post.PostInfo(title='Not mine', body=''), three_posts_inmemory_table_connection,
+                               expected_version=second_version.version)
+    found_post, found_version = await post.get_post_with_version_async(1, three_posts_inmemory_table_connection)
+    assert found_post.post_info.title == 'Updated_title' and found_version == second_version
+
+
+@pytest.mark.asyncio
+async def test_concurrent_reads_share_query(three_posts_inmemory_table_connection):
+    post.post_cache.clear()
+    connect = _connect(three_posts_inmemory_table_connection)
+    shared_before = post.single_flight.shared
+    # one shared connection, so the two kinds of reads run one after another
+    found = await asyncio.gather(*(post.get_post_with_version_cached_async(2, connect) for _ in range(5)))
+    pages = await asyncio.gather(*(post.get_all_posts_coalesced_async(connect, limit=2) for _ in range(5)))
+    assert post.single_flight.shared - shared_before == 8
+    assert all(result == found[0] for result in found)
+    with pytest.raises(TypeError):
+        found[0][0].post_info.title = 'Changed by one of the callers'
+    assert [p.post_id for p in pages[0]] == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_read_after_write_does_not_join_read_before_it(three_posts_inmemory_table_connection):
+    post.post_cache.clear()
+    one_at_a_time = asyncio.Lock()
+
+    @asynccontextmanager
+    async def connect():
+        async with one_at_a_time:
+            yield three_posts_inmemory_table_connection
+    shared_before = post.single_flight.shared
+    before_write = asyncio.ensure_future(post.get_post_version_async(1, connect))
+    await asyncio.sleep(0)  # the read is in flight
+    post.post_cache.invalidate(1)
+    after_write = asyncio.ensure_future(post.get_post_version_async(1, connect))
+    await asyncio.gather(before_write, after_write)
+    assert post.single_flight.shared == shared_before
+
+
+@pytest.mark.asyncio
+async def test_is_post_cached_does_not_count(three_posts_inmemory_table_connection):
+    post.post_cache.clear()
+    connect = _connect(three_posts_inmemory_table_connection)
+    misses = post.post_cache.misses
+    assert not post.is_post_cached(1, connect) and post.post_cache.misses == misses
+    await post.get_post_with_version_cached_async(1, connect)
+    hits = post.post_cache.hits
+    assert post.is_post_cached(1, connect) and post.post_cache.hits == hits
+    post.fresh_connects.add(connect)
+    try:
+        assert not post.is_post_cached(1, connect)
+    finally:
+        post.fresh_connects.discard(connect)
+
+
+@pytest.mark.asyncio
+async def test_get_posts_cached_async_reads_misses_in_one_query(three_posts_inmemory_table_connection):
+    post.post_cache.clear()
+    connect = _connect(three_posts_inmemory_table_connection)
+    await post.get_post_by_id_cached_async(2, connect)
+    batches_before = post.post_loader.batches
+    found = await post.get_posts_cached_async([3, 99, 2, 1, 3], connect)
+    assert [p.post_id for p in found] == [3, 2, 1]
+    assert post.post_loader.batches - batches_before == 1
+    assert post.post_cache.get(3)[0] == found[0]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_lookups_of_different_posts_share_query(three_posts_inmemory_table_connection):
+    post.post_cache.clear()
+    connect = _connect(three_posts_inmemory_table_connection)
+    batches_before = post.post_loader.batches
+    found = await asyncio.gather(*(post.get_post_by_id_cached_async(post_id, connect) for post_id in (1, 2, 3, 4)))
+    assert [p.post_id if p else None for p in found] == [1, 2, 3, None]
+    assert post.post_loader.batches - batches_before == 1
+
+
+@pytest.mark.asyncio
+async def test_write_behind_posts_share_transaction(empty_inmemory_table_connection):
+    async with empty_inmemory_table_connection.begin():
+        # stand-in for the foreign key of user_id
+        await empty_inmemory_table_connection.execute(text("""
+            CREATE TRIGGER no_such_user BEFORE INSERT ON blog_post WHEN NEW.user_id = 99
+            BEGIN SELECT RAISE(ABORT, 'no such user'); END"""))
+    connect = _connect(empty_inmemory_table_connection)
+    batches_before = post.post_writer.batches
+    created = await asyncio.gather(*(post.create_post_write_behind_async(user_id, post.PostInfo(title='t', body=''),
+                                                                         connect)
+                                     for user_id in (1, 2, 3)))
+    assert post.post_writer.batches - batches_before == 1
+
+    results = await asyncio.gather(*(post.create_post_write_behind_async(user_id, post.PostInfo(title='t', body=''),
+                                                                         connect)
+                                     for user_id in (1, 99, 2)), return_exceptions=True)
+    assert isinstance(results[1], post.NoSuchUseridException)
+    # each caller got the post_id of the row with its own user_id
+    written = {p.post_id: p.author_id for p in await post.get_all_posts_async(empty_inmemory_table_connection)}
+    assert written == {p.post_id: user_id for p, user_id in zip(created + [results[0], results[2]], (1, 2, 3, 1, 2))}
+    await post.post_writer.close()
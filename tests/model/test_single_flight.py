@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from blog.model.single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_result():
+    single_flight = SingleFlight()
+    executions = 0
+
+    async def call():
+        nonlocal executions
+        executions += 1
+        await asyncio.sleep(0.01)
+        return executions
+
+    assert await asyncio.gather(*(single_flight.do('key', call) for _ in range(10))) == [1] * 10
+    assert await single_flight.do('key', call) == 2  # result is not kept
+    assert single_flight.stats().dict() == {'calls': 11, 'shared': 9, 'in_flight': 0}
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_others():
+    single_flight = SingleFlight()
+    started = asyncio.Event()
+
+    async def call():
+        started.set()
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    first = asyncio.ensure_future(single_flight.do('key', call))
+    await started.wait()
+    second = asyncio.ensure_future(single_flight.do('key', call))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == 'result'
+    assert first.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_exception_is_shared():
+    single_flight = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.01)
+        raise ValueError('failed')
+
+    results = await asyncio.gather(*(single_flight.do('key', call) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
@@ -0,0 +1,41 @@
+import pytest
+from sqlalchemy import bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from blog.model import post, statements, user
+
+
+def test_add_rejects_taken_name():
+    registry = statements.StatementRegistry()
+    registry.add('post.get', 'SELECT 1')
+    with pytest.raises(ValueError):
+        registry.add('post.get', 'SELECT 2')
+
+
+def test_model_statements_compile_for_both_dialects():
+    assert post and user  # statements are added on import
+    postgres_names = statements.registry.names('postgresql')
+    sqlite_names = statements.registry.names('sqlite')
+    # statements of the other dialect are not executed, nor prepared
+    for name in ('post.search_posts', 'post.insert_posts', 'post.update_posts'):
+        assert f'{name}.postgres' in postgres_names and f'{name}.sqlite' not in postgres_names
+        assert f'{name}.sqlite' in sqlite_names and f'{name}.postgres' not in sqlite_names
+    assert len(postgres_names) == len(sqlite_names) < len(statements.registry)
+    for dialect, names in ((postgresql.asyncpg.dialect(), postgres_names), (sqlite.dialect(), sqlite_names)):
+        for name in names:
+            statements.registry[name].compile(dialect=dialect)
+
+
+@pytest.mark.asyncio
+async def test_registered_statement_is_compiled_once():
+    registry = statements.StatementRegistry()
+    select_in = registry.add('select_in', 'SELECT :value IN :values', bindparam('values', expanding=True))
+    engine = create_async_engine('sqlite+aiosqlite://')
+    registry.count_compiled_cache(engine.sync_engine)
+    async with engine.connect() as connection:
+        for values in ([1, 2], [3], [1, 2]):
+            result = await connection.execute(select_in, parameters={'value': 1, 'values': values})
+            assert result.scalar() == (1 in values)
+    await engine.dispose()
+    assert (registry.stats().compiled_cache_hits, registry.stats().compiled_cache_misses) == (2, 1)
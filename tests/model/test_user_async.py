@@ -1,8 +1,12 @@
+from types import SimpleNamespace
+
+import asyncpg
 import pytest
 import pytest_asyncio
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
 import blog.model.user as user
+from blog.model.auth import user_password
 
 CREATE_USER_TABLE = """CREATE TABLE blog_user(
                 user_id INTEGER PRIMARY KEY,
@@ -57,3 +61,109 @@ async def test_all_users_async(three_users_inmemory_table_connection_async):
 async def test_get_by_name(three_users_inmemory_table_connection_async):
     found_user = await user.get_user_by_username('renatyv', three_users_inmemory_table_connection_async)
     assert found_user.user_info.email == 'renatyv@gmail.com'
+
+
+@pytest.mark.asyncio
+async def test_get_users_after_async(three_users_inmemory_table_connection_async):
+    users = await user.get_users_after_async(three_users_inmemory_table_connection_async, after_user_id=1, limit=10)
+    assert [u.user_id for u in users] == [2, 3]
+
+
+@pytest.mark.asyncio
+async def test_stream_all_users(three_users_inmemory_table_connection_async):
+    batches = [batch async for batch in user.stream_all_users_async(three_users_inmemory_table_connection_async,
+                                                                    batch_size=2)]
+    assert [len(batch) for batch in batches] == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_get_user_by_id_async(three_users_inmemory_table_connection_async):
+    found_user = await user.get_user_by_id_async(2, three_users_inmemory_table_connection_async)
+    assert found_user.user_info.username == 'maratyv'
+    assert await user.get_user_by_id_async(100, three_users_inmemory_table_connection_async) is None
+
+
+@pytest.mark.asyncio
+async def test_create_new_user_async(empty_inmemory_table_connection_async):
+    new_user_info = user.UserInfo(username='maratyv',
+                                  email='maratyv@gmail.com',
+                                  name='Marat',
+                                  surname='Iuldashev')
+    user_creation_data = user.UserCreationData(password='maratyv', user_info=new_user_info)
+    created_user = await user.create_user_async(empty_inmemory_table_connection_async, user_creation_data)
+    found_user = await user.get_user_by_id_async(created_user.user_id, empty_inmemory_table_connection_async)
+    assert found_user == created_user
+    with pytest.raises(user.DuplicateUserCreationException):
+        await user.create_user_async(empty_inmemory_table_connection_async, user_creation_data)
+
+
+@pytest.mark.asyncio
+async def test_update_user_async(three_users_inmemory_table_connection_async):
+    new_user_info = user.UserInfo(username='renatyv',
+                                  email='renatyv@gmail.com',
+                                  name='Renat',
+                                  surname='iuldashev')
+    await user.update_user_info_async(three_users_inmemory_table_connection_async,
+                                      user_id=1,
+                                      user_info=new_user_info)
+    updated_user = await user.get_user_by_id_async(1, three_users_inmemory_table_connection_async)
+    assert updated_user.user_info.surname == new_user_info.surname
+    with pytest.raises(user.UserNotFoundException):
+        await user.update_user_info_async(three_users_inmemory_table_connection_async,
+                                          user_id=100,
+                                          user_info=new_user_info)
+
+
+@pytest.mark.asyncio
+async def test_delete_user_async(three_users_inmemory_table_connection_async):
+    await user.delete_user_async(1, three_users_inmemory_table_connection_async)
+    assert await user.get_user_by_id_async(1, three_users_inmemory_table_connection_async) is None
+    with pytest.raises(user.UserNotFoundException):
+        await user.delete_user_async(1, three_users_inmemory_table_connection_async)
+
+
+@pytest.mark.asyncio
+async def test_import_users_async(three_users_inmemory_table_connection_async):
+    users_data = [user.UserCreationData(password=f'password{i}',
+                                        user_info=user.UserInfo(username=username, email='user@example.com'))
+                  for i, username in enumerate(['new_user', 'renatyv', 'new_user', 'other_user'])]
+    users_data.append(user.UserCreationData(password='pass\x00word', user_info=user.UserInfo(username='nulled')))
+    report = await user.import_users_async(three_users_inmemory_table_connection_async, users_data,
+                                           hashing_workers=2)
+    assert report.imported == 2
+    assert sorted(report.duplicate_usernames) == ['new_user', 'renatyv']
+    assert report.rejected_usernames == ['nulled']
+    imported_user = await user.get_user_by_username('other_user', three_users_inmemory_table_connection_async)
+    assert user_password.verify_password('password3', imported_user.password_hash)
+
+
+@pytest.mark.asyncio
+async def test_import_username_taken_after_check(three_users_inmemory_table_connection_async, monkeypatch):
+    async def nothing_taken_yet(usernames, db_connection):
+        return set()
+    # 'renatyv' is inserted between the check for taken usernames and the load
+    monkeypatch.setattr(user, '_existing_usernames', nothing_taken_yet)
+    users_data = [user.UserCreationData(password='password', user_info=user.UserInfo(username=username))
+                  for username in ('new_user', 'renatyv')]
+    with pytest.raises(user.DuplicateUserCreationException):
+        await user.import_users_async(three_users_inmemory_table_connection_async, users_data, hashing_workers=1)
+    assert await user.get_user_by_username('new_user', three_users_inmemory_table_connection_async) is None
+
+
+class _TakenUsernameDriverConnection:
+    async def copy_records_to_table(self, table_name, records, columns):
+        raise asyncpg.UniqueViolationError('duplicate key value violates unique constraint "blog_user_username_key"')
+
+
+class _AsyncpgConnection:
+    """AsyncConnection of asyncpg dialect as seen by _copy_users"""
+    dialect = SimpleNamespace(driver='asyncpg')
+
+    async def get_raw_connection(self):
+        return SimpleNamespace(driver_connection=_TakenUsernameDriverConnection())
+
+
+@pytest.mark.asyncio
+async def test_copy_of_taken_username_is_duplicate():
+    with pytest.raises(user.DuplicateUserCreationException):
+        await user._copy_users([('renatyv', None, 'hash', None, None)], _AsyncpgConnection())
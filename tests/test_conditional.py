@@ -0,0 +1,62 @@
+import datetime
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from blog.api.v1 import conditional
+
+app = FastAPI()
+app.add_middleware(conditional.ConditionalGetMiddleware, route_paths={'/items', '/items/export'})
+
+
+@app.get('/items')
+async def get_items():
+    return [1, 2, 3]
+
+
+@app.get('/stats')
+async def get_stats():
+    return {'in_flight': 1}
+
+
+@app.get('/items/export')
+async def export_items():
+    return StreamingResponse(iter([b'1\n', b'2\n']))
+
+
+def test_list_page_not_modified():
+    client = TestClient(app)
+    response = client.get('/items')
+    etag = response.headers['etag']
+    not_modified = client.get('/items', headers={'If-None-Match': f'"other", W/{etag}'})
+    assert not_modified.status_code == 304 and not_modified.content == b''
+    assert not_modified.headers['etag'] == etag
+    assert client.get('/items', headers={'If-None-Match': '"other"'}).json() == [1, 2, 3]
+
+
+def test_streamed_response_has_no_etag():
+    response = TestClient(app).get('/items/export')
+    assert response.content == b'1\n2\n' and 'etag' not in response.headers
+
+
+def test_other_routes_have_no_etag():
+    assert 'etag' not in TestClient(app).get('/stats').headers
+
+
+def test_page_etag_changes_with_versions():
+    etag = conditional.page_etag([(1, 1), (2, 1)])
+    assert etag == conditional.page_etag([(1, 1), (2, 1)])
+    assert etag != conditional.page_etag([(1, 1), (2, 2)]) != conditional.page_etag([(1, 1)])
+
+
+def test_post_etag():
+    etag = conditional.post_etag(12, 3)
+    assert conditional.version_from_etag(12, etag) == 3
+    assert conditional.version_from_etag(1, etag) is None
+    assert conditional.version_from_etag(12, '"12.x"') is None
+    assert conditional.etag_matches('*', etag)
+
+
+def test_http_date():
+    assert conditional.http_date(datetime.datetime(2022, 5, 1, 12, 30)) == 'Sun, 01 May 2022 12:30:00 GMT'
@@ -0,0 +1,22 @@
+import json
+
+from hypothesis import given, strategies
+from starlette.responses import JSONResponse
+
+from blog.api.v1 import fast_json
+
+json_values = strategies.recursive(
+    strategies.none() | strategies.booleans() | strategies.integers(-2 ** 63, 2 ** 63 - 1) | strategies.text(),
+    lambda children: strategies.lists(children) | strategies.dictionaries(strategies.text(), children),
+    max_leaves=20)
+
+
+@given(json_values)
+def test_same_bytes_as_json_response(content):
+    assert fast_json.dumps(content) == JSONResponse(content).body
+
+
+def test_fast_json_response():
+    response = fast_json.FastJSONResponse([{'post_id': 1, 'title': 'Привет'}])
+    assert json.loads(response.body) == [{'post_id': 1, 'title': 'Привет'}]
+    assert response.media_type == 'application/json'
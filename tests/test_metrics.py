@@ -0,0 +1,37 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from blog import metrics
+
+app = FastAPI()
+app.add_middleware(metrics.PrometheusMiddleware)
+app.add_route('/metrics', metrics.metrics_endpoint)
+
+
+@app.get('/items/{item_id}')
+async def get_item(item_id: int):
+    return {'item_id': item_id}
+
+
+def _requests_count(route: str, status_code: int) -> float:
+    return metrics.REGISTRY.get_sample_value('http_requests_total', {'method': 'GET', 'route': route,
+                                                                     'status_code': str(status_code)}) or 0
+
+
+def test_requests_are_labeled_by_route_template():
+    client = TestClient(app)
+    before = _requests_count('/items/{item_id}', 200)
+    client.get('/items/1')
+    client.get('/items/2')
+    assert _requests_count('/items/{item_id}', 200) == before + 2
+    before = _requests_count(metrics.UNMATCHED_ROUTE, 404)
+    client.get('/no/such/path')
+    assert _requests_count(metrics.UNMATCHED_ROUTE, 404) == before + 1
+
+
+def test_metrics_endpoint():
+    client = TestClient(app)
+    client.get('/items/1')
+    response = client.get('/metrics')
+    assert response.headers['content-type'] == metrics.CONTENT_TYPE_LATEST
+    assert 'http_request_duration_seconds_bucket{le="0.005",method="GET",route="/items/{item_id}"}' in response.text
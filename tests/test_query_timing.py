@@ -0,0 +1,36 @@
+import pytest
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from blog import metrics
+from blog.dependicies import query_timing
+from blog.model import post
+
+
+def _queries_count(function: str) -> float:
+    return metrics.REGISTRY.get_sample_value('db_query_duration_seconds_count', {'function': function}) or 0
+
+
+@pytest.mark.asyncio
+async def test_statements_are_attributed_to_model_function(monkeypatch):
+    engine = create_async_engine('sqlite+aiosqlite://')
+    query_timing.instrument_engine(engine.sync_engine)
+    monkeypatch.setattr(query_timing.query_timing_settings, 'SLOW_QUERY_SECONDS', 0)
+    messages = []
+    sink_id = logger.add(messages.append, level='WARNING')
+    try:
+        async with engine.connect() as connection:
+            async with connection.begin():
+                await connection.execute(text("""CREATE TABLE blog_post(post_id INTEGER NOT NULL PRIMARY KEY,
+                                                 user_id INTEGER, title VARCHAR(200), body VARCHAR(100000))"""))
+                await connection.execute(text("""INSERT INTO blog_post VALUES (1, 1, 'secret title', 'body')"""))
+            before = _queries_count('blog.model.post.get_posts_after_rows_async')
+            await post.get_posts_after_async(connection, after_post_id=0, limit=987654)
+            assert _queries_count('blog.model.post.get_posts_after_rows_async') == before + 1
+            assert _queries_count(query_timing.UNKNOWN_FUNCTION) >= 2
+    finally:
+        logger.remove(sink_id)
+        await engine.dispose()
+    slow_query_log = [m for m in messages if 'get_posts_after_rows_async' in m]
+    assert slow_query_log and '987654' not in slow_query_log[0] and '(int, int)' in slow_query_log[0]
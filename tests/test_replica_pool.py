@@ -0,0 +1,45 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from blog.dependicies.replica_pool import ReadYourWrites, ReplicaPool
+
+
+async def _named_database(path: str, name: str):
+    engine = create_async_engine(f'sqlite+aiosqlite:///{path}')
+    async with engine.begin() as connection:
+        await connection.execute(text('CREATE TABLE database_name(name VARCHAR(10))'))
+        await connection.execute(text('INSERT INTO database_name VALUES (:name)'), {'name': name})
+    return engine
+
+
+async def _connected_name(replica_pool: ReplicaPool) -> str:
+    connection = await replica_pool.connect()
+    try:
+        return (await connection.execute(text('SELECT name FROM database_name'))).scalar()
+    finally:
+        await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_round_robin_and_fallback(tmp_path):
+    primary = await _named_database(tmp_path / 'primary.db', 'primary')
+    first = await _named_database(tmp_path / 'first.db', 'first')
+    second = await _named_database(tmp_path / 'second.db', 'second')
+    broken = create_async_engine(f'sqlite+aiosqlite:///{tmp_path}/no/such/directory.db')
+    replica_pool = ReplicaPool([first, broken, second], primary, retry_seconds=60)
+    assert [await _connected_name(replica_pool) for _ in range(4)] == ['first', 'second', 'first', 'second']
+    assert replica_pool.healthy_count() == 2
+    assert await _connected_name(ReplicaPool([broken], primary, retry_seconds=60)) == 'primary'
+    for engine in (primary, first, second, broken):
+        await engine.dispose()
+
+
+def test_read_your_writes_by_user_id_and_by_time():
+    read_your_writes = ReadYourWrites(seconds=60, max_users=10)
+    assert not read_your_writes.is_pinned(1)
+    read_primary_until = read_your_writes.pin(1)
+    assert read_your_writes.is_pinned(1)  # Bearer token client without the cookie
+    assert not read_your_writes.is_pinned(2)
+    assert read_your_writes.is_pinned(None, read_primary_until)
+    assert not read_your_writes.is_pinned(None, read_primary_until - 60)
@@ -0,0 +1,77 @@
+import pytest
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.security import OAuth2PasswordRequestForm
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+from starlette import status
+
+from blog.dependicies import throttling
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    buckets = throttling.TokenBucket(capacity=2, rate_per_second=0.5, max_keys=10, clock=clock)
+    assert buckets.try_acquire('a') == 0
+    assert buckets.try_acquire('a') == 0
+    assert buckets.try_acquire('a') == 2.0
+    assert buckets.try_acquire('b') == 0
+    clock.now = 1
+    assert buckets.try_acquire('a') == 1.0
+    clock.now = 2
+    assert buckets.try_acquire('a') == 0
+    assert buckets.try_acquire('a') > 0
+
+
+def test_forgotten_key_has_full_bucket():
+    clock = FakeClock()
+    buckets = throttling.TokenBucket(capacity=1, rate_per_second=1, max_keys=1, clock=clock)
+    assert buckets.try_acquire('a') == 0
+    assert buckets.try_acquire('b') == 0  # evicts a
+    assert buckets.try_acquire('a') == 0
+
+
+def test_retry_after_does_not_take_token():
+    buckets = throttling.TokenBucket(capacity=1, rate_per_second=1, max_keys=10, clock=FakeClock())
+    assert buckets.retry_after('a') == 0
+    assert buckets.try_acquire('a') == 0
+    assert buckets.retry_after('a') == 1.0
+
+
+def test_rate_must_be_positive():
+    with pytest.raises(ValidationError):
+        throttling.LoginThrottlingSettings(LOGIN_RATE_PER_USERNAME_PER_MINUTE=0)
+
+
+login_app = FastAPI()
+
+
+@login_app.post('/token')
+async def token(request: Request,
+                _: None = Depends(throttling.throttle_login),
+                form_data: OAuth2PasswordRequestForm = Depends()):
+    if form_data.password != 'right':
+        throttling.charge_failed_login(request, form_data.username)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    return {}
+
+
+def test_failed_logins_from_other_ip_do_not_lock_user_out(monkeypatch):
+    monkeypatch.setattr(throttling.login_throttling_settings, 'TRUST_X_FORWARDED_FOR', True)
+    monkeypatch.setattr(throttling, 'ip_buckets', throttling.TokenBucket(100, 1, 10, clock=FakeClock()))
+    monkeypatch.setattr(throttling, 'username_buckets', throttling.TokenBucket(2, 1, 10, clock=FakeClock()))
+    client = TestClient(login_app)
+
+    def login(password: str, ip: str) -> int:
+        return client.post('/token', data={'username': 'user1', 'password': password},
+                           headers={'X-Forwarded-For': ip}).status_code
+    assert [login('wrong', '10.0.0.1') for _ in range(3)] == [401, 401, 429]
+    assert [login('right', '10.0.0.2') for _ in range(3)] == [200, 200, 200]
+    assert login('wrong', '10.0.0.2') == 401
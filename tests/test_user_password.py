@@ -1,6 +1,33 @@
+import pytest
+
 import blog.model.auth.user_password as user_password
 
 
 def test_hash_password():
     assert user_password.verify_password('password', user_password.hash_password('password'))
     assert not user_password.verify_password('password', user_password.hash_password('huyassword'))
+
+
+@pytest.mark.asyncio
+async def test_hash_password_async():
+    password_hash = await user_password.hash_password_async('password')
+    assert await user_password.verify_password_async('password', password_hash)
+    assert not await user_password.verify_password_async('huyassword', password_hash)
+
+
+@pytest.mark.asyncio
+async def test_null_in_password_async():
+    with pytest.raises(user_password.NullInPusswordException):
+        await user_password.hash_password_async('pass\x00word')
+
+
+@pytest.mark.asyncio
+async def test_imports_share_process_pool():
+    hashes = await user_password.hash_passwords_in_processes(['first', 'second'], workers=2)
+    assert [user_password.verify_password(p, h) for p, h in zip(['first', 'second'], hashes)] == [True, True]
+    executor = user_password._import_executor
+    with pytest.raises(user_password.NullInPusswordException):
+        await user_password.hash_passwords_in_processes(['pass\x00word'] + ['password'] * 50, workers=2)
+    assert user_password._import_executor is executor
+    user_password.shutdown_executor()
+    assert user_password._import_executor is None
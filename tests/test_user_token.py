@@ -57,3 +57,30 @@ async def test_authenticate_user(three_users_connection_async):
                                                       three_users_connection_async,
                                                       token_settings)
     assert user_token.decode_token_to_user_id(user_2_token, token_settings) == 2
+
+
+def test_decode_token_cached():
+    token_settings = user_token.TokenSettings(JWT_SECRET_KEY='secret key',
+                                              JWT_ENCODE_ALGORITHM='HS256',
+                                              JWT_ACCESS_TOKEN_EXPIRE_MINUTES=30)
+    user_token.verified_token_cache.clear()
+    token = user_token._create_access_token(data={"sub": "5"}, token_settings=token_settings)
+    assert user_token.decode_token_to_user_id_cached(token, token_settings) == 5
+    assert user_token.decode_token_to_user_id_cached(token, token_settings) == 5
+    assert user_token.verified_token_cache.stats().hits == 1
+    other_settings = user_token.TokenSettings(JWT_SECRET_KEY='other key',
+                                              JWT_ENCODE_ALGORITHM='HS256',
+                                              JWT_ACCESS_TOKEN_EXPIRE_MINUTES=30)
+    with pytest.raises(user_token.BadTokenException):
+        user_token.decode_token_to_user_id_cached(token, other_settings)
+
+
+def test_expired_token_is_not_cached():
+    token_settings = user_token.TokenSettings(JWT_SECRET_KEY='secret key',
+                                              JWT_ENCODE_ALGORITHM='HS256',
+                                              JWT_ACCESS_TOKEN_EXPIRE_MINUTES=-1)
+    user_token.verified_token_cache.clear()
+    token = user_token._create_access_token(data={"sub": "5"}, token_settings=token_settings)
+    with pytest.raises(user_token.BadTokenException):
+        user_token.decode_token_to_user_id_cached(token, token_settings)
+    assert user_token.verified_token_cache.stats().size == 0
@@ -83,3 +83,34 @@ def test_create_auth_delete_user():
     response = requests.delete(f'{API_URL}/users',
                                headers={'Authorization': f'Bearer {token}'})
     assert response.status_code == 200
+
+
+def test_get_posts_by_cursor():
+    response = requests.get(f'{API_URL}/posts', params={'limit': 1})
+    assert response.status_code == status.HTTP_200_OK
+    first_post_id = response.json()[0].get('post_id')
+    cursor = response.headers['X-Next-Cursor']
+    response = requests.get(f'{API_URL}/posts', params={'limit': 1, 'cursor': cursor})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()[0].get('post_id') > first_post_id
+
+
+def test_export_posts():
+    response = requests.get(f'{API_URL}/posts/export')
+    assert response.status_code == status.HTTP_200_OK
+    lines = response.text.splitlines()
+    assert len(lines) > 0 and all(line.startswith('{"post_id"') for line in lines)
+
+
+def test_create_delete_posts_batch(authorization_header_userid_2):
+    response = requests.post(f"{API_URL}/posts/batch",
+                             json=[{'title': 'test title 1', 'body': 'test body'},
+                                   {'title': 'test title 2', 'body': 'test body'}],
+                             headers=authorization_header_userid_2)
+    assert response.status_code == status.HTTP_201_CREATED
+    post_ids = [result.get('post_id') for result in response.json()]
+    response = requests.delete(f"{API_URL}/posts/batch",
+                               params={'ids': post_ids},
+                               headers=authorization_header_userid_2)
+    assert response.status_code == status.HTTP_200_OK
+    assert all(result.get('status_code') == status.HTTP_200_OK for result in response.json())